@@ -0,0 +1,5 @@
+import os
+
+# Benchmark runs log to the console only: main.py configures logging on import,
+# and the default log file is the tracked myapp.log
+os.environ.setdefault("LOG_FILE", "")
@@ -0,0 +1,55 @@
+"""
+Compares pages/sec of the pooled browser against one Chromium launch per URL.
+
+Run from the repository root:
+    python -m benchmarks.browser_pool_benchmark --pages 20 --tabs 4
+"""
+import argparse
+import asyncio
+import time
+
+import web_crawler
+from browser_pool import BrowserPool
+from benchmarks.fixture_server import serve_fixtures
+
+
+async def _per_url_launch(urls):
+    for url in urls:
+        await web_crawler.get_page_content(url, retries=1, settle_delay=None)
+
+
+async def _pooled_sequential(urls, tabs):
+    async with BrowserPool(size=tabs) as pool:
+        for url in urls:
+            await web_crawler.get_page_content(url, retries=1, pool=pool, settle_delay=None)
+
+
+async def _pooled_concurrent(urls, tabs):
+    async with BrowserPool(size=tabs) as pool:
+        await asyncio.gather(*(
+            web_crawler.get_page_content(url, retries=1, pool=pool, settle_delay=None)
+            for url in urls
+        ))
+
+
+async def run(page_count, tabs):
+    with serve_fixtures(article_count=page_count) as (base_url, paths):
+        urls = [base_url + path for path in paths]
+        modes = [
+            ("per-URL launch", _per_url_launch(urls)),
+            ("pooled, sequential", _pooled_sequential(urls, tabs)),
+            (f"pooled, {tabs} tabs", _pooled_concurrent(urls, tabs)),
+        ]
+        for name, coro in modes:
+            start = time.perf_counter()
+            await coro
+            elapsed = time.perf_counter() - start
+            print(f"{name:<22} {len(urls) / elapsed:8.2f} pages/sec  ({elapsed:.2f}s for {len(urls)} pages)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--tabs", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args.pages, args.tabs))
@@ -0,0 +1,84 @@
+"""
+Compares utils.truncate_text_by_words with context_packing on multi-megabyte
+inputs: cutting one long text to a budget, and packing a budget from many
+documents (cold, then again with the token counts cached).
+
+Run from the repository root:
+    python -m benchmarks.context_packing_benchmark --sizes 1 4 16 --budget 4000
+    python -m benchmarks.context_packing_benchmark --tokenizer local   # count with the local model's tokenizer
+"""
+import argparse
+import random
+import time
+
+import context_packing
+import utils
+from benchmarks.fixture_server import PARAGRAPH
+
+WORDS = PARAGRAPH.split() + ["sleep", "memory", "hippocampus", "consolidation", "study", "participants", "2019", "Dr."]
+
+
+def _document(size_bytes, seed):
+    """Generated prose of about `size_bytes` characters, in paragraphs of varied sentences."""
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < size_bytes:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = rng.choices(WORDS, k=rng.randint(6, 30))
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _fresh(counter):
+    """A counter with the same tokenizer and an empty cache."""
+    return context_packing.TokenCounter(counter.count_fn, counter.name, counter.cache_size)
+
+
+def run(sizes, budget, documents, repeat):
+    counter = context_packing.get_counter()
+    print(f"Counting with: {counter.name}")
+    # The old function works in words; give it the word count of the same token budget
+    word_limit = int(budget / 1.3)
+    for size in sizes:
+        text = _document(size * 1024 * 1024, seed=size)
+        old_seconds, old = _time(lambda: utils.truncate_text_by_words(text, word_limit), repeat)
+        new_seconds, new = _time(lambda: context_packing.truncate_to_tokens(text, budget, _fresh(counter)), repeat)
+        print(
+            f"truncate {size:3d} MiB: words {old_seconds * 1000:9.1f} ms   tokens {new_seconds * 1000:9.1f} ms   "
+            f"({old_seconds / new_seconds:7.1f}x)   kept {counter.count(new)} tokens, old kept {counter.count(old)}"
+        )
+
+    for size in sizes:
+        docs = [_document(size * 1024 * 1024 // documents, seed=size * 100 + i) for i in range(documents)]
+        fresh = _fresh(counter)
+        cold_seconds, (_, stats) = _time(lambda: context_packing.pack(docs, budget, counter=fresh), 1)
+        warm_seconds, _ = _time(lambda: context_packing.pack(docs, budget, counter=fresh), repeat)
+        print(
+            f"pack     {size:3d} MiB in {documents} documents: cold {cold_seconds * 1000:9.1f} ms   cached {warm_seconds * 1000:9.1f} ms   "
+            f"{stats['selected']}/{stats['passages']} passages, {stats['tokens']} tokens"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16], help="Input sizes in MiB.")
+    parser.add_argument("--budget", type=int, default=4000, help="Token budget.")
+    parser.add_argument("--documents", type=int, default=20, help="Documents the packing input is split into.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tokenizer", choices=["auto", "local", "estimate"], default="auto", help="See CONTEXT_TOKENIZER.")
+    args = parser.parse_args()
+    context_packing.TOKENIZER = args.tokenizer
+    run(args.sizes, args.budget, args.documents, args.repeat)
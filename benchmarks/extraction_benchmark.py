@@ -0,0 +1,76 @@
+"""
+Measures extraction throughput and event-loop lag with and without the
+process-pool ExtractionExecutor.
+
+Run from the repository root:
+    python -m benchmarks.extraction_benchmark --docs 200 --workers 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import web_crawler
+from extraction_executor import ExtractionExecutor
+from benchmarks.fixture_server import make_article_html
+
+PROBE_INTERVAL = 0.01
+
+
+async def _probe_loop_lag(lags, stop):
+    """Sleeps in short steps and records how late the loop wakes us up."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def _measure(name, docs, run):
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe_loop_lag(lags, stop))
+    start = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    lags = lags or [0.0]
+    print(
+        f"{name:<28} {len(docs) / elapsed:8.1f} docs/sec   "
+        f"loop lag p50 {statistics.median(lags) * 1000:7.1f} ms   max {max(lags) * 1000:8.1f} ms"
+    )
+
+
+async def run(doc_count, workers, nlp):
+    docs = [(make_article_html(i), f"http://fixture.local/article/{i}") for i in range(doc_count)]
+
+    async def inline():
+        for html, url in docs:
+            await web_crawler.extract_article_content_with_newspaper(html, url, nlp=nlp)
+
+    await _measure("inline on the event loop", docs, inline)
+
+    async with ExtractionExecutor(max_workers=workers) as executor:
+        # Warm the workers up so process start-up is not counted
+        await executor.extract_many(docs[:workers], nlp=nlp)
+
+        async def pooled_single():
+            await asyncio.gather(*(
+                web_crawler.extract_article_content_with_newspaper(html, url, executor=executor, nlp=nlp)
+                for html, url in docs
+            ))
+
+        async def pooled_batch():
+            await executor.extract_many(docs, nlp=nlp)
+
+        await _measure(f"executor, {workers} workers", docs, pooled_single)
+        await _measure("executor extract_many", docs, pooled_batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--no-nlp", action="store_true", help="Skip newspaper's NLP step")
+    args = parser.parse_args()
+    asyncio.run(run(args.docs, args.workers, not args.no_nlp))
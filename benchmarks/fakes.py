@@ -0,0 +1,113 @@
+"""
+Stand-ins for live services, used by the benchmarks.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+DEFAULT_ANSWER = (
+    "The sources agree on the main points. Several articles describe the background, "
+    "two report recent measurements, and one raises open questions for further study."
+)
+
+
+class FakeChatModel:
+    """
+    Mimics the parts of a LangChain chat model that LLMGateway uses
+    (ainvoke and astream), with configurable latency.
+    """
+
+    def __init__(self, first_token_latency=0.5, per_token_latency=0.02, answer=DEFAULT_ANSWER, prompt_token_latency=0.0):
+        """
+        Args:
+            first_token_latency: Seconds before the first token (prompt processing).
+            per_token_latency: Seconds between subsequent tokens.
+            answer: Text returned for every prompt, split on spaces into tokens,
+                or a function taking the prompt and returning the text.
+            prompt_token_latency: Extra seconds before the first token per prompt word,
+                so long prompts are slower like on a real model.
+        """
+        self.first_token_latency = first_token_latency
+        self.per_token_latency = per_token_latency
+        self.answer = answer
+        self.prompt_token_latency = prompt_token_latency
+        self.calls = 0
+
+    def _prefill_latency(self, messages):
+        words = sum(len(message.content.split()) for message in messages)
+        return self.first_token_latency + self.prompt_token_latency * words
+
+    def _answer(self, messages):
+        return self.answer(messages[-1].content) if callable(self.answer) else self.answer
+
+    @staticmethod
+    def _tokens(answer):
+        words = answer.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        answer = self._answer(messages)
+        tokens = self._tokens(answer)
+        await asyncio.sleep(self._prefill_latency(messages) + self.per_token_latency * (len(tokens) - 1))
+        return SimpleNamespace(content=answer)
+
+    async def astream(self, messages):
+        self.calls += 1
+        answer = self._answer(messages)
+        await asyncio.sleep(self._prefill_latency(messages))
+        for i, token in enumerate(self._tokens(answer)):
+            if i:
+                await asyncio.sleep(self.per_token_latency)
+            yield SimpleNamespace(content=token)
+
+
+class FakeLlama:
+    """
+    Mimics llama_cpp.Llama.create_chat_completion (streaming and not),
+    blocking the calling thread like the real model does.
+    """
+
+    def __init__(self, first_token_latency=0.5, per_token_latency=0.02, answer=DEFAULT_ANSWER):
+        self.first_token_latency = first_token_latency
+        self.per_token_latency = per_token_latency
+        self.answer = answer
+        self.calls = 0
+
+    def create_chat_completion(self, messages, max_tokens=None, stream=False, **kwargs):
+        self.calls += 1
+        if not stream:
+            time.sleep(self.first_token_latency + self.per_token_latency * len(self.answer.split()))
+            return {"choices": [{"message": {"content": self.answer}}]}
+        return self._stream()
+
+    def _stream(self):
+        time.sleep(self.first_token_latency)
+        for i, word in enumerate(self.answer.split(" ")):
+            if i:
+                time.sleep(self.per_token_latency)
+            yield {"choices": [{"delta": {"content": (" " if i else "") + word}}]}
+
+
+class FakeSearchClient:
+    """
+    Mimics google_search_api.SearchClient, answering every query with the
+    same fixed list of links.
+    """
+
+    def __init__(self, links, **kwargs):
+        self.results = [{"title": f"Result {i}", "link": link, "snippet": ""} for i, link in enumerate(links)]
+        self.stats = {"searches": 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def search(self, query, num_results=10):
+        self.stats["searches"] += 1
+        return self.results[:num_results]
+
+    async def search_many(self, queries, num_results=10):
+        return {query: await self.search(query, len(self.results)) for query in queries}
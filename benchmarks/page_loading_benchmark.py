@@ -0,0 +1,118 @@
+"""
+Compares full browser page loads (every request, wait for network idle) with
+lean loads (blocked resources and trackers, ready once the content is stable).
+
+Fixture pages carry images, a web font and a tracking pixel plus script that
+answer slowly, like the ad and analytics hosts real articles pull in. The
+trackers are served from "localhost" and the pages from 127.0.0.1, so the
+lean policy can block them by domain.
+
+Run from the repository root:
+    python -m benchmarks.page_loading_benchmark --pages 10 --tabs 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import page_loading
+from browser_pool import BrowserPool
+from benchmarks.fixture_server import make_article_html, serve_fixtures
+
+IMAGES_PER_PAGE = 8
+IMAGE_BYTES = 150 * 1024
+FONT_BYTES = 80 * 1024
+
+
+def _page_html(index, tracker_base, images, tracker_delay):
+    article = make_article_html(index)
+    assets = "\n".join(f'<img src="/asset/image?n={index}-{i}" width="600">' for i in range(images))
+    trackers = (
+        f'<img src="{tracker_base}/pixel?delay={tracker_delay}&page={index}" width="1" height="1">\n'
+        f'<script async src="{tracker_base}/tag.js?delay={tracker_delay}&page={index}"></script>'
+    )
+    font = '<style>@font-face { font-family: Fixture; src: url("/asset/font"); } body { font-family: Fixture; }</style>'
+    return article.replace("</head>", f"{font}\n</head>").replace("</article>", f"{assets}\n</article>\n{trackers}")
+
+
+def _slow(content_type, body):
+    def respond(params):
+        time.sleep(float(params.get("delay", 0)))
+        return content_type, body
+    return respond
+
+
+async def _load_full(page, url):
+    """The old behaviour: load everything and wait for the network to go idle."""
+    start = time.perf_counter()
+    _, bytes_loaded, requests = await page_loading.load_page_unrestricted(page, url)
+    await page.content()
+    return time.perf_counter() - start, bytes_loaded, requests
+
+
+async def _load_lean(page, url, policy):
+    start = time.perf_counter()
+    load = await page_loading.load_page(page, url, policy)
+    await page.content()
+    return time.perf_counter() - start, load.bytes_loaded, load.requests
+
+
+async def _measure(urls, tabs, load):
+    async with BrowserPool(size=tabs) as pool:
+        async def one(url):
+            async with pool.page() as page:
+                return await load(page, url)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(url) for url in urls))
+        return time.perf_counter() - start, results
+
+
+def _summary(name, elapsed, results):
+    seconds = [r[0] for r in results]
+    bytes_loaded = [r[1] for r in results]
+    print(
+        f"{name:<6} {len(results) / elapsed:6.2f} pages/sec  "
+        f"p50 {statistics.median(seconds):5.2f}s  max {max(seconds):5.2f}s  "
+        f"{statistics.mean(bytes_loaded) / 1024:8.1f} KiB/page  "
+        f"{statistics.mean(r[2] for r in results):5.1f} requests/page"
+    )
+    return statistics.mean(seconds), statistics.mean(bytes_loaded)
+
+
+async def run(page_count, tabs, tracker_delay):
+    routes = {
+        "/asset/image": lambda params: ("image/png", b"\x89PNG" + b"\0" * IMAGE_BYTES),
+        "/asset/font": lambda params: ("font/woff2", b"wOF2" + b"\0" * FONT_BYTES),
+        "/pixel": _slow("image/gif", b"GIF89a" + b"\0" * 43),
+        "/tag.js": _slow("application/javascript", "void 0;"),
+    }
+    pages = {}
+    with serve_fixtures(pages=pages, routes=routes) as (base_url, _):
+        tracker_base = base_url.replace("127.0.0.1", "localhost")
+        for i in range(page_count):
+            pages[f"/article/{i}"] = _page_html(i, tracker_base, IMAGES_PER_PAGE, tracker_delay)
+        urls = [f"{base_url}/article/{i}" for i in range(page_count)]
+        policy = page_loading.InterceptionPolicy(blocked_domains=page_loading.TRACKER_DOMAINS + ["localhost"])
+
+        full_seconds, full_bytes = _summary("full", *await _measure(urls, tabs, _load_full))
+        lean_seconds, lean_bytes = _summary("lean", *await _measure(urls, tabs, lambda page, url: _load_lean(page, url, policy)))
+        print(
+            f"Saved per page: {full_seconds - lean_seconds:.2f}s ({1 - lean_seconds / full_seconds:.0%}), "
+            f"{(full_bytes - lean_bytes) / 1024:.1f} KiB ({1 - lean_bytes / full_bytes:.0%})"
+        )
+        report = page_loading.get_load_report(per_page=True)
+        for page in report.pop("per_page"):
+            print(
+                f"  {page['url']}: {page['seconds']:5.2f}s, {page['bytes_loaded'] / 1024:7.1f} KiB, {page['requests']:3d} requests; "
+                f"saved {page['seconds_saved']:5.2f}s, {page['bytes_saved'] / 1024:7.1f} KiB, {page['requests_saved']:3d} requests"
+            )
+        print(f"Load report: {report}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--tabs", type=int, default=4)
+    parser.add_argument("--tracker-delay", type=float, default=2.0, help="Seconds the fake trackers take to answer.")
+    args = parser.parse_args()
+    asyncio.run(run(args.pages, args.tabs, args.tracker_delay))
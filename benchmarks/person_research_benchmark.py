@@ -0,0 +1,74 @@
+"""
+Measures LLM calls per page and pages per minute of research_person,
+analyzing one page at a time versus several concurrently.
+
+Search and the LLM are replaced by fakes and the pages come from the local
+fixture server, so only fetching, extraction and scheduling are real. The
+fake LLM always confirms the identity; before pages were analyzed in one
+call, every confirmed page took three sequential LLM calls.
+
+Run from the repository root:
+    python -m benchmarks.person_research_benchmark --pages 40 --concurrency 1 4 8
+"""
+import argparse
+import asyncio
+import functools
+import json
+
+import LLM
+import crawl_scheduler
+import google_search_api
+import person_researcher
+from llm_gateway import LLMGateway
+from benchmarks.fakes import FakeChatModel, FakeSearchClient
+from benchmarks.fixture_server import serve_fixtures
+
+ANALYSIS = json.dumps({
+    "is_same_person": True,
+    "reason": "Matches name and context",
+    "new_facts": {},
+    "details": {"occupation": "researcher"},
+    "social_media": {},
+    "urls": [],
+    "keywords": [],
+})
+
+
+async def _run(name, concurrency, minutes):
+    profile = await person_researcher.research_person(
+        {"name": name, "known_for": "fixture articles"},
+        search_duration_minutes=minutes,
+        page_concurrency=concurrency,
+    )
+    return profile["research_stats"]
+
+
+async def run(page_count, concurrencies, minutes):
+    with serve_fixtures(article_count=page_count) as (base_url, paths):
+        links = [base_url + path for path in paths]
+        google_search_api.SearchClient = lambda **kwargs: FakeSearchClient(links)
+        # Every fixture is on one host, so per-domain politeness would serialize the crawl
+        person_researcher.crawl_scheduler.CrawlScheduler = functools.partial(
+            crawl_scheduler.CrawlScheduler, per_domain_concurrency=max(concurrencies), per_domain_interval=0
+        )
+        # One unmeasured run fills the page cache so every setting sees the same fetch cost
+        await _run("Fixture Warmup", max(concurrencies), minutes)
+        for concurrency in concurrencies:
+            stats = await _run(f"Fixture Person {concurrency}", concurrency, minutes)
+            print(
+                f"concurrency {concurrency:2d}: {stats['pages_with_text']:4d} pages  "
+                f"{stats['llm_calls_per_page']:4.2f} LLM calls/page  {stats['pages_per_minute']:8.1f} pages/min"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--first-token-latency", type=float, default=1.0)
+    parser.add_argument("--per-token-latency", type=float, default=0.01)
+    args = parser.parse_args()
+    fake = FakeChatModel(args.first_token_latency, args.per_token_latency, answer=ANALYSIS)
+    LLM.gateway = LLMGateway(api_model=lambda: fake, local_model=lambda: None)
+    asyncio.run(run(args.pages, args.concurrency, args.minutes))
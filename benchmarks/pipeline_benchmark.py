@@ -0,0 +1,396 @@
+"""
+End-to-end benchmark of research_query and research_person on a recorded
+corpus, compared against a stored baseline.
+
+Everything external is replaced by a local stand-in, so runs are
+repeatable and need neither network access nor API keys:
+  - pages come from a local HTTP server replaying saved HTML (a corpus
+    recorded with --record, or generated articles when none is given);
+  - Custom Search requests go to a stub endpoint on the same server that
+    ranks the corpus pages by word overlap with the query;
+  - the LLM is a fake with configurable latency that answers every call
+    site in the shape it expects.
+Fetching, extraction, retrieval, scheduling, the search client and the LLM
+gateway are the real code.
+
+The default corpus is generated deterministically (same pages on every
+machine) and is the replay fixture.
+
+Every run happens in a fresh process with empty caches. The report gives
+runs and pages per minute, p50/p95 seconds per run and per pipeline stage
+(from instrumentation spans) and peak RSS. Timings depend on the machine
+and its installed extractors and models, so the baseline is not part of
+the repository: record it with --save-baseline on the machine that gates
+changes. Any metric worse than it by more than the tolerance is then
+reported as a regression and the exit status is 1; a baseline recorded
+with other settings exits with status 2. Without a baseline the
+comparison is skipped.
+
+Run from the repository root:
+    python -m benchmarks.pipeline_benchmark --save-baseline   # record benchmarks/pipeline_baseline.json
+    python -m benchmarks.pipeline_benchmark                   # compare against it
+    python -m benchmarks.pipeline_benchmark --record benchmarks/corpus URL [URL ...]
+    python -m benchmarks.pipeline_benchmark --corpus benchmarks/corpus
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+import LLM
+import crawl_scheduler
+import google_search_api
+import instrumentation
+import main
+import person_researcher
+from llm_gateway import LLMGateway
+from model_registry import registry
+from benchmarks.fakes import DEFAULT_ANSWER, FakeChatModel
+from benchmarks.fixture_server import serve_fixtures
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "pipeline_baseline.json")
+SEARCH_PATH = "/customsearch/v1"
+
+QUERIES = [
+    "how does sleep affect memory consolidation",
+    "history of the printing press in europe",
+    "how do heat pumps work in cold climates",
+]
+PERSON = "Ada Fixture"
+
+TOPICS = {
+    "sleep": "sleep memory consolidation hippocampus dreams rest brain study participants night",
+    "printing": "printing press europe gutenberg books movable type history century workshop",
+    "heat": "heat pumps cold climates refrigerant compressor efficiency winter homes energy",
+    "person": "Ada Fixture researcher university award publications lecture interview career",
+}
+FILLER = "the of and results show that in a with this from were which these also after during most".split()
+
+ANALYSIS = json.dumps({
+    "is_same_person": True,
+    "reason": "Matches name and context",
+    "new_facts": {},
+    "details": {"occupation": "researcher"},
+    "social_media": {},
+    "urls": [],
+    "keywords": [],
+})
+PROFILE = json.dumps({"name": PERSON, "summary": DEFAULT_ANSWER, "occupation": "researcher", "confidence_score": 80})
+
+# Metrics where a lower value is a regression; for every other metric a higher one is
+HIGHER_IS_BETTER = ("runs_per_minute", "pages_per_minute")
+
+
+def _words(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def generate_corpus(pages_per_topic=15, seed=0):
+    """Builds deterministic article pages for every topic, of varying length."""
+    rng = random.Random(seed)
+    corpus = []
+    for topic, vocabulary in TOPICS.items():
+        terms = vocabulary.split()
+        for i in range(pages_per_topic):
+            paragraphs = []
+            for _ in range(rng.randint(6, 40)):
+                sentences = [
+                    " ".join(rng.choice(terms if rng.random() < 0.4 else FILLER) for _ in range(rng.randint(8, 24))).capitalize() + "."
+                    for _ in range(rng.randint(3, 7))
+                ]
+                paragraphs.append(f"<p>{' '.join(sentences)}</p>")
+            title = f"{' '.join(terms[:3]).title()} {i}"
+            html = (
+                f"<!DOCTYPE html><html><head><title>{title}</title></head><body>"
+                f"<header><nav><a href='/'>Home</a></nav></header>"
+                f"<article><h1>{title}</h1>{''.join(paragraphs)}</article>"
+                f"<footer>Copyright fixture</footer></body></html>"
+            )
+            corpus.append({"path": f"/{topic}/{i}", "title": title, "snippet": " ".join(terms[:8]), "html": html})
+    return corpus
+
+
+def record_corpus(directory, urls):
+    """Fetches live pages once and saves them, with a manifest, as a replayable corpus."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    with httpx.Client(follow_redirects=True, timeout=30, headers={"User-Agent": "Mozilla/5.0"}) as client:
+        for i, url in enumerate(urls):
+            try:
+                response = client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"Skipping {url}: {e}")
+                continue
+            title = re.search(r"<title[^>]*>(.*?)</title>", response.text, re.S | re.I)
+            filename = f"{i}.html"
+            with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+                f.write(response.text)
+            manifest.append({
+                "path": f"/page/{i}",
+                "url": url,
+                "title": title.group(1).strip() if title else url,
+                "snippet": "",
+                "file": filename,
+            })
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Recorded {len(manifest)} of {len(urls)} pages in {directory}")
+
+
+def load_corpus(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    corpus = []
+    for entry in manifest:
+        with open(os.path.join(directory, entry["file"]), encoding="utf-8") as f:
+            corpus.append({**entry, "html": f.read()})
+    return corpus
+
+
+def _search_route(corpus, base):
+    """Stub of the Custom Search JSON API: corpus pages ranked by word overlap with the query."""
+    indexed = [(set(_words(page["title"] + " " + page["html"][:20000])), page) for page in corpus]
+
+    def search(params):
+        terms = set(_words(params.get("q", "")))
+        ranked = sorted(indexed, key=lambda item: (-len(terms & item[0]), item[1]["path"]))
+        start = int(params.get("start", 1))
+        num = int(params.get("num", 10))
+        items = [
+            {"title": page["title"], "link": base["url"] + page["path"], "snippet": page["snippet"]}
+            for _, page in ranked[start - 1:start - 1 + num]
+        ]
+        return "application/json", json.dumps({"items": items, "searchInformation": {"totalResults": str(len(ranked))}})
+
+    return search
+
+
+def fake_answer(prompt):
+    """Answers each call site of the pipeline in the format it parses."""
+    if prompt.startswith("Rewrite the following search query"):
+        query = re.search(r"Query: (.*)", prompt).group(1)
+        return f"{query}\n{query} explained"
+    if "classify their likely type" in prompt:
+        return json.dumps({"person_type": "academic", "initial_keywords": ["researcher", "university"]})
+    if "generate 3-5 additional" in prompt:
+        return f'"{PERSON}" researcher\n"{PERSON}" award\n"{PERSON}" interview'
+    if prompt.startswith("Analyze the following text and determine"):
+        return ANALYSIS
+    if prompt.startswith("Consolidate and synthesize"):
+        return PROFILE
+    return DEFAULT_ANSWER
+
+
+def _install_fakes(base_url, options):
+    google_search_api.SEARCH_URL = base_url + SEARCH_PATH
+    # The whole corpus is on one host, so per-domain politeness would serialize the crawl
+    crawl_scheduler.CrawlScheduler = functools.partial(
+        crawl_scheduler.CrawlScheduler, per_domain_concurrency=64, per_domain_interval=0
+    )
+    fake = FakeChatModel(options["first_token_latency"], options["per_token_latency"], answer=fake_answer)
+    LLM.gateway = LLMGateway(api_model=lambda: fake, local_model=lambda: None)
+
+
+async def _query_run(index, options, pipelined=True):
+    query = QUERIES[index % len(QUERIES)]
+    with instrumentation.run("benchmark", trace_dir="") as trace:
+        async for event in main.research_query_stream(query, stream_answer=False, max_pages=options["pages"], pipelined=pipelined):
+            if event["type"] == "error":
+                raise RuntimeError(event["text"])
+    pages = sum(1 for span in trace.spans if span.name == "fetch" and span.attributes.get("ok"))
+    return trace, pages
+
+
+async def _person_run(index, options):
+    with instrumentation.run("benchmark", trace_dir="") as trace:
+        profile = await person_researcher.research_person(
+            {"name": PERSON, "known_for": "researcher"},
+            search_duration_minutes=options["person_minutes"],
+            page_concurrency=options["concurrency"],
+        )
+    return trace, profile["research_stats"]["pages_with_text"]
+
+
+# "query_batch" is research_query without the pipeline (every search, then the crawl, then ranking)
+SCENARIOS = {"query": _query_run, "query_batch": functools.partial(_query_run, pipelined=False), "person": _person_run}
+
+
+def _run_once(scenario, index, base_url, options):
+    """One cold run in a fresh process: returns its duration, pages, span durations and peak RSS."""
+    workdir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    os.chdir(workdir)  # Every cache lives under ./.cache, so this run starts cold
+    try:
+        _install_fakes(base_url, options)
+        registry.warm_up(["embedder"])  # Loaded once per process, like the server does at startup
+        trace, pages = asyncio.run(SCENARIOS[scenario](index, options))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # ru_maxrss is in KiB on Linux
+    return {
+        "seconds": trace.root.duration,
+        "pages": pages,
+        "spans": [(span.name, span.duration) for span in trace.spans if span is not trace.root],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_children_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _percentiles(values):
+    ordered = sorted(values)
+    return {
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+    }
+
+
+def _summarize(runs):
+    seconds = sum(run["seconds"] for run in runs)
+    durations = {}
+    for run in runs:
+        for name, duration in run["spans"]:
+            durations.setdefault(name, []).append(duration)
+    return {
+        "runs": len(runs),
+        "runs_per_minute": len(runs) / seconds * 60,
+        "pages_per_minute": sum(run["pages"] for run in runs) / seconds * 60,
+        "run_seconds": _percentiles([run["seconds"] for run in runs]),
+        "stages": {name: {**_percentiles(values), "per_run": len(values) / len(runs)} for name, values in sorted(durations.items())},
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "peak_children_rss_mb": max(run["peak_children_rss_mb"] for run in runs),
+    }
+
+
+def run_benchmark(corpus, scenarios, options):
+    base = {}
+    with serve_fixtures({page["path"]: page["html"] for page in corpus}, routes={SEARCH_PATH: _search_route(corpus, base)}) as (base_url, _):
+        base["url"] = base_url
+        results = {}
+        for scenario in scenarios:
+            runs = []
+            for index in range(options["runs"]):
+                # A process per run: nothing is warm but what a server would keep warm
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    runs.append(pool.submit(_run_once, scenario, index, base_url, options).result())
+            results[scenario] = _summarize(runs)
+    return results
+
+
+def _metrics(summary):
+    """Flattens a scenario summary into {metric name: value}."""
+    flat = {key: summary[key] for key in ("runs_per_minute", "pages_per_minute", "peak_rss_mb", "peak_children_rss_mb")}
+    for q in ("p50", "p95"):
+        flat[f"run_seconds.{q}"] = summary["run_seconds"][q]
+        for stage, values in summary["stages"].items():
+            flat[f"{stage}.{q}"] = values[q]
+    return flat
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    Prints every metric next to its baseline value and returns the regressions:
+    throughput lower, or time or memory higher, by more than `tolerance`.
+    Timings that moved by less than `min_seconds` are never regressions.
+    """
+    regressions = []
+    for scenario, summary in results.items():
+        if scenario not in baseline["results"]:
+            print(f"\n{scenario}: not in the baseline")
+            continue
+        print(f"\n{scenario}")
+        current, previous = _metrics(summary), _metrics(baseline["results"][scenario])
+        for name, value in current.items():
+            before = previous.get(name)
+            if before is None:
+                print(f"  {name:45s} {value:10.3f}   (new)")
+                continue
+            change = (value - before) / before if before else 0.0
+            if name in HIGHER_IS_BETTER:
+                regressed = change < -tolerance
+            elif name.startswith("peak_"):
+                regressed = change > tolerance
+            else:
+                regressed = change > tolerance and value - before > min_seconds
+            print(f"  {name:45s} {value:10.3f}   baseline {before:10.3f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{scenario} {name}: {before:.3f} -> {value:.3f} ({change:+.1%})")
+    return regressions
+
+
+def _print_results(results):
+    for scenario, summary in results.items():
+        print(f"\n{scenario}: {summary['runs']} runs")
+        print(f"  {summary['runs_per_minute']:.2f} runs/min  {summary['pages_per_minute']:.1f} pages/min")
+        print(f"  run p50 {summary['run_seconds']['p50']:.2f}s  p95 {summary['run_seconds']['p95']:.2f}s")
+        print(f"  peak RSS {summary['peak_rss_mb']:.0f} MB (+ {summary['peak_children_rss_mb']:.0f} MB in worker processes)")
+        for stage, values in summary["stages"].items():
+            print(f"    {stage:32s} {values['per_run']:6.1f}/run  p50 {values['p50']:8.4f}s  p95 {values['p95']:8.4f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", help="Directory of a corpus recorded with --record (default: generated pages).")
+    parser.add_argument("--record", nargs="+", metavar=("DIR", "URL"), help="Record the given URLs into DIR and exit.")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=3, help="Runs per scenario.")
+    parser.add_argument("--pages", type=int, default=15, help="Pages crawled per research_query run.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Page concurrency of research_person.")
+    parser.add_argument("--person-minutes", type=float, default=2)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--per-token-latency", type=float, default=0.005)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change treated as a regression.")
+    parser.add_argument("--min-seconds", type=float, default=0.1, help="Smallest timing change treated as a regression.")
+    args = parser.parse_args()
+
+    if args.record:
+        record_corpus(args.record[0], args.record[1:])
+        sys.exit(0)
+
+    options = {
+        "corpus": args.corpus or "generated",
+        "runs": args.runs,
+        "pages": args.pages,
+        "concurrency": args.concurrency,
+        "person_minutes": args.person_minutes,
+        "first_token_latency": args.first_token_latency,
+        "per_token_latency": args.per_token_latency,
+    }
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus()
+    results = run_benchmark(corpus, args.scenarios, options)
+    _print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"options": options, "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline recorded on this machine at {args.baseline}; skipping the comparison. "
+              f"Run with --save-baseline to record one.")
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["options"] != options:
+        print(f"\nBaseline was recorded with different settings: {baseline['options']}")
+        sys.exit(2)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSIONS against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions against {args.baseline}.")
@@ -0,0 +1,83 @@
+"""
+Measures the prompt evaluation time the local model saves by reusing the
+state of a shared prompt prefix (prompt_cache.PrefixStateCache), on page
+analysis prompts of person_researcher.
+
+Two fresh processes share one state directory: the first starts with it
+empty (its first call evaluates the whole prompt and stores the prefix
+state), the second starts after a "restart" and loads that state from
+disk. Each call reports its prompt tokens, the tokens reused, the measured
+prompt evaluation time and the time estimated saved.
+
+Needs the local model (llama_cpp and the model file). Run from the
+repository root:
+    python -m benchmarks.prompt_cache_benchmark --calls 5
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+import LLM
+import person_researcher
+import prompt_cache
+from benchmarks.fixture_server import PARAGRAPH
+
+
+def _prompt(index):
+    return person_researcher.PAGE_ANALYSIS_PREFIX + person_researcher.PAGE_ANALYSIS_PROMPT.format(
+        person_name="Jane Doe", known_facts="occupation: researcher",
+        text=f"Page {index}. " + " ".join([PARAGRAPH] * 3),
+    )
+
+
+async def _calls(count, use_prefix):
+    for index in range(count):
+        await LLM.gateway.complete(
+            _prompt(index), backend="local", max_tokens=8, use_cache=False,
+            prefix=person_researcher.PAGE_ANALYSIS_PREFIX if use_prefix else None,
+        )
+        stats = LLM.gateway.prompt_cache_report()
+        lookup = LLM.gateway._prompt_cache.last_lookup if LLM.gateway._prompt_cache is not None else None
+        if lookup is None:
+            print(f"  call {index + 1}: prompt cache unavailable")
+            continue
+        print(
+            f"  call {index + 1}: {lookup['prompt_tokens']:5d} prompt tokens, {lookup['reused_tokens']:5d} reused ({lookup['source']:9s})"
+        )
+    print(
+        f"  per call: prompt evaluation {stats['prompt_eval_seconds_per_call']:.3f}s, "
+        f"saved ~{stats['prompt_eval_seconds_saved_per_call']:.3f}s, reuse rate {stats['reuse_rate']:.0%}"
+    )
+
+
+def _child(count, use_prefix):
+    asyncio.run(_calls(count, use_prefix))
+    LLM.gateway.close()
+
+
+def run(count):
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = {**os.environ, "PROMPT_STATE_DIR": state_dir}
+        for name, extra in (("without a declared prefix", ["--no-prefix"]), ("first process, empty state directory", []),
+                            ("after a restart", [])):
+            print(name)
+            subprocess.run([sys.executable, "-m", "benchmarks.prompt_cache_benchmark", "--child", "--calls", str(count), *extra],
+                           env=env, check=True)
+        size = sum(os.path.getsize(os.path.join(state_dir, name)) for name in os.listdir(state_dir))
+        print(f"state directory: {len(os.listdir(state_dir))} files, {size / 2 ** 20:.1f} MiB "
+              f"(limit {prompt_cache.DEFAULT_MAX_BYTES / 2 ** 20:.0f} MiB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=5, help="Page analysis calls per process.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--no-prefix", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.calls, not args.no_prefix)
+    else:
+        run(args.calls)
@@ -0,0 +1,130 @@
+"""
+Load test for the research job server.
+
+Starts the server in-process with a fake LLM and a fake search client that
+returns pages from the local fixture server, then submits jobs from many
+concurrent clients. Each client follows its job's event stream to the end.
+Reports throughput, end-to-end latency percentiles, time to first progress
+event and how often the queue pushed back with 429.
+
+Run from the repository root:
+    python -m benchmarks.server_load_test --jobs 40 --clients 10 --workers 4
+"""
+import argparse
+import asyncio
+import functools
+import json
+import socket
+import statistics
+import time
+
+import httpx
+import uvicorn
+
+import LLM
+import crawl_scheduler
+import google_search_api
+import main
+import server
+from llm_gateway import LLMGateway
+from benchmarks.fakes import FakeChatModel, FakeSearchClient
+from benchmarks.fixture_server import serve_fixtures
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _run_job(client, index, results):
+    submitted = time.perf_counter()
+    rejections = 0
+    while True:
+        response = await client.post("/jobs", json={"kind": "query", "query": f"fixture topic {index}", "max_pages": 10})
+        if response.status_code != 429:
+            break
+        rejections += 1
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)) / 10)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+
+    first_progress = None
+    status = None
+    async with client.stream("GET", f"/jobs/{job_id}/stream") as stream:
+        async for line in stream.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "progress" and first_progress is None:
+                first_progress = time.perf_counter() - submitted
+            if event["type"] == "status" and event["status"] in server.FINISHED:
+                status = event["status"]
+    results.append({
+        "latency": time.perf_counter() - submitted,
+        "first_progress": first_progress,
+        "status": status,
+        "rejections": rejections,
+    })
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float("nan")
+
+
+async def run(jobs, clients, workers, max_queued):
+    with serve_fixtures(article_count=30) as (base_url, paths):
+        links = [base_url + path for path in paths]
+        google_search_api.SearchClient = lambda **kwargs: FakeSearchClient(links)
+        # Every fixture is on one host, so per-domain politeness would serialize each crawl
+        main.crawl_scheduler.CrawlScheduler = functools.partial(
+            crawl_scheduler.CrawlScheduler, per_domain_concurrency=main.CRAWL_CONCURRENCY, per_domain_interval=0
+        )
+        server.WARM_MODELS = []
+        server.manager = server.JobManager(workers=workers, max_queued=max_queued)
+
+        port = _free_port()
+        uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(uvicorn_server.serve())
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.05)
+
+        results = []
+        pending = iter(range(jobs))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            async def client_loop():
+                for index in pending:
+                    await _run_job(client, index, results)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client_loop() for _ in range(clients)))
+            elapsed = time.perf_counter() - start
+            health = (await client.get("/health")).json()
+
+        uvicorn_server.should_exit = True
+        await serving
+
+    latencies = [r["latency"] for r in results]
+    first = [r["first_progress"] for r in results if r["first_progress"] is not None]
+    print(f"{jobs} jobs, {clients} clients, {workers} workers, queue of {max_queued}")
+    print(f"throughput        {jobs / elapsed * 60:8.1f} jobs/min")
+    print(f"latency p50/p95   {statistics.median(latencies):8.2f}s / {_percentile(latencies, 0.95):.2f}s")
+    print(f"first progress    {statistics.median(first) if first else float('nan'):8.2f}s (p50)")
+    print(f"429 responses     {sum(r['rejections'] for r in results):8d}")
+    print(f"statuses          {dict((s, sum(r['status'] == s for r in results)) for s in server.FINISHED)}")
+    print(f"server            {health}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queued", type=int, default=8)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--per-token-latency", type=float, default=0.01)
+    args = parser.parse_args()
+    fake = FakeChatModel(args.first_token_latency, args.per_token_latency)
+    LLM.gateway = LLMGateway(api_model=lambda: fake, local_model=lambda: None)
+    asyncio.run(run(args.jobs, args.clients, args.workers, args.max_queued))
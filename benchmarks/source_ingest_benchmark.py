@@ -0,0 +1,80 @@
+"""
+Measures multi-source ingestion throughput: sources discovered and articles
+fetched and extracted one at a time against the bounded concurrent pools of
+source_monitor.ingest_sources, then a second cycle that the article memo
+should make almost free.
+
+Every source is a fixture site with an RSS feed; its pages answer after a
+configurable latency, like a remote server. All sources share one host, so
+per-domain politeness is switched off.
+
+Run from the repository root:
+    python -m benchmarks.source_ingest_benchmark --sources 50 --articles 5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import crawl_scheduler
+import source_monitor
+import web_crawler
+from browser_pool import BrowserPool
+from extraction_executor import ExtractionExecutor
+from benchmarks.fixture_server import make_article_html, serve_fixtures
+
+
+def _routes(articles, latency):
+    # Links are relative: discovery resolves them against the document's URL
+    def home(params):
+        time.sleep(latency)
+        feed = f"/feed?source={params['source']}"
+        return "text/html", f'<html><head><link rel="alternate" type="application/rss+xml" href="{feed}"></head><body></body></html>'
+
+    def feed(params):
+        time.sleep(latency)
+        items = "".join(f"<item><link>/article?source={params['source']}&amp;n={n}</link></item>" for n in range(articles))
+        return "application/rss+xml", f'<?xml version="1.0"?><rss version="2.0"><channel>{items}</channel></rss>'
+
+    def article(params):
+        time.sleep(latency)
+        return "text/html; charset=utf-8", make_article_html(f"{params['source']}-{params['n']}")
+
+    return {"/source": home, "/feed": feed, "/article": article}
+
+
+async def _ingest(sources, articles, memo, pool, http_client, executor, concurrency):
+    source_monitor.DISCOVERY_CONCURRENCY = source_monitor.FETCH_CONCURRENCY = concurrency
+    scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=concurrency, per_domain_concurrency=concurrency, per_domain_interval=0)
+    stats = {}
+    async for _ in source_monitor.ingest_sources(sources, articles, pool, http_client, None, executor, scheduler, memo, stats=stats):
+        pass
+    print(
+        f"  {stats['articles']:5d} articles from {stats['sources']} sources in {stats['seconds']:6.2f}s "
+        f"({stats['articles_per_minute']:7.1f}/min, {stats['new']} new of {stats['discovered']} discovered)"
+    )
+    return stats
+
+
+async def run(source_count, articles, latency, concurrency):
+    with tempfile.TemporaryDirectory() as workdir, serve_fixtures(pages={}, routes=_routes(articles, latency)) as (base_url, _):
+        sources = [f"{base_url}/source?source={i}" for i in range(source_count)]
+        async with BrowserPool(size=2) as pool, web_crawler.create_http_client(max_connections=concurrency * 2) as http_client, \
+                ExtractionExecutor() as executor:
+            for name, workers, memo_name in (("serial", 1, "serial"), ("concurrent", concurrency, "concurrent"),
+                                             ("concurrent, 2nd cycle", concurrency, "concurrent")):
+                print(name)
+                memo = source_monitor.ArticleMemo(os.path.join(workdir, f"{memo_name}.sqlite3"))
+                await _ingest(sources, articles, memo, pool, http_client, executor, workers)
+                memo.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--articles", type=int, default=5, help="Articles in each source's feed.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every fixture response takes.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Discovery and fetch workers of the concurrent runs.")
+    args = parser.parse_args()
+    asyncio.run(run(args.sources, args.articles, args.latency, args.concurrency))
@@ -0,0 +1,63 @@
+"""
+Compares time-to-first-token and total latency of research_query in
+blocking mode and in streaming mode (research_query_stream).
+
+Run from the repository root:
+    python -m benchmarks.streaming_benchmark "how do vaccines work" --fake-llm
+
+With --fake-llm the LLM is replaced by a fake with configurable latency, so
+only search and crawling are live. Set RESEARCH_OFFLINE=1 to serve those
+from the page cache of an earlier run as well.
+"""
+import argparse
+import asyncio
+import time
+
+import LLM
+import main
+from llm_gateway import LLMGateway
+from benchmarks.fakes import FakeChatModel
+
+
+async def _blocking(query):
+    start = time.perf_counter()
+    answer = await main.research_query(query)
+    total = time.perf_counter() - start
+    # Nothing is shown until the whole answer exists
+    return total, total, answer
+
+
+async def _streaming(query):
+    start = time.perf_counter()
+    first_token = None
+    answer = None
+    async for event in main.research_query_stream(query):
+        if event["type"] == "token" and first_token is None:
+            first_token = time.perf_counter() - start
+        elif event["type"] in ("answer", "error"):
+            answer = event["text"]
+    total = time.perf_counter() - start
+    return first_token if first_token is not None else total, total, answer
+
+
+async def run(query, runs):
+    # One unmeasured run fills the page cache so both modes see the same crawl cost
+    await _streaming(query)
+    for i in range(runs):
+        for name, mode in (("blocking", _blocking), ("streaming", _streaming)):
+            ttft, total, answer = await mode(query)
+            print(f"{name:<10} run {i + 1}: time to first token {ttft:7.2f}s   total {total:7.2f}s   ({len(answer or '')} chars)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("query")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--fake-llm", action="store_true", help="Replace the LLM with a fake model")
+    parser.add_argument("--first-token-latency", type=float, default=2.0)
+    parser.add_argument("--per-token-latency", type=float, default=0.03)
+    args = parser.parse_args()
+    if args.fake_llm:
+        fake = FakeChatModel(args.first_token_latency, args.per_token_latency)
+        LLM.gateway = LLMGateway(api_model=lambda: fake, local_model=lambda: None)
+    asyncio.run(run(args.query, args.runs))
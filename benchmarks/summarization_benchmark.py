@@ -0,0 +1,92 @@
+"""
+Compares hierarchical (map-reduce) summarization with the old approach of
+truncating the joined articles to 10,000 words: latency, LLM calls, token
+usage and how much of the crawled text reaches the model.
+
+Uses a fake LLM whose latency grows with prompt length. Run from the
+repository root:
+    python -m benchmarks.summarization_benchmark --articles 40 --words 1500
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import os
+import time
+
+import LLM
+import context_packing
+import summarizer
+import utils
+from llm_gateway import LLMGateway
+from benchmarks.fakes import FakeChatModel
+
+TRUNCATION_WORD_LIMIT = 10000
+
+VOCABULARY = (
+    "study report data city market energy policy research team growth result source "
+    "system model year percent region analysis survey impact cost network trend"
+).split()
+
+
+def make_articles(count, words, seed=0):
+    rng = random.Random(seed)
+    articles = []
+    for i in range(count):
+        sentences = []
+        for _ in range(words // 12):
+            sentences.append(" ".join(rng.choice(VOCABULARY) for _ in range(11)).capitalize() + ".")
+        paragraphs = [" ".join(sentences[j:j + 6]) for j in range(0, len(sentences), 6)]
+        articles.append(f"Article {i}.\n\n" + "\n\n".join(paragraphs))
+    return articles
+
+
+async def _truncation(articles):
+    start = time.perf_counter()
+    full_text = "\n\n".join(articles)
+    truncated = utils.truncate_text_by_words(full_text, TRUNCATION_WORD_LIMIT)
+    summary = await summarizer.summarize_with_gemini(truncated)
+    prompt_tokens = context_packing.count_tokens(summarizer._summary_prompt(truncated))
+    return {
+        "seconds": time.perf_counter() - start,
+        "llm_calls": 1,
+        "input_tokens": prompt_tokens,
+        "output_tokens": context_packing.count_tokens(summary),
+        "coverage": context_packing.count_tokens(truncated) / context_packing.count_tokens(full_text),
+    }
+
+
+async def _hierarchical(articles, cache):
+    stats = {}
+    await summarizer.summarize_hierarchical(articles, "what do the sources report?", cache=cache, stats=stats)
+    return stats
+
+
+def _print(name, stats):
+    print(
+        f"{name:<24} {stats['seconds']:7.2f}s  {stats['llm_calls']:4d} calls  "
+        f"in {stats['input_tokens']:7d} tok  out {stats['output_tokens']:6d} tok  coverage {stats['coverage']:6.1%}"
+    )
+
+
+async def run(article_count, words):
+    articles = make_articles(article_count, words)
+    total_words = sum(len(a.split()) for a in articles)
+    print(f"{article_count} articles, {total_words} words\n")
+    _print("truncate to 10k words", await _truncation(articles))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = summarizer.SummaryCache(os.path.join(cache_dir, "summaries.sqlite3"))
+        _print("hierarchical, cold cache", await _hierarchical(articles, cache))
+        _print("hierarchical, warm cache", await _hierarchical(articles, cache))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--articles", type=int, default=40)
+    parser.add_argument("--words", type=int, default=1500, help="Words per article")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent LLM calls")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0002)
+    args = parser.parse_args()
+    fake = FakeChatModel(first_token_latency=0.3, per_token_latency=0.01, prompt_token_latency=args.prompt_token_latency)
+    LLM.gateway = LLMGateway(api_model=lambda: fake, local_model=lambda: None, api_concurrency=args.concurrency)
+    asyncio.run(run(args.articles, args.words))
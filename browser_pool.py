@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+import instrumentation
+
+# List of common user agents to rotate
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_1) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0.2526.111 Safari/537.36",
+    "Mozilla/5.0 (X11; CrOS armv7l 13597.84.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.192 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.59",
+    "Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; AS; rv:11.0) like Gecko"
+]
+
+VIEWPORT = {"width": 1366, "height": 768}
+
+
+class _Tab:
+    """A browser context with a single page, handed out by the pool."""
+
+    def __init__(self, context, page, generation):
+        self.context = context
+        self.page = page
+        self.generation = generation
+        self.uses = 0
+        self.crashed = False
+        page.on("crash", self._on_crash)
+
+    def _on_crash(self, _page):
+        self.crashed = True
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except Exception:
+            pass  # Context already gone with the browser
+
+
+class BrowserPool:
+    """
+    A long-lived Chromium instance with a fixed number of reusable tabs.
+
+    Each tab is its own browser context, so cookies and storage do not leak
+    between concurrent fetches. A tab is recycled after `max_pages_per_tab`
+    page loads or when its page crashes, and the whole browser is relaunched
+    if it disconnects.
+
+    Usage:
+        async with BrowserPool(size=4) as pool:
+            async with pool.page() as page:
+                await page.goto(url)
+    """
+
+    def __init__(self, size=4, headless=True, max_pages_per_tab=50, user_agents=None):
+        """
+        Args:
+            size: Number of tabs that can be open at the same time.
+            headless: Whether to run Chromium in headless mode.
+            max_pages_per_tab: Page loads served by a tab before it is recycled.
+            user_agents: User agents to rotate between tabs (defaults to USER_AGENTS).
+        """
+        self.size = size
+        self.headless = headless
+        self.max_pages_per_tab = max_pages_per_tab
+        self.user_agents = user_agents or USER_AGENTS
+
+        self._playwright = None
+        self._browser = None
+        self._generation = 0
+        self._tabs = None
+        self._launch_lock = asyncio.Lock()
+        self._closed = True
+
+        self.stats = {"pages_served": 0, "tabs_recycled": 0, "browser_launches": 0, "crashes": 0}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """Starts Playwright, launches the browser and opens the tabs."""
+        if not self._closed:
+            return
+        self._closed = False
+        self._playwright = await async_playwright().start()
+        await self._launch_browser()
+        self._tabs = asyncio.Queue()
+        for _ in range(self.size):
+            self._tabs.put_nowait(await self._new_tab())
+
+    async def close(self):
+        """Closes every tab, the browser and Playwright."""
+        if self._closed:
+            return
+        self._closed = True
+        while self._tabs and not self._tabs.empty():
+            tab = self._tabs.get_nowait()
+            if tab is not None:
+                await tab.close()
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+        await self._playwright.stop()
+        self._browser = None
+        self._playwright = None
+
+    async def _launch_browser(self):
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._generation += 1
+        self.stats["browser_launches"] += 1
+        logging.info(f"Browser pool launched Chromium (generation {self._generation}).")
+
+    async def _ensure_browser(self):
+        """Relaunches the browser if it has crashed or disconnected."""
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                logging.warning("Browser pool lost its browser. Relaunching Chromium.")
+                self.stats["crashes"] += 1
+                await self._launch_browser()
+
+    async def _new_tab(self):
+        context = await self._browser.new_context(
+            user_agent=random.choice(self.user_agents),
+            viewport=VIEWPORT,
+        )
+        page = await context.new_page()
+        return _Tab(context, page, self._generation)
+
+    def _is_healthy(self, tab):
+        return (
+            tab.generation == self._generation
+            and not tab.crashed
+            and not tab.page.is_closed()
+            and tab.uses < self.max_pages_per_tab
+        )
+
+    async def _recycle(self, tab):
+        if tab.crashed:
+            self.stats["crashes"] += 1
+        self.stats["tabs_recycled"] += 1
+        await tab.close()
+        await self._ensure_browser()
+        return await self._new_tab()
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        Borrows a healthy page from the pool for the duration of the block.
+
+        Waits if all tabs are in use. The page is health-checked before it is
+        handed out and recycled afterwards if it crashed or reached its limit.
+        """
+        if self._closed:
+            raise RuntimeError("BrowserPool is not started.")
+        waiting_since = time.perf_counter()
+        tab = await self._tabs.get()
+        instrumentation.count(tab_wait_seconds=time.perf_counter() - waiting_since)
+        try:
+            if tab is None or not self._is_healthy(tab):
+                if tab is None:
+                    await self._ensure_browser()
+                    tab = await self._new_tab()
+                else:
+                    tab = await self._recycle(tab)
+            tab.uses += 1
+            self.stats["pages_served"] += 1
+            yield tab.page
+        except BaseException:
+            # Navigation errors are normal; only throw the tab away if it broke.
+            if tab is not None and (tab.crashed or tab.page.is_closed() or not self._browser.is_connected()):
+                try:
+                    tab = await self._recycle(tab)
+                except Exception as e:
+                    logging.error(f"Browser pool could not recycle a tab: {e}")
+                    tab = None
+            raise
+        finally:
+            if self._closed:
+                if tab is not None:
+                    await tab.close()
+            else:
+                self._tabs.put_nowait(tab)
@@ -0,0 +1,195 @@
+import os
+import re
+import time
+
+import instrumentation
+
+# Default limits for one research run (0 or empty: unlimited)
+MAX_TOKENS = int(os.getenv("RESEARCH_MAX_TOKENS", 0)) or None
+MAX_SECONDS = float(os.getenv("RESEARCH_MAX_SECONDS", 0)) or None
+MAX_REQUESTS = int(os.getenv("RESEARCH_MAX_REQUESTS", 0)) or None
+
+# A run stops once the average gain of its last GAIN_WINDOW observations
+# falls below MIN_GAIN, after at least MIN_OBSERVATIONS observations
+MIN_GAIN = float(os.getenv("RESEARCH_MIN_GAIN", 0.1))
+GAIN_WINDOW = 5
+MIN_OBSERVATIONS = 5
+
+# How the signals of one observation are combined (signals not given are left out)
+GAIN_WEIGHTS = {"novelty": 0.4, "facts": 0.4, "confidence": 0.2}
+# New facts in one observation that count as a full gain
+FACTS_FOR_FULL_GAIN = 3
+# Change in confidence that counts as a full gain
+CONFIDENCE_FOR_FULL_GAIN = 0.1
+
+SHINGLE_WORDS = 4
+
+# Stop reasons set by the controller itself; callers may record their own with stop()
+TIME_BUDGET, TOKEN_BUDGET, REQUEST_BUDGET, DIMINISHING_RETURNS = (
+    "time budget", "token budget", "request budget", "diminishing returns"
+)
+
+
+class NoveltyTracker:
+    """
+    Measures how much of a text has not been seen before, as the share of
+    its word shingles that no earlier text contained.
+    """
+
+    def __init__(self, shingle_words=SHINGLE_WORDS):
+        self.shingle_words = shingle_words
+        self._seen = set()
+
+    def novelty(self, text):
+        """Returns the unseen share of `text` (0.0 to 1.0) and remembers its shingles."""
+        words = re.findall(r"\w+", text.lower())
+        n = self.shingle_words
+        shingles = {hash(" ".join(words[i:i + n])) for i in range(max(len(words) - n + 1, 1))} if words else set()
+        if not shingles:
+            return 0.0
+        new = shingles - self._seen
+        self._seen |= new
+        return len(new) / len(shingles)
+
+
+def unknown_facts(known, facts):
+    """The facts in `facts` that `known` lacks or records with a different value."""
+    return {key: value for key, value in facts.items() if str(known.get(key, "")).lower() != str(value).lower()}
+
+
+class BudgetController:
+    """
+    Decides when a research run should stop: when a token, time or request
+    budget is spent, or when the marginal information gain of its recent
+    work (new text, new facts, movement in confidence) has dropped below
+    `min_gain`.
+
+    Tokens are the LLM tokens instrumentation records in the run the
+    controller is used in; requests are charged by the caller.
+
+    Usage:
+        budget = BudgetController(max_seconds=300, max_requests=50)
+        while not budget.should_stop():
+            text = await fetch_next()
+            budget.charge(requests=1)
+            budget.observe(novelty=tracker.novelty(text))
+        budget.report()   # stop reason and consumption
+    """
+
+    def __init__(self, max_tokens=MAX_TOKENS, max_seconds=MAX_SECONDS, max_requests=MAX_REQUESTS, min_gain=MIN_GAIN,
+                 window=GAIN_WINDOW, min_observations=MIN_OBSERVATIONS):
+        """
+        Args:
+            max_tokens: Estimated LLM tokens (prompt plus response) the run may use, or None.
+            max_seconds: Seconds the run may take, or None.
+            max_requests: Searches and page fetches the run may make, or None.
+            min_gain: Average gain (0.0 to 1.0) below which the run stops; 0 disables it.
+            window: Observations averaged.
+            min_observations: Observations needed before diminishing returns can stop the run.
+        """
+        self.limits = {"tokens": max_tokens, "seconds": max_seconds, "requests": max_requests}
+        self.min_gain = min_gain
+        self.window = window
+        self.min_observations = min_observations
+        self.stop_reason = None
+        self.gains = []
+        self._requests = 0
+        self._confidence = None
+        self._started = time.monotonic()
+        self._run = None
+        self._tokens_at_start = 0
+        self._llm_tokens()
+
+    def _llm_tokens(self):
+        if self._run is None:
+            # Bound to the first run it is used in, so it may be created before the run starts
+            self._run = instrumentation.current_run()
+            if self._run is None:
+                return 0
+            self._tokens_at_start = self._run.total("tokens_in", "tokens_out")
+        return self._run.total("tokens_in", "tokens_out")
+
+    def consumed(self):
+        """Tokens, seconds and requests used so far."""
+        return {
+            "tokens": self._llm_tokens() - self._tokens_at_start,
+            "seconds": time.monotonic() - self._started,
+            "requests": self._requests,
+        }
+
+    def remaining(self, resource):
+        """What is left of one budget ("tokens", "seconds" or "requests"), or None if it is unlimited."""
+        limit = self.limits[resource]
+        return None if limit is None else max(limit - self.consumed()[resource], 0)
+
+    def charge(self, requests=0):
+        """Records searches and page fetches made."""
+        self._requests += requests
+
+    def observe(self, novelty=None, facts=None, confidence=None):
+        """
+        Records the gain of one unit of work (e.g. one page).
+
+        Args:
+            novelty: Share of the new text not seen before (0.0 to 1.0).
+            facts: Number of new facts it added.
+            confidence: The run's confidence after it (0.0 to 1.0); the gain
+                is how far it moved.
+
+        Returns:
+            The combined gain, 0.0 to 1.0.
+        """
+        signals = {}
+        if novelty is not None:
+            signals["novelty"] = novelty
+        if facts is not None:
+            signals["facts"] = min(facts / FACTS_FOR_FULL_GAIN, 1.0)
+        if confidence is not None:
+            previous = self._confidence if self._confidence is not None else 0.0
+            signals["confidence"] = min(abs(confidence - previous) / CONFIDENCE_FOR_FULL_GAIN, 1.0)
+            self._confidence = confidence
+        weight = sum(GAIN_WEIGHTS[name] for name in signals)
+        gain = sum(GAIN_WEIGHTS[name] * value for name, value in signals.items()) / weight if weight else 0.0
+        self.gains.append(gain)
+        instrumentation.count(information_gain=gain)
+        return gain
+
+    def recent_gain(self):
+        """Average gain of the last `window` observations, or None before the first one."""
+        recent = self.gains[-self.window:]
+        return sum(recent) / len(recent) if recent else None
+
+    def stop(self, reason):
+        """Records why the run stopped, unless a reason was already recorded."""
+        if self.stop_reason is None:
+            self.stop_reason = reason
+
+    def should_stop(self):
+        """True once a budget is spent or returns have diminished; the reason is kept in `stop_reason`."""
+        if self.stop_reason is not None:
+            return True
+        consumed = self.consumed()
+        for resource, reason in (("seconds", TIME_BUDGET), ("tokens", TOKEN_BUDGET), ("requests", REQUEST_BUDGET)):
+            limit = self.limits[resource]
+            if limit is not None and consumed[resource] >= limit:
+                self.stop(reason)
+                return True
+        if self.min_gain and len(self.gains) >= self.min_observations and self.recent_gain() < self.min_gain:
+            self.stop(DIMINISHING_RETURNS)
+            return True
+        return False
+
+    def report(self):
+        """The stop reason, limits, consumption (and share of each limit used) and gain history."""
+        consumed = self.consumed()
+        return {
+            "stop_reason": self.stop_reason,
+            "limits": dict(self.limits),
+            "consumed": consumed,
+            "used": {
+                resource: consumed[resource] / limit if limit else None for resource, limit in self.limits.items()
+            },
+            "observations": len(self.gains),
+            "recent_gain": self.recent_gain(),
+            "min_gain": self.min_gain,
+        }
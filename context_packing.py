@@ -0,0 +1,279 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from model_registry import registry, local_model_downloaded, LOCAL_N_CTX
+from utils import estimate_tokens
+
+# Which tokenizer counts tokens: "auto" and "local" use the local model's
+# tokenizer, loading only its vocabulary on first use unless the model is
+# loaded anyway. "auto" never downloads the model file for it and quietly
+# falls back to the word-based estimate without it; "local" downloads the
+# file if needed and warns when the tokenizer is unavailable. "estimate"
+# never loads the tokenizer
+TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "auto")
+
+# Token counts remembered per counter
+COUNT_CACHE_SIZE = 50000
+# No tokenizer packs more characters than this into one token; longer
+# stretches are known not to fit without counting them
+MAX_CHARS_PER_TOKEN = 32
+# Size of one packed passage
+PASSAGE_TOKENS = 250
+
+# Context window of the local model, the tightest limit a prompt has to fit
+CONTEXT_TOKENS = LOCAL_N_CTX
+
+# A sentence ends after ., ! or ? (and closing quotes or brackets) followed by whitespace, or at a line break
+_SENTENCE_END = re.compile(r"[.!?]+[\"'”’)\]]*\s+|\n\s*")
+_WORD = re.compile(r"\S+")
+
+
+class TokenCounter:
+    """
+    Counts tokens with a model's tokenizer, remembering the counts of texts
+    it has seen (an LRU of COUNT_CACHE_SIZE entries), so the same passages
+    are tokenized once however often they are packed.
+
+    Usage:
+        counter = TokenCounter(lambda text: len(tokenizer.encode(text)), name="gemma")
+        counter.count("Some text.")
+    """
+
+    def __init__(self, count_fn=estimate_tokens, name="estimate", cache_size=COUNT_CACHE_SIZE):
+        """
+        Args:
+            count_fn: Returns the number of tokens in a string.
+            name: Shown in the report.
+            cache_size: Counts remembered (0: none, for counts cheaper than a lookup).
+        """
+        self.count_fn = count_fn
+        self.name = name
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"counts": 0, "cache_hits": 0, "chars_tokenized": 0}
+
+    def count(self, text):
+        if not self.cache_size:
+            self.stats["counts"] += 1
+            return self.count_fn(text)
+        key = (len(text), hash(text))
+        with self._lock:
+            self.stats["counts"] += 1
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return tokens
+        tokens = self.count_fn(text)
+        with self._lock:
+            self.stats["chars_tokenized"] += len(text)
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def report(self):
+        counts = self.stats["counts"]
+        return {"tokenizer": self.name, **self.stats, "hit_rate": self.stats["cache_hits"] / counts if counts else 0.0}
+
+
+# The estimate is a word count, cheaper than a cache lookup
+ESTIMATE = TokenCounter(cache_size=0)
+
+_local_counter = None
+_tokenizer_failed = False
+
+
+def _local_tokenizer_counter():
+    global _local_counter
+    if _local_counter is None:
+        # The full model when it is loaded anyway, else just its vocabulary
+        if registry.is_loaded("llama_local"):
+            llama = registry.get("llama_local")
+        elif TOKENIZER == "auto" and not local_model_downloaded():
+            raise FileNotFoundError("the local model file is not downloaded")
+        else:
+            llama = registry.get("llama_tokenizer")
+        _local_counter = TokenCounter(lambda text: len(llama.tokenize(text.encode("utf-8"), add_bos=False)), name="llama_local")
+    return _local_counter
+
+
+def get_counter():
+    """
+    The counter for the local model's tokenizer (see CONTEXT_TOKENIZER), or
+    the word-based estimate when that tokenizer is not available.
+    """
+    global _tokenizer_failed
+    # After a failure only a model loaded since then brings the tokenizer back
+    if TOKENIZER == "estimate" or (_tokenizer_failed and not registry.is_loaded("llama_local")):
+        return ESTIMATE
+    try:
+        return _local_tokenizer_counter()
+    except Exception as e:
+        # Not retried as is: without the model file every call would fail the same way
+        _tokenizer_failed = True
+        log = logging.info if TOKENIZER == "auto" else logging.warning
+        log(f"Tokenizer unavailable ({e}). Estimating token counts from words.")
+        return ESTIMATE
+
+
+def count_tokens(text):
+    """Tokens in `text`, counted with get_counter()."""
+    return get_counter().count(text)
+
+
+def iter_sentences(text, start=0):
+    """Yields the (start, end) offsets of each sentence from `start` on, scanning lazily."""
+    for match in _SENTENCE_END.finditer(text, start):
+        if match.end() > start:
+            yield start, match.end()
+            start = match.end()
+    if start < len(text):
+        yield start, len(text)
+
+
+def _cut_words(text, start, max_tokens, counter):
+    """End offset of the longest run of whole words from `start` that fits in `max_tokens`."""
+    window = text[start:start + max_tokens * MAX_CHARS_PER_TOKEN]
+    ends = [match.end() for match in _WORD.finditer(window)]
+    if ends and ends[-1] == len(window) and start + len(window) < len(text):
+        ends.pop()  # The window may end inside a word
+    low, high = 0, len(ends)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count(window[:ends[middle - 1]]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return start + (ends[low - 1] if low else 0)
+
+
+def truncate_to_tokens(text, max_tokens, counter=None):
+    """
+    Cuts `text` to at most `max_tokens` tokens at a sentence boundary.
+
+    Sentences are counted one at a time as they are scanned, and scanning
+    stops at the first one that does not fit, so the cost depends on the
+    length kept, not on the length of `text`. If even the first sentence
+    does not fit, it is cut between words.
+
+    Args:
+        text: The text to cut.
+        max_tokens: Token limit.
+        counter: TokenCounter (default: get_counter()).
+
+    Returns:
+        A prefix of `text`.
+    """
+    counter = counter or get_counter()
+    if max_tokens <= 0:
+        return ""
+    used = end = 0
+    for start, stop in iter_sentences(text):
+        tokens = _count_span(text, start, stop, max_tokens - used, counter)
+        if tokens > max_tokens - used:
+            break
+        used += tokens
+        end = stop
+    else:
+        return text
+    if end == 0:
+        end = _cut_words(text, 0, max_tokens, counter)
+    return text[:end].rstrip()
+
+
+def _count_span(text, start, stop, limit, counter):
+    """Tokens in text[start:stop], or limit + 1 when the span is too long to fit in `limit` anyway."""
+    if stop - start > limit * MAX_CHARS_PER_TOKEN:
+        return limit + 1
+    return counter.count(text[start:stop])
+
+
+def split_sentence_passages(text, passage_tokens=PASSAGE_TOKENS, counter=None):
+    """
+    Splits text into passages of up to `passage_tokens` tokens made of whole
+    sentences, in one pass (a sentence longer than a passage is cut between words).
+
+    Returns:
+        List of (passage, tokens).
+    """
+    counter = counter or get_counter()
+    passages = []
+    passage_start = passage_end = tokens = 0
+    for start, stop in iter_sentences(text):
+        sentence_tokens = _count_span(text, start, stop, passage_tokens, counter)
+        if tokens and tokens + sentence_tokens > passage_tokens:
+            passages.append((text[passage_start:passage_end], tokens))
+            passage_start, tokens = start, 0
+        while sentence_tokens > passage_tokens:
+            cut = _cut_words(text, start, passage_tokens, counter)
+            if cut <= start:
+                # One "word" longer than a passage
+                cut = min(start + passage_tokens * MAX_CHARS_PER_TOKEN, stop)
+            passages.append((text[start:cut], counter.count(text[start:cut])))
+            start = passage_start = cut
+            sentence_tokens = _count_span(text, start, stop, passage_tokens, counter)
+        tokens += sentence_tokens
+        passage_end = stop
+    if tokens:
+        passages.append((text[passage_start:passage_end], tokens))
+    return [(passage.strip(), tokens) for passage, tokens in passages if passage.strip()]
+
+
+def pack(documents, max_tokens, score=None, counter=None, passage_tokens=PASSAGE_TOKENS, separator="\n\n"):
+    """
+    Fills a token budget with the most valuable passages of several documents.
+
+    Documents are split into sentence-bounded passages; passages are taken
+    in order of value while they fit (smaller ones can still fill the space a
+    larger one left), then put back in document order.
+
+    Args:
+        documents: List of texts.
+        max_tokens: Token budget of the packed text, separators included.
+        score: Optional function taking the list of passages and returning
+            a value for each. By default earlier passages of a document are
+            worth more, so every document contributes its opening first.
+        counter: TokenCounter (default: get_counter()).
+        passage_tokens: Size of one passage.
+        separator: Put between passages.
+
+    Returns:
+        (text, stats): the packed text, and the number of documents, passages,
+        passages selected, tokens selected and tokens left out.
+    """
+    counter = counter or get_counter()
+    passages = []  # (document index, position, text, tokens)
+    for document_index, document in enumerate(documents):
+        if document:
+            for position, (text, tokens) in enumerate(split_sentence_passages(document, passage_tokens, counter)):
+                passages.append((document_index, position, text, tokens))
+    stats = {"documents": len(documents), "passages": len(passages), "selected": 0, "tokens": 0,
+             "tokens_dropped": sum(p[3] for p in passages)}
+    if not passages:
+        return "", stats
+
+    values = score([p[2] for p in passages]) if score is not None else [1.0 / (1 + p[1]) for p in passages]
+    separator_tokens = counter.count(separator) if separator.strip() else 0
+    order = sorted(range(len(passages)), key=lambda i: (-values[i], passages[i][0], passages[i][1]))
+    kept, used = [], 0
+    for index in order:
+        cost = passages[index][3] + (separator_tokens if kept else 0)
+        if used + cost <= max_tokens:
+            kept.append(index)
+            used += cost
+    kept.sort(key=lambda i: passages[i][:2])
+    stats["selected"] = len(kept)
+    stats["tokens"] = used
+    stats["tokens_dropped"] -= sum(passages[i][3] for i in kept)
+    return separator.join(passages[i][2] for i in kept), stats
+
+
+def prompt_budget(prompt, max_output_tokens, context_tokens=CONTEXT_TOKENS, counter=None):
+    """Tokens left for inserted text in a prompt of `context_tokens` once `prompt` and the answer are accounted for."""
+    counter = counter or get_counter()
+    return max(context_tokens - counter.count(prompt) - max_output_tokens, 0)
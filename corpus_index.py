@@ -0,0 +1,437 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+import retrieval
+import utils
+
+# Defaults, overridable through the environment
+DEFAULT_INDEX_DIR = os.getenv("CORPUS_INDEX_DIR", os.path.join(".cache", "corpus"))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Query terms found in more than half of the passages (where the classic BM25
+# idf turns negative) add little to a score and have the longest postings
+# lists; they are skipped when the query has rarer terms, as are stopwords
+MAX_TERM_DF_SHARE = 0.5
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in is it its of on or she that the their they this to was "
+    "were what when where which who will with".split()
+)
+# Rank fusion constant: a passage's hybrid score is the sum of 1 / (RRF_K + rank) over both rankings
+RRF_K = 60
+
+# Up to this many rows the vector search is exact; beyond it, rows are first
+# narrowed down to ANN_CANDIDATES by the Hamming distance of their LSH signatures
+EXACT_SEARCH_ROWS = 20000
+ANN_CANDIDATES = 2000
+SIGNATURE_BITS = 64
+
+# The embedding matrix grows by doubling, starting at this many rows
+INITIAL_ROWS = 1024
+
+# A passage found in the index: `score` is the fused rank score, `bm25` and
+# `cosine` its scores in each ranking (None if it was not ranked there)
+IndexHit = namedtuple("IndexHit", ["passage_id", "url", "title", "publish_date", "text", "score", "bm25", "cosine"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    url_key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    title TEXT,
+    publish_date TEXT,
+    keywords TEXT,
+    text_hash TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS passages (
+    passage_id INTEGER PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS passages_doc ON passages (doc_id);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    passage_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, passage_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _terms(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CorpusIndex:
+    """
+    Persistent index of every article extracted so far, for hybrid
+    full-text and vector search over their passages.
+
+    Articles are split into the same passages the retrieval step ranks. An
+    SQLite store (WAL mode) holds the documents, passages and an inverted
+    index for BM25. Passage embeddings live in a memory-mapped float32
+    matrix, one row per passage, next to a matrix of 64-bit random-hyperplane
+    signatures used to narrow large searches down to a few candidates before
+    the exact cosine ranking, so only those rows are read from disk.
+
+    The index updates incrementally: adding an article writes only its own
+    rows, and re-adding a changed article replaces its passages.
+
+    One process writes the index at a time; it is safe to share between the
+    threads of that process.
+
+    Usage:
+        index = get_default_index()
+        index.add_article(url, article_data)   # from extract_article_content_with_newspaper
+        hits = index.search("effects of sleep on memory", k=20)
+    """
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        """
+        Args:
+            index_dir: Directory holding the SQLite store and the matrices.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(index_dir, "index.sqlite3"), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        self.dimensions = int(meta["dimensions"]) if "dimensions" in meta else None
+        if "passages" not in meta:
+            meta.update(self._count_passages())
+        # BM25 statistics, kept up to date by add_article instead of being counted per query
+        self._passages = int(meta["passages"])
+        self._total_length = int(meta["total_length"])
+        self._rows = self._db.execute("SELECT COALESCE(MAX(passage_id), 0) FROM passages").fetchone()[0]
+        self._matrix = None
+        self._signatures = None
+        self._planes = None
+        self._capacity = 0
+        self._warned_dimensions = False
+        if self.dimensions is not None:
+            self._open_matrices(max(self._rows, INITIAL_ROWS))
+        self.stats = {"articles_added": 0, "articles_unchanged": 0, "articles_replaced": 0, "passages_added": 0,
+                      "searches": 0, "ann_searches": 0}
+
+    def _count_passages(self):
+        """Computes the BM25 statistics of an index written before they were kept in `meta`."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            count, total_length = self._db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM passages WHERE deleted = 0").fetchone()
+            self._db.execute("DELETE FROM terms")
+            self._db.execute("INSERT INTO terms (term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+            counters = {"passages": str(count), "total_length": str(total_length)}
+            self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", counters.items())
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return counters
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    # Embedding matrix
+
+    def _matrix_path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _open_matrices(self, rows):
+        """Maps the embedding and signature files, growing them to at least `rows` rows."""
+        capacity = max(rows, self._capacity * 2, INITIAL_ROWS)
+        self._flush()
+        self._matrix = self._signatures = None
+        for name, row_bytes in (("embeddings.f32", self.dimensions * 4), ("signatures.u64", 8)):
+            path = self._matrix_path(name)
+            with open(path, "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self._matrix = np.memmap(self._matrix_path("embeddings.f32"), dtype=np.float32, mode="r+", shape=(capacity, self.dimensions))
+        self._signatures = np.memmap(self._matrix_path("signatures.u64"), dtype=np.uint64, mode="r+", shape=(capacity,))
+        self._planes = np.random.RandomState(0).standard_normal((SIGNATURE_BITS, self.dimensions)).astype(np.float32)
+        self._capacity = capacity
+
+    def _flush(self):
+        for matrix in (self._matrix, self._signatures):
+            if matrix is not None:
+                matrix.flush()
+
+    def _signature(self, vectors):
+        bits = (vectors @ self._planes.T) > 0
+        return np.packbits(bits, axis=1, bitorder="little").view(np.uint64).reshape(-1)
+
+    def _fit_vectors(self, vectors, count):
+        """Returns `vectors` if they match the index's dimensions, else zero rows (found by BM25 only)."""
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dimensions', ?)", (str(self.dimensions),))
+            self._open_matrices(INITIAL_ROWS)
+        if vectors.shape[1] == self.dimensions:
+            return vectors
+        if not self._warned_dimensions:
+            logging.warning(f"Corpus index holds {self.dimensions}-d embeddings, got {vectors.shape[1]}-d; new passages are indexed for full-text search only.")
+            self._warned_dimensions = True
+        return np.zeros((count, self.dimensions), dtype=np.float32)
+
+    # Updates
+
+    def contains(self, url):
+        """Whether an article was indexed for this URL."""
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM documents WHERE url_key = ?", (utils.normalize_url(url),)).fetchone()
+        return row is not None
+
+    def add_article(self, url, article, passages=None, vectors=None):
+        """
+        Indexes an article, replacing an earlier version of the same URL if its text changed.
+
+        Args:
+            url: The article's URL.
+            article: Dict with "text" and optionally "title", "publish_date"
+                and "keywords" (as returned by extract_article_content_with_newspaper).
+            passages, vectors: The article's passages and their embeddings,
+                if they were already computed; otherwise they are computed here.
+
+        Returns:
+            True if the index changed, False if the article was already indexed as is.
+        """
+        text = (article or {}).get("text") or ""
+        if not text.strip():
+            return False
+        url_key = utils.normalize_url(url)
+        text_hash = _text_hash(text)
+        with self._lock:
+            row = self._db.execute("SELECT doc_id, text_hash FROM documents WHERE url_key = ?", (url_key,)).fetchone()
+        if row is not None and row[1] == text_hash:
+            self.stats["articles_unchanged"] += 1
+            return False
+
+        if passages is None:
+            passages = [passage for _, passage in retrieval.split_passages([text])]
+            vectors = retrieval.embed(passages) if passages else None
+        if not passages:
+            return False
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        with self._lock:
+            vectors = self._fit_vectors(vectors, len(passages))
+            first_row = self._rows
+            if first_row + len(passages) > self._capacity:
+                self._open_matrices(first_row + len(passages))
+            # Vectors first: a crash before the commit leaves unused rows, never rows without vectors
+            self._matrix[first_row:first_row + len(passages)] = vectors
+            self._signatures[first_row:first_row + len(passages)] = self._signature(vectors)
+            passages_count, total_length = self._passages, self._total_length
+            df = Counter()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if row is not None:
+                    doc_id = row[0]
+                    # The old postings are found from the passages' text, by primary key
+                    old = self._db.execute("SELECT passage_id, text, length FROM passages WHERE doc_id = ? AND deleted = 0", (doc_id,)).fetchall()
+                    for passage_id, old_text, length in old:
+                        old_terms = set(_terms(old_text))
+                        df.subtract(old_terms)
+                        self._db.executemany("DELETE FROM postings WHERE term = ? AND passage_id = ?", [(term, passage_id) for term in old_terms])
+                        passages_count -= 1
+                        total_length -= length
+                    self._db.execute("UPDATE passages SET deleted = 1 WHERE doc_id = ?", (doc_id,))
+                    self._db.execute(
+                        "UPDATE documents SET url = ?, title = ?, publish_date = ?, keywords = ?, text_hash = ?, added_at = ? WHERE doc_id = ?",
+                        (url, article.get("title"), _date(article.get("publish_date")), json.dumps(article.get("keywords") or []),
+                         text_hash, time.time(), doc_id),
+                    )
+                else:
+                    doc_id = self._db.execute(
+                        "INSERT INTO documents (url_key, url, title, publish_date, keywords, text_hash, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (url_key, url, article.get("title"), _date(article.get("publish_date")),
+                         json.dumps(article.get("keywords") or []), text_hash, time.time()),
+                    ).lastrowid
+                for offset, passage in enumerate(passages):
+                    passage_id = first_row + offset + 1
+                    terms = Counter(_terms(passage))
+                    self._db.execute(
+                        "INSERT INTO passages (passage_id, doc_id, text, length) VALUES (?, ?, ?, ?)",
+                        (passage_id, doc_id, passage, sum(terms.values())),
+                    )
+                    self._db.executemany(
+                        "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)",
+                        [(term, passage_id, tf) for term, tf in terms.items()],
+                    )
+                    df.update(terms.keys())
+                    passages_count += 1
+                    total_length += sum(terms.values())
+                self._db.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                    [(term, change) for term, change in df.items() if change],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("passages", str(passages_count)), ("total_length", str(total_length))],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._rows = first_row + len(passages)
+            self._passages, self._total_length = passages_count, total_length
+        self.stats["articles_replaced" if row is not None else "articles_added"] += 1
+        self.stats["passages_added"] += len(passages)
+        return True
+
+    # Search
+
+    def search_bm25(self, query, k):
+        """Returns up to k (passage_id, BM25 score) pairs, best first."""
+        terms = set(_terms(query))
+        terms = (terms - STOPWORDS) or terms
+        if not terms:
+            return []
+        with self._lock:
+            count, total_length = self._passages, self._total_length
+            if not count:
+                return []
+            df = {term: self._df(term) for term in terms}
+            rare = {term for term in terms if 0 < df[term] <= MAX_TERM_DF_SHARE * count}
+            terms = rare or {term for term in terms if df[term]}
+            postings = {
+                term: self._db.execute("SELECT passage_id, tf FROM postings WHERE term = ?", (term,)).fetchall() for term in terms
+            }
+            candidates = {passage_id for rows in postings.values() for passage_id, _ in rows}
+            lengths = {}
+            candidate_list = list(candidates)
+            for start in range(0, len(candidate_list), 900):
+                chunk = candidate_list[start:start + 900]
+                lengths.update(self._db.execute(
+                    f"SELECT passage_id, length FROM passages WHERE passage_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        average_length = total_length / count
+        scores = {}
+        for term, rows in postings.items():
+            if not rows:
+                continue
+            idf = math.log(1 + (count - df[term] + 0.5) / (df[term] + 0.5))
+            for passage_id, tf in rows:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[passage_id] / average_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def _df(self, term):
+        row = self._db.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+        return row[0] if row else 0
+
+    def search_vectors(self, query_vector, k):
+        """Returns up to k (passage_id, cosine similarity) pairs, best first (approximate beyond EXACT_SEARCH_ROWS rows)."""
+        with self._lock:
+            rows = self._rows
+            if not rows or self.dimensions is None or len(query_vector) != self.dimensions:
+                return []
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            if rows <= EXACT_SEARCH_ROWS:
+                candidates = np.arange(rows)
+            else:
+                self.stats["ann_searches"] += 1
+                signature = self._signature(query_vector[None, :])[0]
+                distances = _POPCOUNT[(self._signatures[:rows] ^ signature).view(np.uint8)].reshape(rows, 8).sum(axis=1, dtype=np.uint16)
+                candidates = np.sort(np.argpartition(distances, ANN_CANDIDATES)[:ANN_CANDIDATES])
+            scores = np.asarray(self._matrix[candidates] @ query_vector)
+        best = retrieval.top_k(scores, min(k * 2, len(scores)))
+        # Rows of replaced passages are still in the matrix: overfetch and drop them when the hits are read
+        return [(int(candidates[i]) + 1, float(scores[i])) for i in best]
+
+    def search(self, query, k=20, query_vector=None):
+        """
+        Hybrid search: the BM25 and vector rankings merged by reciprocal rank fusion.
+
+        Args:
+            query: The query text.
+            k: Hits to return.
+            query_vector: The query's embedding, if already computed.
+
+        Returns:
+            Up to k IndexHit, best first.
+        """
+        self.stats["searches"] += 1
+        if query_vector is None:
+            query_vector = retrieval.embed([query])[0]
+        bm25 = dict(self.search_bm25(query, k * 2))
+        cosine = dict(self.search_vectors(query_vector, k * 2))
+        fused = {}
+        for ranking in (bm25, cosine):
+            for rank, passage_id in enumerate(ranking):
+                fused[passage_id] = fused.get(passage_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        if not fused:
+            return []
+        with self._lock:
+            ids = list(fused)
+            rows = self._db.execute(
+                "SELECT p.passage_id, d.url, d.title, d.publish_date, p.text FROM passages p JOIN documents d ON d.doc_id = p.doc_id "
+                f"WHERE p.deleted = 0 AND p.passage_id IN ({','.join('?' * len(ids))})", ids,
+            ).fetchall()
+        hits = [
+            IndexHit(passage_id, url, title, publish_date, text, fused[passage_id], bm25.get(passage_id), cosine.get(passage_id))
+            for passage_id, url, title, publish_date, text in rows
+        ]
+        hits.sort(key=lambda hit: -hit.score)
+        return hits[:k]
+
+    def vectors(self, passage_ids):
+        """The embedding rows of the given passages."""
+        with self._lock:
+            if self._matrix is None:
+                return np.zeros((len(passage_ids), 0), dtype=np.float32)
+            return np.array(self._matrix[np.asarray(passage_ids, dtype=np.int64) - 1])
+
+    def report(self):
+        """Returns this process's counters plus the index's size."""
+        with self._lock:
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {**self.stats, "documents": documents, "passages": self._passages, "matrix_rows": self._rows, "dimensions": self.dimensions}
+
+
+def _date(value):
+    return str(value) if value else None
+
+
+_default_index = None
+
+
+def get_default_index():
+    """The process-wide corpus index, created on first use under CORPUS_INDEX_DIR."""
+    global _default_index
+    if _default_index is None:
+        _default_index = CorpusIndex()
+    return _default_index
@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import instrumentation
+
+# One finished crawl task. `value` is whatever the fetch function returned,
+# `error` is set instead when the fetch raised or ran past its deadline.
+CrawlResult = namedtuple("CrawlResult", ["url", "value", "error", "elapsed"])
+
+
+class _DomainState:
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_lock = asyncio.Lock()
+        self.last_request = 0.0
+
+
+class CrawlScheduler:
+    """
+    Runs fetches concurrently with a global limit and per-domain politeness.
+
+    Results are yielded in completion order, so callers can start processing
+    the first pages while slower ones are still loading. Breaking out of the
+    loop (or reaching `stop_after`) cancels every fetch still in flight.
+
+    Usage:
+        scheduler = CrawlScheduler(max_concurrency=8)
+        async with contextlib.aclosing(scheduler.crawl(urls, fetch)) as results:
+            async for result in results:
+                ...
+    """
+
+    def __init__(self, max_concurrency=8, per_domain_concurrency=2, per_domain_interval=1.0, task_timeout=60):
+        """
+        Args:
+            max_concurrency: Maximum number of fetches in flight overall.
+            per_domain_concurrency: Maximum number of fetches in flight per domain.
+            per_domain_interval: Minimum seconds between two requests to the same domain.
+            task_timeout: Deadline in seconds for a single fetch, including retries.
+        """
+        self.max_concurrency = max_concurrency
+        self.per_domain_concurrency = per_domain_concurrency
+        self.per_domain_interval = per_domain_interval
+        self.task_timeout = task_timeout
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._domains = {}
+
+    def _domain(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._domains:
+            self._domains[host] = _DomainState(self.per_domain_concurrency)
+        return self._domains[host]
+
+    async def _wait_for_rate_limit(self, domain):
+        async with domain.rate_lock:
+            wait = domain.last_request + self.per_domain_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            domain.last_request = time.monotonic()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url):
+        """
+        Holds a fetch slot for `url`, waiting for the global and per-domain
+        limits and the domain's rate limit. For callers that run their own
+        fetch loop instead of crawl().
+        """
+        domain = self._domain(url)
+        # Take the domain slot first so a busy domain does not hold global slots.
+        async with domain.semaphore:
+            async with self._global:
+                await self._wait_for_rate_limit(domain)
+                yield
+
+    async def run(self, url, fetch):
+        """
+        Fetches one URL within the scheduler's limits and deadline, for
+        callers that schedule URLs one at a time (e.g. a pipeline stage).
+        Never raises: failures are returned in the CrawlResult.
+        """
+        queued_at = time.monotonic()
+        async with self.slot(url):
+            start = time.monotonic()
+            with instrumentation.span("crawl_task", url=url) as span:
+                span.add(queue_seconds=start - queued_at)
+                try:
+                    value = await asyncio.wait_for(fetch(url), timeout=self.task_timeout)
+                    return CrawlResult(url, value, None, time.monotonic() - start)
+                except asyncio.TimeoutError:
+                    span.add(timeouts=1)
+                    return CrawlResult(url, None, TimeoutError(f"Fetch exceeded {self.task_timeout}s deadline"), time.monotonic() - start)
+                except Exception as e:
+                    span.set(error_message=str(e))
+                    return CrawlResult(url, None, e, time.monotonic() - start)
+
+    async def crawl(self, urls, fetch, stop_after=None):
+        """
+        Fetches every URL and yields a CrawlResult as each one finishes.
+
+        Args:
+            urls: URLs to fetch. Duplicates are fetched once.
+            fetch: Coroutine function taking a URL and returning its content.
+            stop_after: Stop and cancel the remaining fetches once this many
+                successful (non-empty) results have been yielded.
+
+        Yields:
+            CrawlResult for every URL, in completion order.
+        """
+        tasks = {asyncio.ensure_future(self.run(url, fetch)) for url in dict.fromkeys(urls)}
+        succeeded = 0
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result.error is None and result.value:
+                        succeeded += 1
+                    yield result
+                if stop_after is not None and succeeded >= stop_after:
+                    logging.info(f"Crawl reached {succeeded} results. Cancelling {len(tasks)} remaining fetches.")
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
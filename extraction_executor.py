@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import web_crawler
+
+EXTRACTORS = {
+    "newspaper": lambda html, url, nlp: web_crawler.extract_article_content_with_newspaper_sync(html, url, nlp),
+    "trafilatura": lambda html, url, nlp: web_crawler.extract_article_content_with_trafilatura_sync(html),
+}
+
+
+def _extract_batch(items, extractor, nlp):
+    """
+    Runs in a worker process. Extracts every (html, url) pair in the batch and
+    returns ("ok", result) or ("error", message) for each, so one bad page
+    does not fail the whole batch.
+    """
+    extract = EXTRACTORS[extractor]
+    results = []
+    for html, url in items:
+        try:
+            results.append(("ok", extract(html, url, nlp)))
+        except Exception as e:
+            results.append(("error", f"{type(e).__name__}: {e}"))
+    return results
+
+
+class ExtractionExecutor:
+    """
+    Runs article extraction in a pool of worker processes.
+
+    Single calls to extract() are collected into small batches (up to
+    `batch_size` pages, or whatever arrived within `batch_delay` seconds) so
+    the pickling round-trip to a worker is paid once per batch rather than
+    once per page. The event loop only awaits futures and never parses HTML.
+
+    Usage:
+        async with ExtractionExecutor(max_workers=4) as executor:
+            article = await web_crawler.extract_article_content_with_newspaper(html, url, executor=executor)
+    """
+
+    def __init__(self, max_workers=None, batch_size=8, batch_delay=0.02):
+        """
+        Args:
+            max_workers: Worker processes (defaults to the number of CPUs).
+            batch_size: Pages sent to a worker in one batch.
+            batch_delay: Seconds to wait for a batch to fill before sending it anyway.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Spawn rather than fork: the parent holds an event loop, Playwright pipes and SQLite handles
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._pending = {}
+        self._timers = {}
+        self.stats = {"documents": 0, "batches": 0, "errors": 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Flushes pending batches and shuts the worker processes down."""
+        for key in list(self._pending):
+            self._flush(key)
+        await asyncio.get_running_loop().run_in_executor(None, self._pool.shutdown)
+
+    async def extract(self, html_content, url, extractor="newspaper", nlp=True):
+        """
+        Extracts one page in a worker process.
+
+        Args:
+            html_content: HTML of the page.
+            url: URL of the page (used by newspaper).
+            extractor: "newspaper" or "trafilatura".
+            nlp: Whether newspaper should also compute summary and keywords.
+
+        Returns:
+            The extractor's result for this page.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (extractor, nlp)
+        self._pending.setdefault(key, []).append(((html_content, url), future))
+        if len(self._pending[key]) >= self.batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.batch_delay, self._flush, key)
+        return await future
+
+    async def extract_many(self, pages, extractor="newspaper", nlp=True):
+        """
+        Extracts a list of (html, url) pairs, batch_size pages per worker task.
+
+        Returns:
+            Results in the same order as `pages`. Pages that failed to parse
+            are returned as None.
+        """
+        loop = asyncio.get_running_loop()
+        batches = [pages[i:i + self.batch_size] for i in range(0, len(pages), self.batch_size)]
+        outputs = await asyncio.gather(*(
+            loop.run_in_executor(self._pool, _extract_batch, batch, extractor, nlp) for batch in batches
+        ))
+        self.stats["batches"] += len(batches)
+        results = []
+        for status, value in (item for output in outputs for item in output):
+            self.stats["documents"] += 1
+            if status == "ok":
+                results.append(value)
+            else:
+                self.stats["errors"] += 1
+                logging.warning(f"Extraction failed: {value}")
+                results.append(None)
+        return results
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        self.stats["batches"] += 1
+        done = asyncio.wrap_future(self._pool.submit(_extract_batch, items, *key))
+        done.add_done_callback(lambda task: self._resolve(futures, task))
+
+    def _resolve(self, futures, task):
+        if task.cancelled() or task.exception() is not None:
+            error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for future, (status, value) in zip(futures, task.result()):
+            self.stats["documents"] += 1
+            if future.done():
+                continue  # Caller gave up waiting
+            if status == "ok":
+                future.set_result(value)
+            else:
+                self.stats["errors"] += 1
+                future.set_exception(RuntimeError(value))
@@ -0,0 +1,329 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import utils
+
+DEFAULT_FRONTIER_PATH = os.getenv("FRONTIER_PATH", os.path.join(".cache", "frontier.sqlite3"))
+
+# Queued URLs kept per session; the lowest scored are dropped beyond this
+DEFAULT_MAX_QUEUED = 50000
+# Candidates read from the index on each pop before the diversity penalty is applied
+POP_CANDIDATES = 64
+# Score removed for every page already visited on the same domain
+DOMAIN_PENALTY = 0.15
+
+# Prior authority of well-known sources, by host suffix. Unknown hosts score 0.3.
+AUTHORITY = {
+    "wikipedia.org": 1.0,
+    ".gov": 0.9,
+    ".edu": 0.9,
+    ".ac.uk": 0.9,
+    "britannica.com": 0.9,
+    "scholar.google.com": 0.8,
+    "researchgate.net": 0.7,
+    "orcid.org": 0.8,
+    "linkedin.com": 0.7,
+    "crunchbase.com": 0.6,
+    "reuters.com": 0.8,
+    "apnews.com": 0.8,
+    "bbc.co.uk": 0.8,
+    "bbc.com": 0.8,
+    "nytimes.com": 0.7,
+    "theguardian.com": 0.7,
+    "forbes.com": 0.6,
+    "imdb.com": 0.6,
+    "x.com": 0.5,
+    "twitter.com": 0.5,
+    "instagram.com": 0.5,
+    "facebook.com": 0.5,
+    "pinterest.com": 0.1,
+}
+DEFAULT_AUTHORITY = 0.3
+
+# A URL handed out by pop(). `score` is the stored priority before the diversity penalty.
+FrontierItem = namedtuple("FrontierItem", ["url", "score", "depth", "source"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    session TEXT NOT NULL,
+    url_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    score REAL NOT NULL,
+    depth INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    state TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    PRIMARY KEY (session, url_key)
+);
+CREATE INDEX IF NOT EXISTS urls_queue ON urls (session, state, score);
+CREATE TABLE IF NOT EXISTS domains (
+    session TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (session, domain)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def domain_of(url):
+    host = urlparse(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def authority(url):
+    """Prior trust in a URL's host, from AUTHORITY (longest matching suffix wins)."""
+    host = domain_of(url)
+    best, best_length = DEFAULT_AUTHORITY, 0
+    for suffix, value in AUTHORITY.items():
+        if (host == suffix.lstrip(".") or host.endswith(suffix if suffix.startswith(".") else "." + suffix)) \
+                and len(suffix) > best_length:
+            best, best_length = value, len(suffix)
+    return best
+
+
+def identity_match(identity_terms, *texts):
+    """Fraction of the identity terms (e.g. the person's name parts) found in the URL, title or snippet."""
+    if not identity_terms:
+        return 0.0
+    haystack = " ".join(t for t in texts if t).lower()
+    words = set(re.findall(r"[a-z0-9]+", haystack))
+    return sum(1 for term in identity_terms if term in words) / len(identity_terms)
+
+
+def score_url(url, identity_terms, title="", snippet="", rank=None, depth=0):
+    """
+    Priority of a URL before the per-domain diversity penalty, roughly 0..1.
+
+    Args:
+        url: The candidate URL.
+        identity_terms: Lowercase terms identifying the subject.
+        title: Search result title or link text, if known.
+        snippet: Search result snippet, if known.
+        rank: Position in the search results (0 = first), if it came from a search.
+        depth: Links followed from a search result to reach this URL.
+    """
+    score = 0.4 * authority(url) + 0.45 * identity_match(identity_terms, url.replace("-", " ").replace("_", " "), title, snippet)
+    if rank is not None:
+        score += 0.15 / (1 + rank)
+    return score - 0.05 * depth
+
+
+class Frontier:
+    """
+    Priority queue of URLs to visit, stored in SQLite.
+
+    URLs are canonicalized with utils.normalize_url, so tracking parameters,
+    fragments and case differences do not produce duplicate visits; a URL is
+    never queued twice in a session. pop() returns the highest-scoring URL
+    after penalizing domains that have already been visited, which spreads
+    the crawl across sources instead of draining one site.
+
+    Only a handful of rows are in memory at any time, so frontiers far
+    larger than RAM work. A session picks up where it left off: URLs handed
+    out but never finished (the process crashed) are queued again, and
+    callers can persist their own progress with save_state().
+
+    Usage:
+        with Frontier("person:ada lovelace", identity_terms=["ada", "lovelace"]) as frontier:
+            frontier.add(url, title=title, snippet=snippet, rank=0)
+            while (item := frontier.pop()) is not None:
+                ...
+                frontier.done(item.url)
+    """
+
+    def __init__(self, session, path=DEFAULT_FRONTIER_PATH, identity_terms=None, max_queued=DEFAULT_MAX_QUEUED):
+        """
+        Args:
+            session: Name of the crawl; reopening the same session resumes it.
+            path: SQLite file holding every session.
+            identity_terms: Lowercase terms identifying the subject, used for scoring.
+            max_queued: Queued URLs kept; the lowest scored are dropped beyond this.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.session = session
+        self.identity_terms = [t.lower() for t in identity_terms or []]
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self.stats = {"added": 0, "duplicates": 0, "dropped": 0, "popped": 0, "requeued": 0}
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE urls SET state = 'queued' WHERE session = ? AND state = 'in_progress'", (session,)
+            )
+            self.stats["requeued"] = cursor.rowcount
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM urls WHERE session = ? AND state = 'queued'", (self.session,)
+            ).fetchone()[0]
+
+    def seen(self, url):
+        """Whether the URL (in any spelling that normalizes the same) was ever added to this session."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM urls WHERE session = ? AND url_key = ?", (self.session, utils.normalize_url(url))
+            ).fetchone() is not None
+
+    def add(self, url, title="", snippet="", rank=None, depth=0, source="search", score=None):
+        """
+        Queues a URL unless it was already seen in this session.
+
+        Args:
+            url: The URL to visit.
+            title, snippet, rank, depth: Passed to score_url().
+            source: Where the URL came from ("search", "discovery", ...).
+            score: Explicit priority, overriding score_url().
+
+        Returns:
+            True if the URL was new.
+        """
+        if not url.startswith(("http://", "https://")):
+            return False
+        if score is None:
+            score = score_url(url, self.identity_terms, title, snippet, rank, depth)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO urls (session, url_key, url, domain, score, depth, source, state, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (self.session, utils.normalize_url(url), url, domain_of(url), score, depth, source, time.time()),
+            )
+            if cursor.rowcount == 0:
+                self.stats["duplicates"] += 1
+                return False
+            self.stats["added"] += 1
+            if self.stats["added"] % 256 == 0:
+                self._trim()
+        return True
+
+    def _trim(self):
+        overflow = self._db.execute(
+            "SELECT COUNT(*) FROM urls WHERE session = ? AND state = 'queued'", (self.session,)
+        ).fetchone()[0] - self.max_queued
+        if overflow > 0:
+            # Dropped rows stay in the table so the URLs still count as seen
+            self._db.execute(
+                "UPDATE urls SET state = 'dropped' WHERE rowid IN ("
+                "SELECT rowid FROM urls WHERE session = ? AND state = 'queued' ORDER BY score LIMIT ?)",
+                (self.session, overflow),
+            )
+            self.stats["dropped"] += overflow
+
+    def pop(self):
+        """
+        Hands out the best URL, marking it in progress.
+
+        Returns:
+            A FrontierItem, or None when the frontier is empty.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT u.url_key, u.url, u.domain, u.score, u.depth, u.source, COALESCE(d.visits, 0) "
+                "FROM (SELECT * FROM urls WHERE session = ? AND state = 'queued' ORDER BY score DESC LIMIT ?) u "
+                "LEFT JOIN domains d ON d.session = ? AND d.domain = u.domain",
+                (self.session, POP_CANDIDATES, self.session),
+            ).fetchall()
+            if not rows:
+                return None
+            url_key, url, domain, score, depth, source, _ = max(rows, key=lambda r: r[3] - DOMAIN_PENALTY * r[6])
+            self._db.execute(
+                "UPDATE urls SET state = 'in_progress' WHERE session = ? AND url_key = ?", (self.session, url_key)
+            )
+            self._db.execute(
+                "INSERT INTO domains (session, domain, visits) VALUES (?, ?, 1) "
+                "ON CONFLICT (session, domain) DO UPDATE SET visits = visits + 1",
+                (self.session, domain),
+            )
+            self.stats["popped"] += 1
+        return FrontierItem(url, score, depth, source)
+
+    def done(self, url, success=True):
+        """Marks a popped URL as finished so it is not handed out again after a restart."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE urls SET state = ? WHERE session = ? AND url_key = ?",
+                ("done" if success else "failed", self.session, utils.normalize_url(url)),
+            )
+
+    def release(self, url):
+        """Puts a popped URL back in the queue unvisited, e.g. when the crawl stops before getting to it."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE urls SET state = 'queued' WHERE session = ? AND url_key = ? AND state = 'in_progress'",
+                (self.session, utils.normalize_url(url)),
+            )
+            if cursor.rowcount:
+                self._db.execute(
+                    "UPDATE domains SET visits = visits - 1 WHERE session = ? AND domain = ? AND visits > 0",
+                    (self.session, domain_of(url)),
+                )
+
+    def save_state(self, state, done=()):
+        """
+        Stores a JSON-serializable dict with the caller's progress for this session.
+
+        Args:
+            state: The progress to store.
+            done: (url, success) pairs of popped URLs whose results `state`
+                includes; they are marked finished in the same transaction.
+        """
+        payload = json.dumps(state, default=str)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (session, state, updated_at) VALUES (?, ?, ?)",
+                    (self.session, payload, time.time()),
+                )
+                self._db.executemany(
+                    "UPDATE urls SET state = ? WHERE session = ? AND url_key = ?",
+                    [("done" if success else "failed", self.session, utils.normalize_url(url)) for url, success in done],
+                )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def load_state(self):
+        """Returns the dict last passed to save_state(), or None for a new session."""
+        with self._lock:
+            row = self._db.execute("SELECT state FROM sessions WHERE session = ?", (self.session,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def clear(self):
+        """Forgets the session entirely, e.g. once it has completed."""
+        with self._lock:
+            for table in ("urls", "domains", "sessions"):
+                self._db.execute(f"DELETE FROM {table} WHERE session = ?", (self.session,))
+
+    def report(self):
+        """Returns URL counts per state and the stats counters."""
+        with self._lock:
+            states = dict(self._db.execute(
+                "SELECT state, COUNT(*) FROM urls WHERE session = ? GROUP BY state", (self.session,)
+            ).fetchall())
+        return {"states": states, **self.stats}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -2,6 +2,17 @@
 #https://programmablesearchengine.google.com/controlpanel/all
 
 import requests
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+import httpx
+
+import instrumentation
 
 
 # import keyring
@@ -20,7 +31,7 @@ search_engine_id = os.getenv("SEARCH_ENGINE_ID")
 
 # gemini_key = os.getenv("gemini_key")
 
-def google_search_api(query, gemini_key, search_engine_id, num_results=10):
+def google_search_api(query, gemini_key, search_engine_id, num_results=10, cache=None):
     """
     perform a google search using google custom search json api and return results.
     
@@ -28,18 +39,31 @@ def google_search_api(query, gemini_key, search_engine_id, num_results=10):
     :param gemini_key: your google api key.
     :param search_engine_id: your google custom search engine id.
     :param num_results: number of results to fetch (default is 10).
+    :param cache: optional page_cache.PageCache; responses are stored without the api key and reused while fresh (or always, in offline mode).
     :return: list of search results with title, link, and snippet.
     """
     url = "https://www.googleapis.com/customsearch/v1"
     params = {
         "q": query,
         "key": gemini_key,
-        "search_engine_id": search_engine_id,
+        "cx": search_engine_id,
         "num": num_results
     } 
 
-    response = requests.get(url, params=params)
-    data = response.json()
+    data = None
+    if cache is not None:
+        cache_url = url + "?" + urlencode({k: v for k, v in params.items() if k != "key"})
+        cached = cache.get(cache_url)
+        if cached is not None and (cached.fresh or cache.offline):
+            data = json.loads(cached.html)
+        elif cache.offline:
+            return {"error": "offline mode: search not in cache."}
+
+    if data is None:
+        response = requests.get(url, params=params)
+        data = response.json()
+        if cache is not None and "items" in data:
+            cache.put(cache_url, response.text)
     
     #check if there are search results in the response
     if "items" in data:
@@ -55,6 +79,297 @@ def google_search_api(query, gemini_key, search_engine_id, num_results=10):
         return {"error": "no results found or invalid api key."}
 
 
+# Async client: one shared connection pool, concurrent fan-out over many
+# queries, pagination past 10 results, caching and duplicate-query collapsing.
+SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+RESULTS_PER_PAGE = 10   # API maximum for "num"
+MAX_RESULTS = 100       # API never returns results past start=91
+DAILY_QUOTA = int(os.getenv("SEARCH_DAILY_QUOTA", 100))   # free tier: 100 queries/day
+QUERIES_PER_SECOND = float(os.getenv("SEARCH_QPS", 5))
+# API calls made per UTC day, shared by every client, run and process using this file
+SEARCH_QUOTA_PATH = os.getenv("SEARCH_QUOTA_PATH", os.path.join(".cache", "search_quota.sqlite3"))
+SIMILAR_QUERY_JACCARD = 0.8
+
+# words ignored when deciding whether two queries are the same search
+QUERY_STOPWORDS = {"a", "an", "the", "is", "are", "what", "whats", "s", "of", "for", "to", "in", "on",
+                   "and", "or", "me", "can", "you", "about", "how", "do", "does", "i", "just", "up", "there"}
+
+def query_terms(query):
+    """The set of meaningful lowercase terms in a query."""
+    terms = set(re.findall(r"\w+", query.lower().replace("'", ""))) - QUERY_STOPWORDS
+    return frozenset(terms) or frozenset(re.findall(r"\w+", query.lower()))
+
+def collapse_queries(queries):
+    """
+    Groups duplicate and near-identical queries (same terms ignoring case,
+    punctuation and stopwords, or a term-set Jaccard similarity of at least
+    SIMILAR_QUERY_JACCARD).
+
+    :return: dict mapping each representative query to the list of queries it stands for.
+    """
+    groups = {}
+    representatives = []
+    for query in queries:
+        terms = query_terms(query)
+        for rep, rep_terms in representatives:
+            union = terms | rep_terms
+            if union and len(terms & rep_terms) / len(union) >= SIMILAR_QUERY_JACCARD:
+                groups[rep].append(query)
+                break
+        else:
+            representatives.append((query, terms))
+            groups[query] = [query]
+    return groups
+
+class _RateLimiter:
+    """
+    Spaces requests to `rate` per second and refuses them once the daily quota is used.
+
+    With a `path`, the calls made each UTC day are counted in SQLite (one
+    atomic increment per call), so the quota holds across runs, restarts and
+    processes sharing the file; otherwise they are counted in memory.
+    Thread-safe and not tied to an event loop, so one limiter serves the
+    whole process.
+    """
+
+    def __init__(self, rate, daily_quota, path=None):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.daily_quota = daily_quota
+        self.used_today = 0
+        self._day = time.strftime("%Y-%m-%d", time.gmtime())
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, calls INTEGER NOT NULL)")
+            self.used_today = self._stored_calls(self._day)
+
+    def _stored_calls(self, day):
+        row = self._db.execute("SELECT calls FROM usage WHERE day = ?", (day,)).fetchone()
+        return row[0] if row else 0
+
+    def quota_left(self):
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        with self._lock:
+            if today != self._day:
+                self._day, self.used_today = today, 0
+            if self._db is not None:
+                self.used_today = self._stored_calls(today)
+            return self.daily_quota - self.used_today
+
+    def _reserve(self):
+        """Counts one call against today's quota; False if it is used up."""
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        with self._lock:
+            if today != self._day:
+                self._day, self.used_today = today, 0
+            if self.daily_quota <= 0:
+                return False
+            if self._db is None:
+                if self.used_today >= self.daily_quota:
+                    return False
+                self.used_today += 1
+                return True
+            row = self._db.execute(
+                "INSERT INTO usage (day, calls) VALUES (?, 1) ON CONFLICT(day) DO UPDATE SET calls = calls + 1 "
+                "WHERE calls < ? RETURNING calls",
+                (today, self.daily_quota),
+            ).fetchone()
+            if row is None:
+                self.used_today = self.daily_quota
+                return False
+            self.used_today = row[0]
+            return True
+
+    async def acquire(self):
+        # The SQLite write runs off the event loop
+        allowed = await asyncio.to_thread(self._reserve) if self._db is not None else self._reserve()
+        if not allowed:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+_default_limiter = None
+
+def get_default_limiter():
+    """
+    Returns the process-wide limiter, created on first use from SEARCH_QPS,
+    SEARCH_DAILY_QUOTA and SEARCH_QUOTA_PATH and shared by every SearchClient.
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        _default_limiter = _RateLimiter(QUERIES_PER_SECOND, DAILY_QUOTA, SEARCH_QUOTA_PATH)
+    return _default_limiter
+
+class SearchClient:
+    """
+    Async Google Custom Search client.
+
+    Usage:
+        async with SearchClient(cache=page_cache.get_default_cache()) as client:
+            results_by_query = await client.search_many(queries)
+    """
+
+    def __init__(self, api_key=None, cx=None, cache=None, http_client=None, queries_per_second=None, daily_quota=None):
+        """
+        :param api_key: Google API key (defaults to GEMINI_KEY from the environment).
+        :param cx: Custom search engine id (defaults to SEARCH_ENGINE_ID).
+        :param cache: optional page_cache.PageCache; responses are stored without the api key and reused while fresh (or always, in offline mode).
+        :param http_client: shared httpx.AsyncClient; one is created (and closed) by the client otherwise.
+        :param queries_per_second: request pacing.
+        :param daily_quota: API calls allowed per UTC day; further searches are answered from the cache only.
+            Without either, the client uses the process-wide limiter (get_default_limiter()), so pacing and
+            quota are shared by every client and the quota persists across runs; with either, it gets
+            its own limiter, counted in memory.
+        """
+        self.api_key = api_key or gemini_key
+        self.cx = cx or search_engine_id
+        self.cache = cache
+        self._http_client = http_client
+        self._owns_client = http_client is None
+        if queries_per_second is None and daily_quota is None:
+            self._limiter = get_default_limiter()
+        else:
+            self._limiter = _RateLimiter(
+                QUERIES_PER_SECOND if queries_per_second is None else queries_per_second,
+                DAILY_QUOTA if daily_quota is None else daily_quota,
+            )
+        self._inflight = {}
+        self.stats = {"searches": 0, "api_calls": 0, "cache_hits": 0, "collapsed": 0, "quota_refusals": 0}
+
+    async def __aenter__(self):
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=20, http2=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._owns_client and self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    async def _fetch_page(self, query, start, num):
+        params = {"q": query, "cx": self.cx, "num": num, "start": start}
+        cache_url = SEARCH_URL + "?" + urlencode(params)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, cache_url)
+            if cached is not None and (cached.fresh or self.cache.offline):
+                self.stats["cache_hits"] += 1
+                instrumentation.count(cache_hits=1)
+                return json.loads(cached.html)
+            if self.cache.offline:
+                return {}
+
+        # Identical page requests already in flight share one API call
+        if cache_url in self._inflight:
+            return await asyncio.shield(self._inflight[cache_url])
+        task = asyncio.ensure_future(self._call_api(params, cache_url))
+        self._inflight[cache_url] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._inflight.pop(cache_url, None)
+
+    async def _call_api(self, params, cache_url):
+        with instrumentation.span("search_api", start=params["start"]) as span:
+            waiting_since = time.perf_counter()
+            allowed = await self._limiter.acquire()
+            span.add(queue_seconds=time.perf_counter() - waiting_since)
+            if not allowed:
+                self.stats["quota_refusals"] += 1
+                span.set(quota_refused=True)
+                logging.warning(f"Search quota exhausted; skipping API call for '{params['q']}'.")
+                return {}
+            self.stats["api_calls"] += 1
+            response = await self._http_client.get(SEARCH_URL, params={**params, "key": self.api_key})
+            span.set(status=response.status_code)
+            span.add(bytes_fetched=len(response.content))
+        if response.status_code != 200:
+            # Error pages are not always JSON
+            try:
+                message = response.json().get("error", {}).get("message", "")
+            except (ValueError, AttributeError):
+                message = response.text[:200]
+            logging.error(f"Search API error {response.status_code} for '{params['q']}': {message}")
+            return {}
+        data = response.json()
+        if self.cache is not None and "items" in data:
+            await asyncio.to_thread(self.cache.put, cache_url, response.text)
+        return data
+
+    async def search(self, query, num_results=RESULTS_PER_PAGE):
+        """
+        Searches one query, fetching as many result pages as `num_results` needs.
+
+        :return: list of results with title, link, and snippet (empty if none).
+        """
+        self.stats["searches"] += 1
+        num_results = min(num_results, MAX_RESULTS)
+        with instrumentation.span("search", query=query) as span:
+            results = await self._search(query, num_results)
+            span.set(results=len(results))
+        return results
+
+    async def _search(self, query, num_results):
+        first = await self._fetch_page(query, 1, min(num_results, RESULTS_PER_PAGE))
+        items = list(first.get("items", []))
+        total = int(first.get("searchInformation", {}).get("totalResults", 0) or 0)
+        wanted = min(num_results, total) if total else len(items)
+        if len(items) == RESULTS_PER_PAGE and wanted > RESULTS_PER_PAGE:
+            starts = range(RESULTS_PER_PAGE + 1, wanted + 1, RESULTS_PER_PAGE)
+            pages = await asyncio.gather(*(
+                self._fetch_page(query, start, min(RESULTS_PER_PAGE, wanted - start + 1)) for start in starts
+            ))
+            for page in pages:
+                items.extend(page.get("items", []))
+        return [
+            {
+                "title": result.get("title"),
+                "link": result.get("link"),
+                "snippet": result.get("snippet")
+            }
+            for result in items[:num_results]
+        ]
+
+    async def search_many(self, queries, num_results=RESULTS_PER_PAGE):
+        """
+        Searches all queries concurrently, issuing one search per group of
+        near-identical queries.
+
+        :return: dict mapping every query in `queries` to its results.
+        """
+        groups = collapse_queries(queries)
+        self.stats["collapsed"] += len(queries) - len(groups)
+        representatives = list(groups)
+        outcomes = await asyncio.gather(*(self.search(q, num_results) for q in representatives), return_exceptions=True)
+        results = {}
+        for rep, outcome in zip(representatives, outcomes):
+            if isinstance(outcome, Exception):
+                logging.error(f"Error performing Google search for '{rep}': {outcome}")
+                outcome = []
+            for query in groups[rep]:
+                results[query] = outcome
+        return results
+
+def unique_results(results_by_query):
+    """Flattens search_many() output, keeping the first result for each link."""
+    seen = set()
+    merged = []
+    for results in results_by_query.values():
+        for result in results:
+            if result["link"] not in seen:
+                seen.add(result["link"])
+                merged.append(result)
+    return merged
+
+
 #standard python entry point
 if __name__ == "__main__":
     # Example usage:
@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+# Where per-run timing reports are written ("" disables the files)
+DEFAULT_TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(".cache", "traces"))
+# Runs kept in the trace directory; the oldest are deleted beyond this
+MAX_TRACE_FILES = int(os.getenv("TRACE_MAX_FILES", 200))
+# Spans kept per run for export. Stage statistics always count every span.
+MAX_SPANS_PER_RUN = 5000
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Log file written next to the console output ("" for the console only)
+LOG_FILE = os.getenv("LOG_FILE", "myapp.log")
+LOG_FORMAT = "%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s"
+
+SERVICE_NAME = "deep-research"
+
+_current_run = contextvars.ContextVar("instrumentation_run", default=None)
+_current_span = contextvars.ContextVar("instrumentation_span", default=None)
+_logging_configured = False
+
+
+class Span:
+    """One timed operation. Attributes describe it; counters (bytes, tokens, seconds waited...) are summed per stage in the report."""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "counters", "error", "_started")
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.counters = {}
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._started = time.perf_counter_ns()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _end(self):
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._started
+
+    @property
+    def duration(self):
+        end_ns = self.end_ns if self.end_ns is not None else self.start_ns + time.perf_counter_ns() - self._started
+        return (end_ns - self.start_ns) / 1e9
+
+
+class _NoopSpan:
+    """Stands in for a span outside any run, so instrumented code costs next to nothing there."""
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, **counters):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class Run:
+    """
+    Spans recorded for one pipeline run, with a per-stage timing report and
+    an OpenTelemetry (OTLP/JSON) export.
+    """
+
+    def __init__(self, name, attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, None, attributes)
+        self.spans = []
+        self.dropped = 0
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.root.name
+
+    def _record(self, span):
+        # Spans end on the event loop and in worker threads alike
+        with self._lock:
+            stage = self._stages.setdefault(span.name, {"durations": [], "errors": 0, "counters": {}})
+            stage["durations"].append(span.duration)
+            if span.error:
+                stage["errors"] += 1
+            for key, value in span.counters.items():
+                stage["counters"][key] = stage["counters"].get(key, 0) + value
+            if len(self.spans) < MAX_SPANS_PER_RUN:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def total(self, *counters):
+        """Sum of the given counters over every span that has ended so far (e.g. total("tokens_in", "tokens_out"))."""
+        with self._lock:
+            return sum(stage["counters"].get(key, 0) for stage in self._stages.values() for key in counters)
+
+    def report(self):
+        """
+        Returns the run's timing report: for every stage (span name) the
+        number of spans, total, p50, p95 and max seconds, errors and the sum
+        of each counter (bytes, tokens, cache hits, queue seconds...).
+        Spans of one stage may overlap, so their total can exceed the run's duration.
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    "count": len(stage["durations"]),
+                    "total_seconds": sum(stage["durations"]),
+                    "p50_seconds": _percentile(stage["durations"], 0.5),
+                    "p95_seconds": _percentile(stage["durations"], 0.95),
+                    "max_seconds": max(stage["durations"]),
+                    "errors": stage["errors"],
+                    **stage["counters"],
+                }
+                for name, stage in self._stages.items()
+            }
+            recorded, dropped = len(self.spans), self.dropped
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "attributes": self.root.attributes,
+            "started_at": self.root.start_ns / 1e9,
+            "duration_seconds": self.root.duration,
+            "error": self.root.error,
+            "stages": stages,
+            "spans_recorded": recorded,
+            "spans_dropped": dropped,
+        }
+
+    def to_otlp(self):
+        """Returns the spans in the OTLP/JSON trace format, ready for a collector's /v1/traces endpoint."""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [
+                        {
+                            "traceId": self.trace_id,
+                            "spanId": span.span_id,
+                            "parentSpanId": span.parent_id or "",
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(span.start_ns),
+                            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                            "attributes": _otlp_attributes({**span.attributes, **span.counters}),
+                            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                        }
+                        for span in spans
+                    ],
+                }],
+            }],
+        }
+
+    def _finish(self, trace_dir):
+        self._record(self.root)
+        report = self.report()
+        stages = ", ".join(
+            f"{name} {stage['count']}x p50 {stage['p50_seconds']:.2f}s" for name, stage in report["stages"].items() if name != self.name
+        )
+        logging.info(f"Run '{self.name}' took {report['duration_seconds']:.1f}s: {stages}")
+        if trace_dir:
+            try:
+                _write_trace_files(trace_dir, self, report)
+            except OSError as e:
+                logging.warning(f"Could not write the trace of run {self.trace_id}: {e}")
+        _export_opentelemetry(self)
+        return report
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _write_trace_files(trace_dir, run, report):
+    os.makedirs(trace_dir, exist_ok=True)
+    with open(os.path.join(trace_dir, f"{run.trace_id}.json"), "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    with open(os.path.join(trace_dir, f"{run.trace_id}.otlp.json"), "w") as f:
+        json.dump(run.to_otlp(), f, default=str)
+    reports = sorted(
+        (entry for entry in os.scandir(trace_dir) if entry.name.endswith(".json") and not entry.name.endswith(".otlp.json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in reports[:max(len(reports) - MAX_TRACE_FILES, 0)]:
+        for path in (entry.path, entry.path[:-len(".json")] + ".otlp.json"):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+def _export_opentelemetry(run):
+    """Replays the run into the OpenTelemetry SDK when it is installed and configured (e.g. with an OTLP exporter)."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return
+    tracer = trace.get_tracer(__name__)
+    exported = {}
+    try:
+        for span in sorted(run.spans, key=lambda s: s.start_ns):
+            parent = exported.get(span.parent_id)
+            otel_span = tracer.start_span(
+                span.name,
+                context=trace.set_span_in_context(parent) if parent is not None else None,
+                start_time=span.start_ns,
+                attributes={
+                    k: v if isinstance(v, (bool, int, float, str)) else str(v)
+                    for k, v in {**span.attributes, **span.counters}.items() if v is not None
+                },
+            )
+            if span.error:
+                otel_span.set_status(trace.Status(trace.StatusCode.ERROR, span.error))
+            otel_span.end(end_time=span.end_ns or span.start_ns)
+            exported[span.span_id] = otel_span
+    except Exception as e:
+        logging.warning(f"OpenTelemetry export failed: {e}")
+
+
+def _reset(variable, token):
+    # An async generator closed by the garbage collector exits in another context
+    with contextlib.suppress(ValueError):
+        variable.reset(token)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a child of the current span. Works in sync
+    code, coroutines, async generators and threads started with
+    asyncio.to_thread (context variables follow the work). Outside a run it
+    does nothing.
+
+    Usage:
+        with instrumentation.span("fetch", url=url) as s:
+            html = await fetch(url)
+            s.add(bytes=len(html))
+    """
+    run = _current_run.get()
+    if run is None:
+        yield _NOOP
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else run.root.span_id, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except (asyncio.CancelledError, GeneratorExit):
+        # Work cut short on purpose (early stop, client gone) is not an error
+        current.set(cancelled=True)
+        raise
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        raise
+    finally:
+        current._end()
+        _reset(_current_span, token)
+        run._record(current)
+
+
+@contextlib.contextmanager
+def run(name, trace_dir=DEFAULT_TRACE_DIR, **attributes):
+    """
+    Records every span in the enclosed block as one run. When the block
+    ends, a one-line timing summary is logged, the report and OTLP/JSON
+    trace are written to `trace_dir` and the spans are exported through the
+    OpenTelemetry SDK if it is installed. Inside another run this is just a
+    span of that run.
+
+    Usage:
+        with instrumentation.run("research_query", query=query) as trace:
+            ...
+        trace.report()
+    """
+    outer = _current_run.get()
+    if outer is not None:
+        with span(name, **attributes):
+            yield outer
+        return
+    current = Run(name, attributes)
+    run_token = _current_run.set(current)
+    span_token = _current_span.set(current.root)
+    try:
+        yield current
+    except BaseException as e:
+        current.root.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        raise
+    finally:
+        current.root._end()
+        _reset(_current_span, span_token)
+        _reset(_current_run, run_token)
+        current._finish(trace_dir)
+
+
+def current_run():
+    """The run being recorded in this context, or None."""
+    return _current_run.get()
+
+
+def annotate(**attributes):
+    """Sets attributes on the current span."""
+    (_current_span.get() or _NOOP).set(**attributes)
+
+
+def count(**counters):
+    """Adds to counters on the current span (e.g. bytes=len(html), cache_hits=1)."""
+    (_current_span.get() or _NOOP).add(**counters)
+
+
+class _TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        current = _current_run.get()
+        record.trace_id = current.trace_id[:8] if current is not None else "-"
+        return True
+
+
+def configure_logging(level=LOG_LEVEL, filename=LOG_FILE):
+    """
+    Configures the root logger for the whole process: the console plus,
+    unless `filename` is empty, a log file. Every line carries the short
+    trace id of the run it belongs to. Only the first call has an effect,
+    so entry points can all call it.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    handlers = [logging.StreamHandler()]
+    if filename:
+        handlers.append(logging.FileHandler(filename))
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(_TraceIdFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in handlers:
+        root.addHandler(handler)
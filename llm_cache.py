@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import retrieval
+
+# Defaults, overridable through the environment
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite3"))
+DEFAULT_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 50000))
+# Cosine similarity at which a different prompt may reuse a cached answer (0 = exact matches only)
+DEFAULT_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", 0))
+# Most recent entries compared in a similarity lookup
+SIMILARITY_CANDIDATES = 2000
+# Prompts longer than this are only matched exactly: small edits to long
+# prompts (a different page, another article) change the right answer
+SIMILARITY_MAX_CHARS = 2000
+
+# A cached answer. `backend` is the one that originally produced it;
+# `similarity` is 1.0 for an exact match.
+CachedResponse = namedtuple("CachedResponse", ["text", "backend", "similarity"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    call_site TEXT NOT NULL,
+    response TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    embedding BLOB,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope, created_at);
+"""
+
+
+def _digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _embed(text):
+    return retrieval.embed([text])[0].astype(np.float32)
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM responses.
+
+    Entries are keyed by the model, the call parameters and the exact
+    prompt. Optionally, a short prompt that misses can still reuse the
+    answer to a near-identical earlier prompt with the same model and
+    parameters, when their embeddings' cosine similarity reaches
+    `similarity_threshold`.
+
+    Entries expire after `ttl_seconds`; beyond `max_entries` the least
+    recently used are evicted. The SQLite store runs in WAL mode, so
+    concurrent workers and processes can share one cache file.
+
+    Usage:
+        cache = LLMCache()
+        cached = cache.get("gemma-3-12b-it", prompt, {"max_tokens": None}, call_site="classify")
+        if cached is None:
+            cache.put("gemma-3-12b-it", prompt, params, text, backend="api", call_site="classify")
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, similarity_threshold=DEFAULT_SIMILARITY):
+        """
+        Args:
+            path: SQLite file holding the cache.
+            ttl_seconds: Age after which an entry is no longer served.
+            max_entries: Entries kept; least recently used are evicted beyond this.
+            similarity_threshold: Cosine similarity for near-identical prompt
+                matches, or 0 to match exact prompts only.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._puts = 0
+        # Per call site: hits, similar_hits, misses, stores
+        self.stats = {}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _site(self, call_site):
+        return self.stats.setdefault(call_site, {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0})
+
+    @staticmethod
+    def _scope(model, params):
+        return _digest(model, json.dumps(params, sort_keys=True, default=str))
+
+    def _use_similarity(self, prompt):
+        return self.similarity_threshold > 0 and len(prompt) <= SIMILARITY_MAX_CHARS
+
+    def get(self, model, prompt, params=None, call_site="default"):
+        """
+        Looks up a response.
+
+        Args:
+            model: Name of the model (or models) that would answer.
+            prompt: The prompt.
+            params: Dict of call parameters that change the answer.
+            call_site: Name the hit/miss counters are recorded under.
+
+        Returns:
+            A CachedResponse, or None on a miss.
+        """
+        scope = self._scope(model, params or {})
+        key = _digest(scope, prompt)
+        oldest = time.time() - self.ttl_seconds
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, backend FROM responses WHERE key = ? AND created_at >= ?", (key, oldest)
+            ).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        if row is not None:
+            self._site(call_site)["hits"] += 1
+            return CachedResponse(row[0], row[1], 1.0)
+
+        if self._use_similarity(prompt):
+            similar = self._get_similar(scope, prompt, oldest)
+            if similar is not None:
+                self._site(call_site)["similar_hits"] += 1
+                return similar
+        self._site(call_site)["misses"] += 1
+        return None
+
+    def _get_similar(self, scope, prompt, oldest):
+        try:
+            query = _embed(prompt)
+        except Exception as e:
+            logging.warning(f"LLM cache similarity lookup unavailable: {e}")
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, response, backend, embedding FROM responses "
+                "WHERE scope = ? AND created_at >= ? AND embedding IS NOT NULL ORDER BY created_at DESC LIMIT ?",
+                (scope, oldest, SIMILARITY_CANDIDATES),
+            ).fetchall()
+        rows = [row for row in rows if len(row[3]) == query.nbytes]
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        with self._lock:
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), rows[best][0]))
+        return CachedResponse(rows[best][1], rows[best][2], float(scores[best]))
+
+    def put(self, model, prompt, params, response, backend, call_site="default"):
+        """Stores a response and evicts expired and least recently used entries now and then."""
+        scope = self._scope(model, params or {})
+        embedding = None
+        if self._use_similarity(prompt):
+            try:
+                embedding = _embed(prompt).tobytes()
+            except Exception as e:
+                logging.warning(f"Could not embed prompt for the LLM cache: {e}")
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, call_site, response, backend, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (_digest(scope, prompt), scope, call_site, response, backend, embedding, now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 1:
+                self._evict()
+        self._site(call_site)["stores"] += 1
+
+    def _evict(self):
+        self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        overflow = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)", (overflow,)
+            )
+
+    def report(self):
+        """Returns hit rates per call site and overall."""
+        sites = {}
+        for name, site in self.stats.items():
+            lookups = site["hits"] + site["similar_hits"] + site["misses"]
+            sites[name] = {**site, "hit_rate": (site["hits"] + site["similar_hits"]) / lookups if lookups else None}
+        lookups = sum(site["hits"] + site["similar_hits"] + site["misses"] for site in self.stats.values())
+        hits = sum(site["hits"] + site["similar_hits"] for site in self.stats.values())
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"call_sites": sites, "hit_rate": hits / lookups if lookups else None, "entries": entries}
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """The process-wide LLM cache, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LLMCache()
+    return _default_cache
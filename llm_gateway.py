@@ -0,0 +1,529 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+
+from langchain_core.messages import HumanMessage
+
+import instrumentation
+from prompt_cache import PrefixStateCache
+from utils import estimate_tokens
+
+# Lower numbers are served first
+PRIORITY_HIGH = 0    # short classification / verification prompts
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10    # long synthesis prompts
+
+# Bytes of prompt state the local model keeps for reuse between calls
+LOCAL_KV_CACHE_BYTES = 2 << 30
+# Calls evaluating fewer prompt tokens than this are too short to time the prompt evaluation rate
+MIN_TIMED_PROMPT_TOKENS = 32
+
+# text: the model's answer; backend: "api" or "local";
+# queue_seconds: time spent waiting for a slot; generate_seconds: time spent generating;
+# cached: True if the answer came from the response cache; fallback: True if the local model answered after the API failed
+LLMResult = namedtuple("LLMResult", ["text", "backend", "queue_seconds", "generate_seconds", "cached", "fallback"],
+                       defaults=[False, False])
+
+
+class _PrioritySemaphore:
+    """An asyncio semaphore that hands free slots to the highest-priority waiter."""
+
+    def __init__(self, value):
+        self._value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed to us just before we were cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+class _LocalJob:
+    def __init__(self, prompt, max_tokens, loop, on_token=None, json_schema=None, prefix=None):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.json_schema = json_schema
+        self.prefix = prefix
+        self.loop = loop
+        self.on_token = on_token
+        self.future = loop.create_future()
+        self.cancelled = threading.Event()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.prompt_stats = None  # Filled in by the worker: prompt tokens reused and evaluation time
+
+
+def _post(job, callback, *args):
+    """Runs `callback` on the job's event loop; a no-op if that loop has since closed."""
+    try:
+        job.loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _count_stream(prompt, pieces, backend):
+    instrumentation.annotate(backend=backend)
+    instrumentation.count(tokens_in=estimate_tokens(prompt), tokens_out=estimate_tokens("".join(pieces)))
+
+
+# How an API reports that it does not accept an argument (HTTP 400 / gRPC INVALID_ARGUMENT, or a client-side type error)
+_INVALID_ARGUMENT = re.compile(r"invalid[ _]?argument|\b400\b|unexpected keyword|response_mime_type|response_schema|json mode", re.I)
+
+
+def _rejected_arguments(error):
+    """True if `error` says the request's arguments were rejected, rather than a transient failure (timeouts, 429s, network)."""
+    if isinstance(error, TypeError) or getattr(error, "code", None) in (400, "INVALID_ARGUMENT"):
+        return True
+    return bool(_INVALID_ARGUMENT.search(str(error)))
+
+
+def _count_prompt_eval(job):
+    if job.prompt_stats is not None:
+        instrumentation.count(**job.prompt_stats)
+
+
+class LLMGateway:
+    """
+    Single async entry point for every LLM call.
+
+    API (Gemini) calls run concurrently up to `api_concurrency`, with free
+    slots going to the highest-priority waiter. Local llama_cpp calls are
+    queued by priority onto one dedicated worker thread, since the model can
+    only generate one sequence at a time. The model keeps its prompt states
+    (prompt_cache.PrefixStateCache: in RAM, and on disk per declared prompt
+    prefix) so prompts sharing a prefix with an earlier one, in this run or a
+    previous one, skip re-evaluating it. Generation never runs on the event loop.
+
+    Timeouts and cancellation work for both backends. A cancelled local job
+    is dropped if it has not started yet, or stopped at the next token.
+
+    With a response cache, answers are reused across calls and runs. They
+    are stored under the backend that produced them: an "auto" call only
+    reuses a local answer while no API model is configured. Answers
+    produced by a fallback are not cached, so a temporary API outage does not
+    pin the local model's answer.
+    """
+
+    def __init__(self, api_model, local_model, api_concurrency=4, default_timeout=180, cache=None, model_name="default"):
+        """
+        Args:
+            api_model: Callable returning the LangChain chat model for the API, or None if unavailable.
+            local_model: Callable returning the llama_cpp model, or None if unavailable.
+                Called on the worker thread, so it may load the model lazily.
+            api_concurrency: Maximum API calls in flight.
+            default_timeout: Seconds before a call is abandoned, unless overridden per call.
+            cache: Callable returning the llm_cache.LLMCache to use, or None for no caching.
+            model_name: Identifies the configured models in cache keys.
+        """
+        self._api_model = api_model
+        self._cache = cache
+        self.model_name = model_name
+        self._local_model = local_model
+        self.default_timeout = default_timeout
+        self._api_slots = _PrioritySemaphore(api_concurrency)
+        self._local_queue = queue.PriorityQueue()
+        self._local_counter = itertools.count()
+        self._local_thread = None
+        self._local_lock = threading.Lock()
+        self._kv_cache_installed = False
+        self._prompt_cache = None
+        self._seconds_per_prompt_token = None  # Moving average, measured on the local model
+        self._api_json_mode = True  # Cleared if the API model rejects native JSON output
+        self.stats = {"api_calls": 0, "local_calls": 0, "fallbacks": 0, "timeouts": 0, "cancelled": 0, "cache_hits": 0,
+                      "local_prompt_tokens": 0, "local_reused_tokens": 0, "local_prompt_eval_seconds": 0.0,
+                      "local_prompt_eval_seconds_saved": 0.0}
+
+    def _cache_for(self, use_cache):
+        return self._cache() if use_cache and self._cache is not None else None
+
+    async def _cache_get(self, cache, prompt, backend, max_tokens, json_schema, call_site):
+        # Answers are stored under the backend that produced them, so "auto" takes
+        # an API answer, or a local one only while no API model is configured
+        for answered_by in ["api", "local"] if backend == "auto" else [backend]:
+            if answered_by == "local" and backend == "auto" and self._api_model is not None and self._api_model() is not None:
+                break
+            params = {"backend": answered_by, "max_tokens": max_tokens, "json_schema": json_schema}
+            # SQLite (and embedding, for similarity lookups) runs off the event loop
+            cached = await asyncio.to_thread(cache.get, self.model_name, prompt, params, call_site)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return cached
+        return None
+
+    async def _cache_put(self, cache, prompt, text, answered_by, max_tokens, json_schema, call_site):
+        params = {"backend": answered_by, "max_tokens": max_tokens, "json_schema": json_schema}
+        await asyncio.to_thread(cache.put, self.model_name, prompt, params, text, answered_by, call_site)
+
+    async def complete(self, prompt, priority=PRIORITY_NORMAL, timeout=None, backend="auto", max_tokens=None, json_schema=None,
+                       call_site="default", use_cache=True, prefix=None, store=True):
+        """
+        Generates a response to `prompt`.
+
+        Args:
+            prompt: The user prompt.
+            priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW (any int works; lower is sooner).
+            timeout: Seconds before giving up (defaults to default_timeout).
+            backend: "auto" (API, falling back to local), "api" or "local".
+            max_tokens: Generation limit for the local model.
+            json_schema: JSON Schema the answer must follow. Enables native JSON
+                output where the backend supports it (Gemini response schema,
+                llama_cpp grammar-constrained decoding); otherwise only the
+                prompt asks for it.
+            call_site: Name the cache hit counters are recorded under.
+            use_cache: Whether this call may be answered from (and stored in) the response cache.
+            prefix: The fixed start of `prompt` shared by other calls (e.g. the
+                instructions of a template). The local model keeps its state
+                after this prefix on disk and reuses it in later calls and runs.
+                Ignored if `prompt` does not start with it.
+            store: Whether a fresh answer is stored in the response cache. Callers
+                that check the answer first pass False and call remember() once
+                it is known to be usable.
+
+        Returns:
+            LLMResult with the stripped response text.
+        """
+        with instrumentation.span(f"llm.{call_site}", priority=priority) as span:
+            result = await self._complete(prompt, priority, timeout, backend, max_tokens, json_schema, call_site, use_cache, prefix,
+                                          store)
+            span.set(backend=result.backend)
+            span.add(queue_seconds=result.queue_seconds, generate_seconds=result.generate_seconds)
+            if result.cached:
+                span.add(cache_hits=1)
+            else:
+                span.add(tokens_in=estimate_tokens(prompt), tokens_out=estimate_tokens(result.text))
+            return result
+
+    async def remember(self, prompt, result, max_tokens=None, json_schema=None, call_site="default"):
+        """
+        Stores the answer of a complete(..., store=False) call in the response
+        cache, under the same arguments and the backend that produced it.
+        Cached and fallback answers are not stored.
+        """
+        cache = self._cache_for(True)
+        if cache is None or result.cached or result.fallback:
+            return
+        await self._cache_put(cache, prompt, result.text, result.backend, max_tokens, json_schema, call_site)
+
+    async def _complete(self, prompt, priority, timeout, backend, max_tokens, json_schema, call_site, use_cache, prefix=None,
+                        store=True):
+        timeout = timeout or self.default_timeout
+        cache = self._cache_for(use_cache)
+        if cache is not None:
+            cached = await self._cache_get(cache, prompt, backend, max_tokens, json_schema, call_site)
+            if cached is not None:
+                return LLMResult(cached.text, cached.backend, 0.0, 0.0, True)
+        try:
+            fell_back = False
+            result = None
+            if backend in ("auto", "api"):
+                model = self._api_model() if self._api_model else None
+                if model is not None:
+                    try:
+                        result = await asyncio.wait_for(self._complete_api(model, prompt, priority, json_schema), timeout)
+                    except (asyncio.TimeoutError, asyncio.CancelledError):
+                        raise
+                    except Exception as e:
+                        if backend == "api":
+                            raise
+                        fell_back = True
+                        self.stats["fallbacks"] += 1
+                        instrumentation.count(fallbacks=1)
+                        logging.error(f"API LLM call failed: {e}. Falling back to local LLM.")
+                elif backend == "api":
+                    raise RuntimeError("No API LLM available.")
+            if result is None:
+                result = await asyncio.wait_for(self._complete_local(prompt, priority, max_tokens, json_schema, prefix), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        if fell_back:
+            return result._replace(fallback=True)
+        if cache is not None and store:
+            await self._cache_put(cache, prompt, result.text, result.backend, max_tokens, json_schema, call_site)
+        return result
+
+    async def _complete_api(self, model, prompt, priority, json_schema=None):
+        queued_at = time.perf_counter()
+        await self._api_slots.acquire(priority)
+        started_at = time.perf_counter()
+        try:
+            self.stats["api_calls"] += 1
+            messages = [HumanMessage(content=prompt)]
+            response = None
+            if json_schema is not None and self._api_json_mode:
+                try:
+                    response = await model.ainvoke(messages, response_mime_type="application/json", response_schema=json_schema)
+                except Exception as e:
+                    if not _rejected_arguments(e):
+                        raise
+                    # Not every model (e.g. Gemma) supports JSON mode; stop asking for it
+                    self._api_json_mode = False
+                    logging.warning(f"API model rejected native JSON output ({e}). Relying on the prompt instead.")
+            if response is None:
+                response = await model.ainvoke(messages)
+            text = response.content
+        finally:
+            self._api_slots.release()
+        return LLMResult(text.strip(), "api", started_at - queued_at, time.perf_counter() - started_at)
+
+    def _submit_local(self, prompt, priority, max_tokens, on_token=None, json_schema=None, prefix=None):
+        self._ensure_local_worker()
+        if prefix is not None and not prompt.startswith(prefix):
+            prefix = None
+        job = _LocalJob(prompt, max_tokens, asyncio.get_running_loop(), on_token, json_schema, prefix)
+        self._local_queue.put((priority, next(self._local_counter), job))
+        return job
+
+    async def _complete_local(self, prompt, priority, max_tokens, json_schema=None, prefix=None):
+        job = self._submit_local(prompt, priority, max_tokens, json_schema=json_schema, prefix=prefix)
+        try:
+            text = await job.future
+        except BaseException:
+            job.cancelled.set()
+            raise
+        _count_prompt_eval(job)
+        return LLMResult(text, "local", job.started_at - job.enqueued_at, time.perf_counter() - job.started_at)
+
+    async def stream(self, prompt, priority=PRIORITY_NORMAL, timeout=None, backend="auto", max_tokens=None,
+                     call_site="default", use_cache=True, prefix=None):
+        """
+        Generates a response to `prompt`, yielding text chunks as they are produced.
+
+        Takes the same arguments as complete(). With backend="auto" the call
+        falls back to the local model only if the API fails before its first
+        chunk; a failure mid-answer is raised. `timeout` bounds the whole answer.
+        Closing the generator early cancels the generation. A cached answer is
+        yielded as a single chunk; a fresh one is cached once it is complete.
+        """
+        with instrumentation.span(f"llm.{call_site}", priority=priority, streamed=True) as span:
+            started = time.perf_counter()
+            first = True
+            async for chunk in self._stream(prompt, priority, timeout, backend, max_tokens, call_site, use_cache, prefix):
+                if first:
+                    span.set(first_chunk_seconds=time.perf_counter() - started)
+                    first = False
+                yield chunk
+
+    async def _stream(self, prompt, priority, timeout, backend, max_tokens, call_site, use_cache, prefix=None):
+        deadline = time.monotonic() + (timeout or self.default_timeout)
+        cache = self._cache_for(use_cache)
+        if cache is not None:
+            cached = await self._cache_get(cache, prompt, backend, max_tokens, None, call_site)
+            if cached is not None:
+                instrumentation.annotate(backend=cached.backend)
+                instrumentation.count(cache_hits=1)
+                yield cached.text
+                return
+        pieces = []
+        if backend in ("auto", "api"):
+            model = self._api_model() if self._api_model else None
+            if model is not None:
+                started = False
+                try:
+                    async for chunk in self._stream_api(model, prompt, priority, deadline):
+                        started = True
+                        pieces.append(chunk)
+                        yield chunk
+                    _count_stream(prompt, pieces, "api")
+                    if cache is not None:
+                        await self._cache_put(cache, prompt, "".join(pieces).strip(), "api", max_tokens, None, call_site)
+                    return
+                except (asyncio.TimeoutError, asyncio.CancelledError, GeneratorExit):
+                    raise
+                except Exception as e:
+                    if backend == "api" or started:
+                        raise
+                    self.stats["fallbacks"] += 1
+                    instrumentation.count(fallbacks=1)
+                    cache = None  # A fallback answer is not cached
+                    logging.error(f"API LLM stream failed: {e}. Falling back to local LLM.")
+            elif backend == "api":
+                raise RuntimeError("No API LLM available.")
+        async for chunk in self._stream_local(prompt, priority, max_tokens, deadline, prefix):
+            pieces.append(chunk)
+            yield chunk
+        _count_stream(prompt, pieces, "local")
+        if cache is not None:
+            await self._cache_put(cache, prompt, "".join(pieces).strip(), "local", max_tokens, None, call_site)
+
+    async def _stream_api(self, model, prompt, priority, deadline):
+        await asyncio.wait_for(self._api_slots.acquire(priority), max(deadline - time.monotonic(), 0))
+        try:
+            self.stats["api_calls"] += 1
+            chunks = model.astream([HumanMessage(content=prompt)]).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                if chunk.content:
+                    yield chunk.content
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        finally:
+            self._api_slots.release()
+
+    async def _stream_local(self, prompt, priority, max_tokens, deadline, prefix=None):
+        tokens = asyncio.Queue()
+        job = self._submit_local(prompt, priority, max_tokens, on_token=tokens.put_nowait, prefix=prefix)
+        job.future.add_done_callback(lambda _: tokens.put_nowait(None))
+        try:
+            while True:
+                token = await asyncio.wait_for(tokens.get(), max(deadline - time.monotonic(), 0))
+                if token is None:
+                    break
+                yield token
+            job.future.result()  # Raise the worker's error, if any
+            _count_prompt_eval(job)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        finally:
+            job.cancelled.set()
+
+    def _ensure_local_worker(self):
+        with self._local_lock:
+            if self._local_thread is None or not self._local_thread.is_alive():
+                self._local_thread = threading.Thread(target=self._local_worker, name="llm-local-worker", daemon=True)
+                self._local_thread.start()
+
+    def _install_kv_cache(self, llm):
+        if self._kv_cache_installed:
+            return
+        self._kv_cache_installed = True
+        try:
+            import llama_cpp
+            model_id = f"{self.model_name}:{getattr(llm, 'model_path', '')}:{llm.n_ctx()}:{llama_cpp.__version__}"
+            self._prompt_cache = PrefixStateCache(llm, model_id, llama_cpp.LlamaRAMCache(capacity_bytes=LOCAL_KV_CACHE_BYTES))
+            llm.set_cache(self._prompt_cache)
+        except Exception as e:
+            logging.warning(f"Could not enable the llama_cpp KV cache: {e}")
+
+    def _record_prompt_eval(self, job, eval_seconds):
+        """Sets the job's prompt statistics from the cache lookup of its call and the time to its first token."""
+        lookup = self._prompt_cache.last_lookup if self._prompt_cache is not None else None
+        if lookup is None:
+            return
+        evaluated = lookup["prompt_tokens"] - lookup["reused_tokens"]
+        if evaluated >= MIN_TIMED_PROMPT_TOKENS:
+            rate = eval_seconds / evaluated
+            previous = self._seconds_per_prompt_token
+            self._seconds_per_prompt_token = rate if previous is None else 0.8 * previous + 0.2 * rate
+        # Reused tokens cost what evaluated ones do at the measured rate
+        saved = lookup["reused_tokens"] * (self._seconds_per_prompt_token or 0.0)
+        self.stats["local_prompt_tokens"] += lookup["prompt_tokens"]
+        self.stats["local_reused_tokens"] += lookup["reused_tokens"]
+        self.stats["local_prompt_eval_seconds"] += eval_seconds
+        self.stats["local_prompt_eval_seconds_saved"] += saved
+        job.prompt_stats = {"prompt_tokens_reused": lookup["reused_tokens"], "prompt_eval_seconds": eval_seconds,
+                            "prompt_eval_seconds_saved": saved}
+
+    def prompt_cache_report(self):
+        """
+        Prompt reuse of the local model: tokens per call, the share reused from
+        earlier prompt states, and the prompt evaluation time spent and saved
+        per call (saved time is estimated at the measured per-token rate).
+        """
+        calls = self.stats["local_calls"]
+        report = {
+            "local_calls": calls,
+            "reuse_rate": self.stats["local_reused_tokens"] / self.stats["local_prompt_tokens"] if self.stats["local_prompt_tokens"] else 0.0,
+            "prompt_tokens_per_call": self.stats["local_prompt_tokens"] / calls if calls else 0.0,
+            "reused_tokens_per_call": self.stats["local_reused_tokens"] / calls if calls else 0.0,
+            "prompt_eval_seconds_per_call": self.stats["local_prompt_eval_seconds"] / calls if calls else 0.0,
+            "prompt_eval_seconds_saved_per_call": self.stats["local_prompt_eval_seconds_saved"] / calls if calls else 0.0,
+        }
+        if self._prompt_cache is not None:
+            report["cache"] = self._prompt_cache.report()
+        return report
+
+    def _local_worker(self):
+        while True:
+            _, _, job = self._local_queue.get()
+            if job is None:
+                return
+            if job.cancelled.is_set():
+                continue
+            job.started_at = time.perf_counter()
+            try:
+                llm = self._local_model()
+                if llm is None:
+                    raise RuntimeError("No local LLM available.")
+                self._install_kv_cache(llm)
+                if self._prompt_cache is not None:
+                    self._prompt_cache.begin(job.prefix)
+                self.stats["local_calls"] += 1
+                pieces = []
+                options = {}
+                if job.json_schema is not None:
+                    # llama_cpp compiles the schema into a grammar that constrains sampling
+                    options["response_format"] = {"type": "json_object", "schema": job.json_schema}
+                eval_started = time.perf_counter()
+                stream = llm.create_chat_completion(
+                    messages=[{"role": "user", "content": job.prompt}],
+                    max_tokens=job.max_tokens,
+                    stream=True,
+                    **options,
+                )
+                for chunk in stream:
+                    if eval_started is not None:
+                        # The prompt is evaluated before the first chunk
+                        self._record_prompt_eval(job, time.perf_counter() - eval_started)
+                        eval_started = None
+                    if job.cancelled.is_set():
+                        break
+                    delta = chunk["choices"][0]["delta"].get("content")
+                    if delta:
+                        pieces.append(delta)
+                        if job.on_token is not None:
+                            _post(job, job.on_token, delta)
+                _post(job, _resolve, job.future, "".join(pieces).strip())
+            except Exception as e:
+                lookup = self._prompt_cache.last_lookup if self._prompt_cache is not None else None
+                if lookup is not None and lookup["source"] == "disk":
+                    # Do not load a state that broke a call again
+                    logging.warning(f"Local LLM call failed after loading a stored prompt state; discarding it: {e}")
+                    self._prompt_cache.discard()
+                _post(job, _resolve, job.future, None, e)
+
+    def close(self):
+        """Stops the local worker thread once the jobs queued so far are done."""
+        if self._local_thread is not None and self._local_thread.is_alive():
+            self._local_queue.put((float("inf"), next(self._local_counter), None))
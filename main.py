@@ -1,20 +1,50 @@
 import google_search_api
 import summarizer
 import web_crawler
+import browser_pool
+import crawl_scheduler
+import page_cache
+import extraction_executor
+import retrieval
+import corpus_index
+from budget import BudgetController, NoveltyTracker
+import pipeline
+import llm_cache
+import instrumentation
+import page_loading
 import LLM
 import utils
 import person_researcher
 import json
 import logging
 import asyncio
+import contextlib
+import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import numpy as np
+
+# Configure logging (console and myapp.log, see instrumentation.configure_logging)
+instrumentation.configure_logging()
+
+# Crawling stops once this many words of article text are gathered
+CRAWL_WORD_TARGET = 40000
+# Pages fetched in parallel (also the number of browser tabs)
+CRAWL_CONCURRENCY = 8
+# Estimated tokens of the most relevant passages handed to the summarizer
+RETRIEVAL_TOKEN_BUDGET = 12000
+# Passages at least this similar to the query count as relevant while gathering
+RELEVANT_PASSAGE_SCORE = 0.35
+# The pipelined crawl stops once relevant passages add up to this many estimated tokens
+RELEVANT_TOKEN_TARGET = 2 * RETRIEVAL_TOKEN_BUDGET
+# Pipeline workers waiting on the ExtractionExecutor (which does the work in its own processes)
+EXTRACT_WORKERS = 4
+# Passages looked up in the local corpus index per search query before searching the web
+LOCAL_INDEX_HITS = 100
 
 async def research_query(query: str):
     # Step 1: Classify query type
     # try:
-    #     query_classification = LLM.classify_query_type(query)
+    #     query_classification = await LLM.classify_query_type(query)
     #     query_type = query_classification.get("query_type")
     #     print(query_type)
     # except Exception as e:
@@ -35,61 +65,407 @@ async def research_query(query: str):
     #         return "Error: Could not complete person research."
     # else:
     #     logging.info("Detected general research query.")
-        # 1. Enhance query
+        answer = None
+        async for event in research_query_stream(query, stream_answer=False):
+            if event["type"] in ("answer", "error"):
+                answer = event["text"]
+        return answer
+
+async def research_query_stream(query: str, stream_answer: bool = True, pool=None, http_client=None, executor=None, max_pages: int = None, pipelined: bool = True,
+                                budget: BudgetController = None):
+    """
+    Runs the research pipeline and yields events while it runs.
+
+    Every event is a dict with "type" and "elapsed" (seconds since start):
+        {"type": "progress", "stage": "queries_enhanced", "queries": [...]}
+        {"type": "progress", "stage": "local_index", "passages": int, "web_queries": int}   (pipelined only)
+        {"type": "progress", "stage": "search_completed", "results": int}   (pipelined: may follow the first fetches)
+        {"type": "progress", "stage": "url_fetched", "url": str, "ok": bool}
+        {"type": "progress", "stage": "article_extracted", "url": str, "words": int}
+        {"type": "progress", "stage": "crawl_completed", "articles": int, "stop_reason": str}
+        {"type": "progress", "stage": "passages_selected", "passages": int, "tokens_saved": int}
+        {"type": "token", "text": str}      (only with stream_answer)
+        {"type": "answer", "text": str, "budget": dict}   the full final answer, always last on success
+        {"type": "error", "text": str}      last event when the run fails
+
+    Args:
+        query: The research query.
+        stream_answer: Yield the final answer token by token as the model
+            generates it. Otherwise it is generated in one call.
+        pool, http_client, executor: Shared BrowserPool, httpx client and
+            ExtractionExecutor (e.g. kept warm by a server). Each one not
+            given is created for this run and closed afterwards.
+        max_pages: Stop crawling after this many pages were fetched.
+        pipelined: Answer from the local corpus index first and search the
+            web only for queries it does not cover; search, fetch, extract
+            and rank as a pipeline, each URL moving on as soon as it is ready
+            and crawling stopping once enough relevant text is gathered; add
+            every new article to the index. False runs every search, then
+            the whole crawl, then ranking (the batch path, for comparison).
+        budget: budget.BudgetController limiting the searches, fetches, LLM
+            tokens and time spent gathering; by default the RESEARCH_*
+            settings apply and crawling also stops once new articles stop
+            adding new text or relevant passages. The answer event carries
+            its stop reason and consumption.
+
+    The run is traced (see instrumentation): its timing report is written
+    under the trace directory, and the "answer" and "error" events carry its
+    "trace_id".
+    """
+    with instrumentation.run("research_query", query=query) as trace:
+        async with contextlib.aclosing(_research_query_stream(query, stream_answer, pool, http_client, executor, max_pages, pipelined, budget)) as events:
+            async for event in events:
+                if event["type"] in ("answer", "error"):
+                    event["trace_id"] = trace.trace_id
+                yield event
+
+async def _research_query_stream(query, stream_answer, pool, http_client, executor, max_pages, pipelined, budget):
+    start_time = time.perf_counter()
+    if budget is None:
+        budget = BudgetController()
+
+    def event(event_type, **fields):
+        return {"type": event_type, "elapsed": time.perf_counter() - start_time, **fields}
+
+    # 1. Enhance query
+    try:
+        with instrumentation.span("enhance_query"):
+            enhanced_queries = await LLM.enhance_query_into_two(query)
+        logging.info(f"Enhanced Queries: {enhanced_queries}")
+    except Exception as e:
+        logging.error(f"Error enhancing query: {e}")
+        yield event("error", text="Error: Could not enhance query.")
+        return
+    yield event("progress", stage="queries_enhanced", queries=enhanced_queries)
+
+    # Pages, extractions and search responses are reused across runs (RESEARCH_OFFLINE=1 serves only from it)
+    cache = page_cache.get_default_cache()
+
+    # 2-4. Search, crawl, extract and rank, then keep the passages most relevant to the query
+    gathered = {}
+    gather = _gather_pipelined if pipelined else _gather_batch
+    async with contextlib.AsyncExitStack() as resources:
+        if pool is None:
+            pool = await resources.enter_async_context(browser_pool.BrowserPool(size=CRAWL_CONCURRENCY))
+        if http_client is None:
+            http_client = await resources.enter_async_context(web_crawler.create_http_client())
+        if executor is None:
+            executor = await resources.enter_async_context(extraction_executor.ExtractionExecutor())
+
+        async def fetch(url):
+            return await web_crawler.fetch_page(url, pool=pool, http_client=http_client, cache=cache, executor=executor)
+
+        async with contextlib.aclosing(gather(query, enhanced_queries, cache, fetch, executor, max_pages, budget, gathered, event)) as events:
+            async for progress in events:
+                yield progress
+    logging.info(f"Fetch tiers: {web_crawler.get_tier_report()}")
+    logging.info(f"Browser page loads: {page_loading.get_load_report()}")
+    logging.info(f"Page cache: {cache.report()}")
+    if "error" in gathered:
+        yield event("error", text=gathered["error"])
+        return
+    passages = gathered["passages"]
+    logging.info(f"Retrieval: {gathered['retrieval_stats']}")
+    yield event("progress", stage="passages_selected", passages=len(passages), tokens_saved=gathered["retrieval_stats"]["tokens_saved"])
+
+    # 5. Summarize and synthesize the selected passages (map-reduce, nothing truncated)
+    summary_stats = {}
+    try:
+        with instrumentation.span("summarize", passages=len(passages)):
+            if stream_answer:
+                chunks = []
+                async for chunk in summarizer.summarize_hierarchical_stream(passages, query, stats=summary_stats):
+                    chunks.append(chunk)
+                    yield event("token", text=chunk)
+                final_summary = "".join(chunks).strip()
+            else:
+                final_summary = await summarizer.summarize_hierarchical(passages, query, stats=summary_stats)
+    except Exception as e:
+        logging.error(f"Error summarizing content: {e}")
+        yield event("error", text="Error: Could not summarize extracted content.")
+        return
+    logging.info(f"Summarization: {summary_stats}")
+    logging.info(f"LLM cache: {llm_cache.get_default_cache().report()}")
+    logging.info(f"Final Summary: {final_summary}")
+    yield event("answer", text=final_summary, budget=budget.report())
+
+def _summary_token_budget(budget):
+    """Passage tokens for the summarizer: RETRIEVAL_TOKEN_BUDGET, less if the token budget is nearly spent."""
+    remaining = budget.remaining("tokens")
+    if remaining is None:
+        return RETRIEVAL_TOKEN_BUDGET
+    # Map-reduce costs roughly twice its input (prompts plus partial summaries); always summarize something
+    return max(min(RETRIEVAL_TOKEN_BUDGET, remaining // 2), retrieval.PASSAGE_TOKENS)
+
+async def _gather_batch(query, enhanced_queries, cache, fetch, executor, max_pages, budget, gathered, event):
+    """
+    Gathers passages stage by stage: every search, then the crawl (pages
+    extracted in completion order), then ranking over all articles. Fills
+    `gathered` with "passages" and "retrieval_stats", or "error".
+    """
+    # Search all enhanced queries concurrently (near-identical queries share one API call)
+    with instrumentation.span("search_many", queries=len(enhanced_queries)):
+        async with google_search_api.SearchClient(cache=cache) as search_client:
+            results_by_query = await search_client.search_many(enhanced_queries)
+            logging.info(f"Search stats: {search_client.stats}")
+            budget.charge(requests=search_client.stats["searches"])
+    for q, search_results in results_by_query.items():
+        if not search_results:
+            logging.warning(f"No search results for query '{q}'")
+    all_search_results = google_search_api.unique_results(results_by_query)
+    logging.info(f"Total Search Results: {len(all_search_results)}")
+    yield event("progress", stage="search_completed", results=len(all_search_results))
+
+    if not all_search_results:
+        gathered["error"] = "No relevant search results found."
+        return
+
+    # Crawl and extract content from search results, handling pages as they finish
+    all_article_content = []
+    gathered_words = fetched = 0
+    novelty = NoveltyTracker()
+    scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=CRAWL_CONCURRENCY)
+    with instrumentation.span("crawl", urls=len(all_search_results)):
+        urls = [result["link"] for result in all_search_results]
+        async with contextlib.aclosing(scheduler.crawl(urls, fetch, stop_after=max_pages)) as crawl_results:
+            async for crawled in crawl_results:
+                budget.charge(requests=1)
+                fetched += crawled.error is None and bool(crawled.value)
+                yield event("progress", stage="url_fetched", url=crawled.url, ok=crawled.error is None and bool(crawled.value))
+                if crawled.error is not None:
+                    logging.error(f"Error crawling {crawled.url}: {crawled.error}")
+                    continue
+                if not crawled.value:
+                    continue
+                try:
+                    article_data = await web_crawler.extract_article_content_with_newspaper(crawled.value, crawled.url, cache, executor)
+                    if article_data and article_data["text"]:
+                        all_article_content.append(article_data["text"])
+                        words = len(article_data["text"].split())
+                        gathered_words += words
+                        budget.observe(novelty=novelty.novelty(article_data["text"]))
+                        yield event("progress", stage="article_extracted", url=crawled.url, words=words)
+                    else:
+                        logging.warning(f"No article content extracted from {crawled.url}")
+                except Exception as e:
+                    logging.error(f"Error extracting {crawled.url}: {e}")
+                if gathered_words >= CRAWL_WORD_TARGET:
+                    budget.stop("word target reached")
+                if budget.should_stop():
+                    logging.info(f"Stopping the crawl: {budget.stop_reason}. Cancelling remaining fetches.")
+                    break
+    budget.stop("page limit reached" if max_pages is not None and fetched >= max_pages else "search results exhausted")
+    logging.info(f"Total Articles Crawled: {len(all_article_content)}")
+    yield event("progress", stage="crawl_completed", articles=len(all_article_content), stop_reason=budget.stop_reason)
+
+    if not all_article_content:
+        gathered["error"] = "No article content could be extracted from search results."
+        return
+
+    # Keep the passages most relevant to the query, dropping near-duplicate copies
+    with instrumentation.span("select_passages", articles=len(all_article_content)) as span:
+        passages, retrieval_stats = await asyncio.to_thread(retrieval.select_passages, query, all_article_content, _summary_token_budget(budget))
+        span.set(passages=len(passages))
+        span.add(tokens_saved=retrieval_stats["tokens_saved"])
+    gathered["passages"], gathered["retrieval_stats"] = passages, retrieval_stats
+
+def _search_local_index(index, query_vector, queries, query_vectors):
+    """
+    Looks the search queries up in the local corpus index.
+
+    Returns:
+        (texts, vectors, scores, gaps): the passages found (each once), their
+        embeddings and similarity to `query_vector`, and the queries whose
+        relevant passages fall short of their share of RELEVANT_TOKEN_TARGET
+        (the ones still worth a web search).
+    """
+    texts, vectors, scores, gaps = [], [], [], []
+    seen = set()
+    share = RELEVANT_TOKEN_TARGET / max(len(queries), 1)
+    for q, q_vector in zip(queries, query_vectors):
+        hits = [hit for hit in index.search(q, LOCAL_INDEX_HITS, q_vector) if hit.passage_id not in seen]
+        seen.update(hit.passage_id for hit in hits)
+        if not hits:
+            gaps.append(q)
+            continue
+        hit_texts = [hit.text for hit in hits]
+        if index.dimensions == len(query_vector):
+            hit_vectors = index.vectors([hit.passage_id for hit in hits])
+            hit_scores = hit_vectors @ query_vector
+        else:
+            # Indexed with another embedding model: embed the passages again
+            hit_vectors, hit_scores = retrieval.score_passages(query_vector, hit_texts)
+        texts += hit_texts
+        vectors.append(hit_vectors)
+        scores.append(hit_scores)
+        covered = sum(utils.estimate_tokens(text) for text, score in zip(hit_texts, hit_scores) if score >= RELEVANT_PASSAGE_SCORE)
+        if covered < share:
+            gaps.append(q)
+    return texts, vectors, scores, gaps
+
+async def _gather_pipelined(query, enhanced_queries, cache, fetch, executor, max_pages, budget, gathered, event):
+    """
+    Gathers passages from the local corpus index, then fills the gaps with
+    search -> fetch -> extract -> rank -> index running as one pipeline (see
+    pipeline.Pipeline): only queries the index does not cover are searched,
+    a URL is fetched as soon as its search returns (unless it is already
+    indexed), extracted as soon as it is fetched, its passages scored against
+    the query as soon as it is extracted and then added to the index. Bounded
+    queues between the stages keep at most a few pages in memory, and the
+    crawl stops once relevant passages reach RELEVANT_TOKEN_TARGET, the text
+    reaches CRAWL_WORD_TARGET or `max_pages` pages were fetched. Fills
+    `gathered` like _gather_batch.
+    """
+    scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=CRAWL_CONCURRENCY)
+    index = corpus_index.get_default_index()
+    groups = list(google_search_api.collapse_queries(enhanced_queries))
+    embedded = await asyncio.to_thread(retrieval.embed, [query, *groups])
+    query_vector = embedded[0]
+    seen_links = set()
+    search_progress = {"pending": 0, "results": 0, "indexed": 0, "reported": False}
+
+    async def search(q):
         try:
-            enhanced_queries = LLM.enhance_query_into_two(query)
-            logging.info(f"Enhanced Queries: {enhanced_queries}")
+            results = await search_client.search(q)
         except Exception as e:
-            logging.error(f"Error enhancing query: {e}")
-            return "Error: Could not enhance query."
+            logging.error(f"Error performing Google search for '{q}': {e}")
+            results = []
+        finally:
+            search_progress["pending"] -= 1
+        if not results:
+            logging.warning(f"No search results for query '{q}'")
+        for result in results:
+            if result["link"] not in seen_links:
+                seen_links.add(result["link"])
+                search_progress["results"] += 1
+                if await asyncio.to_thread(index.contains, result["link"]):
+                    # Its passages were already looked up locally
+                    search_progress["indexed"] += 1
+                    continue
+                yield result["link"]
 
-        # 2. Perform Google Search for each enhanced query
-        all_search_results = []
-        for q in enhanced_queries:
+    async def extract(crawled):
+        # Only the extracted text travels on; the HTML is dropped here
+        page = {"url": crawled.url, "ok": crawled.error is None and bool(crawled.value), "error": crawled.error, "text": None}
+        if page["ok"]:
             try:
-                search_results = google_search_api.google_search_api(q, google_search_api.api_key, google_search_api.cx)
-                if search_results and "error" not in search_results:
-                    all_search_results.extend(search_results)
-                else:
-                    logging.warning(f"No search results or error for query '{q}': {search_results.get('error', 'Unknown error')}")
+                article_data = await web_crawler.extract_article_content_with_newspaper(crawled.value, crawled.url, cache, executor)
+                page["text"] = article_data["text"] if article_data else None
+                page["article"] = article_data
             except Exception as e:
-                logging.error(f"Error performing Google search for '{q}': {e}")
-        logging.info(f"Total Search Results: {len(all_search_results)}")
+                logging.error(f"Error extracting {crawled.url}: {e}")
+        return page
 
-        if not all_search_results:
-            return "No relevant search results found."
+    async def rank(page):
+        if page["text"]:
+            with instrumentation.span("rank", url=page["url"]):
+                texts = [passage for _, passage in retrieval.split_passages([page["text"]])]
+                vectors, scores = await asyncio.to_thread(retrieval.score_passages, query_vector, texts)
+            page.update(passages=texts, vectors=vectors, scores=scores)
+        return page
 
-        # 3. Crawl and extract content from search results
-        all_article_content = []
-        for result in all_search_results:
+    async def index_article(page):
+        if page["text"]:
             try:
-                html_content = await web_crawler.get_page_content(result["link"])
-                if html_content:
-                    article_data = await web_crawler.extract_article_content_with_newspaper(html_content, result["link"])
-                    if article_data and article_data["text"]:
-                        all_article_content.append(article_data["text"])
-                    else:
-                        logging.warning(f"No article content extracted from {result['link']}")
+                await asyncio.to_thread(index.add_article, page["url"], page.pop("article"), page["passages"], page["vectors"])
             except Exception as e:
-                logging.error(f"Error crawling {result['link']}: {e}")
-        logging.info(f"Total Articles Crawled: {len(all_article_content)}")
+                logging.error(f"Error indexing {page['url']}: {e}")
+        return page
 
-        if not all_article_content:
-            return "No article content could be extracted from search results."
+    def search_completed():
+        search_progress["reported"] = True
+        logging.info(f"Total Search Results: {search_progress['results']}")
+        return event("progress", stage="search_completed", results=search_progress["results"])
 
-        # 4. Summarize and synthesize the extracted information
-        full_text_for_summary = "\n\n".join(all_article_content)
-        
-        # Truncate text if it's too long for the LLM
-        truncated_text = utils.truncate_text_by_words(full_text_for_summary, 10000) # Adjust word limit as needed
+    # Local passages first; only the queries they leave uncovered go to the web
+    with instrumentation.span("local_index", queries=len(groups)) as span:
+        texts, vectors, scores, web_queries = await asyncio.to_thread(_search_local_index, index, query_vector, groups, embedded[1:])
+        span.set(passages=len(texts), web_queries=len(web_queries))
+    relevant_tokens = sum(
+        utils.estimate_tokens(text) for text, score in zip(texts, np.concatenate(scores) if scores else []) if score >= RELEVANT_PASSAGE_SCORE
+    )
+    if relevant_tokens >= RELEVANT_TOKEN_TARGET:
+        web_queries = []
+    if not web_queries:
+        budget.stop("answered from local index")
+    logging.info(f"Local index: {len(texts)} passages, {relevant_tokens} relevant tokens; searching the web for {web_queries}")
+    yield event("progress", stage="local_index", passages=len(texts), web_queries=len(web_queries))
 
-        try:
-            final_summary = summarizer.summarize_with_gemini(truncated_text)
-            logging.info(f"Final Summary: {final_summary}")
-            return final_summary
-        except Exception as e:
-            logging.error(f"Error summarizing content: {e}")
-            return "Error: Could not summarize extracted content."
+    search_progress["pending"] = len(web_queries)
+    articles = fetched = gathered_words = 0
+    novelty = NoveltyTracker()
+    for text in texts:
+        novelty.novelty(text)
+    stages = pipeline.Pipeline([
+        pipeline.Stage("search", search, workers=max(len(web_queries), 1)),
+        pipeline.Stage("fetch", lambda url: scheduler.run(url, fetch), workers=CRAWL_CONCURRENCY * 2),
+        pipeline.Stage("extract", extract, workers=EXTRACT_WORKERS),
+        pipeline.Stage("rank", rank),
+        pipeline.Stage("index", index_article),
+    ])
+    async with google_search_api.SearchClient(cache=cache) as search_client:
+        search_client.stats["collapsed"] += len(enhanced_queries) - len(groups)
+        budget.charge(requests=len(web_queries))
+        with instrumentation.span("crawl", queries=len(web_queries)) as span:
+            async with contextlib.aclosing(stages.run(web_queries)) as pages:
+                async for page in pages:
+                    if not search_progress["reported"] and search_progress["pending"] == 0:
+                        yield search_completed()
+                    yield event("progress", stage="url_fetched", url=page["url"], ok=page["ok"])
+                    budget.charge(requests=1)
+                    if page["error"] is not None:
+                        logging.error(f"Error crawling {page['url']}: {page['error']}")
+                    fetched += page["ok"]
+                    if page["text"]:
+                        articles += 1
+                        words = len(page["text"].split())
+                        gathered_words += words
+                        texts += page["passages"]
+                        vectors.append(page["vectors"])
+                        scores.append(page["scores"])
+                        relevant_tokens += sum(
+                            utils.estimate_tokens(text) for text, score in zip(page["passages"], page["scores"]) if score >= RELEVANT_PASSAGE_SCORE
+                        )
+                        # Marginal gain: text not seen in earlier articles, and progress towards enough relevant text
+                        budget.observe(novelty=novelty.novelty(page["text"]), confidence=min(relevant_tokens / RELEVANT_TOKEN_TARGET, 1.0))
+                        yield event("progress", stage="article_extracted", url=page["url"], words=words)
+                    elif page["ok"]:
+                        logging.warning(f"No article content extracted from {page['url']}")
+                    if relevant_tokens >= RELEVANT_TOKEN_TARGET:
+                        budget.stop("enough relevant text")
+                    elif gathered_words >= CRAWL_WORD_TARGET:
+                        budget.stop("word target reached")
+                    elif max_pages is not None and fetched >= max_pages:
+                        budget.stop("page limit reached")
+                    if budget.should_stop():
+                        logging.info(f"Stopping the crawl: {budget.stop_reason}. Cancelling remaining fetches.")
+                        break
+            budget.stop("search results exhausted")
+            span.set(stop_reason=budget.stop_reason, articles=articles)
+            span.add(relevant_tokens=relevant_tokens)
+        logging.info(f"Search stats: {search_client.stats}")
+    logging.info(f"Pipeline: {stages.report()}")
+    logging.info(f"Corpus index: {index.report()} ({search_progress['indexed']} search results already indexed)")
+    if not search_progress["reported"]:
+        yield search_completed()
+    if not search_progress["results"] and not texts:
+        gathered["error"] = "No relevant search results found."
+        return
+    logging.info(f"Total Articles Crawled: {articles}")
+    yield event("progress", stage="crawl_completed", articles=articles, stop_reason=budget.stop_reason)
+
+    if not texts:
+        gathered["error"] = "No article content could be extracted from search results."
+        return
+
+    # Every passage is already scored: only duplicates and the token budget are left to decide
+    with instrumentation.span("select_passages", articles=articles) as span:
+        passages, retrieval_stats = await asyncio.to_thread(
+            retrieval.select_scored, texts, np.concatenate(vectors), np.concatenate(scores), _summary_token_budget(budget)
+        )
+        span.set(passages=len(passages))
+        span.add(tokens_saved=retrieval_stats["tokens_saved"])
+    gathered["passages"], gathered["retrieval_stats"] = passages, retrieval_stats
 
 # if __name__ == "__main__":
     # user_query = input("Enter your research query: ")
@@ -0,0 +1,216 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+import psutil
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Unload least recently used models when the process grows past this many bytes (0 = never)
+MAX_RSS_BYTES = int(os.getenv("MODEL_MAX_RSS_BYTES", 0))
+# Context window of the local model, in tokens
+LOCAL_N_CTX = int(os.getenv("LOCAL_LLM_N_CTX", 20000))
+LOCAL_MODEL_REPO = "unsloth/gemma-3-1b-it-GGUF"
+LOCAL_MODEL_FILE = "gemma-3-1b-it-Q5_K_M.gguf"
+
+
+def _rss_bytes():
+    return psutil.Process().memory_info().rss
+
+
+class _Entry:
+    def __init__(self, loader, unloader):
+        self.loader = loader
+        self.unloader = unloader
+        self.model = None
+        self.lock = threading.Lock()
+        self.load_seconds = None
+        self.rss_bytes = None
+        self.last_used = None
+        self.loads = 0
+
+
+class ModelRegistry:
+    """
+    Process-wide home for expensive models and API clients.
+
+    Each backend is registered with a loader and only loaded the first time
+    it is asked for. Every module then shares the same instance. Loading is
+    thread-safe, so two callers racing for the same model load it once.
+
+    Usage:
+        registry.register("pegasus", load_pegasus)
+        model, tokenizer = registry.get("pegasus")
+    """
+
+    def __init__(self, max_rss_bytes=MAX_RSS_BYTES):
+        """
+        Args:
+            max_rss_bytes: After a load, unload other models (least recently
+                used first) while the process RSS is above this. 0 disables it.
+        """
+        self.max_rss_bytes = max_rss_bytes
+        self._entries = {}
+
+    def register(self, name, loader, unloader=None):
+        """
+        Args:
+            name: Key used with get().
+            loader: Zero-argument callable that builds the model.
+            unloader: Optional callable receiving the model to release extra resources.
+        """
+        self._entries[name] = _Entry(loader, unloader)
+
+    def get(self, name):
+        """Returns the model, loading it on first use."""
+        entry = self._entries[name]
+        loaded_now = False
+        if entry.model is None:
+            with entry.lock:
+                if entry.model is None:
+                    self._load(name, entry)
+                    loaded_now = True
+        entry.last_used = time.monotonic()
+        model = entry.model
+        if loaded_now and self.max_rss_bytes:
+            self.unload_under_pressure(self.max_rss_bytes, keep=name)
+        return model
+
+    def is_loaded(self, name):
+        return self._entries[name].model is not None
+
+    def _load(self, name, entry):
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        entry.model = entry.loader()
+        entry.load_seconds = time.perf_counter() - start
+        entry.rss_bytes = max(_rss_bytes() - rss_before, 0)
+        entry.loads += 1
+        entry.last_used = time.monotonic()
+        logging.info(f"Loaded model '{name}' in {entry.load_seconds:.2f}s (+{entry.rss_bytes / 1024 ** 2:.0f} MB RSS).")
+
+    def warm_up(self, names=None):
+        """
+        Loads models ahead of their first use (all registered ones by default).
+        Failures are logged and skipped so one missing backend does not stop the rest.
+        """
+        for name in names or list(self._entries):
+            try:
+                self.get(name)
+            except Exception as e:
+                logging.error(f"Could not warm up model '{name}': {e}")
+
+    def unload(self, name):
+        """Drops the model so its memory can be reclaimed. It is reloaded on the next get()."""
+        entry = self._entries[name]
+        with entry.lock:
+            if entry.model is None:
+                return
+            model = entry.model
+            entry.model = None
+            if entry.unloader is not None:
+                try:
+                    entry.unloader(model)
+                except Exception as e:
+                    logging.warning(f"Unloader for model '{name}' failed: {e}")
+            del model
+        gc.collect()
+        logging.info(f"Unloaded model '{name}'.")
+
+    def unload_under_pressure(self, max_rss_bytes, keep=None):
+        """
+        Unloads models, least recently used first, until the process RSS is
+        below `max_rss_bytes` or nothing else can be unloaded.
+
+        Returns:
+            Names of the models that were unloaded.
+        """
+        unloaded = []
+        loaded = sorted(
+            (entry.last_used, name) for name, entry in self._entries.items()
+            if entry.model is not None and name != keep
+        )
+        for _, name in loaded:
+            if _rss_bytes() <= max_rss_bytes:
+                break
+            self.unload(name)
+            unloaded.append(name)
+        return unloaded
+
+    def report(self):
+        """Returns load time, resident memory added at load and state for every model."""
+        return {
+            name: {
+                "loaded": entry.model is not None,
+                "load_seconds": entry.load_seconds,
+                "rss_bytes": entry.rss_bytes,
+                "loads": entry.loads,
+            }
+            for name, entry in self._entries.items()
+        }
+
+
+def _load_local_llama():
+    from llama_cpp import Llama
+    return Llama.from_pretrained(
+        repo_id=LOCAL_MODEL_REPO,
+        filename=LOCAL_MODEL_FILE,
+        n_ctx=LOCAL_N_CTX
+    )
+
+
+def _load_local_tokenizer():
+    # Only the vocabulary: tokenizes like the local model without loading its weights
+    from llama_cpp import Llama
+    return Llama.from_pretrained(repo_id=LOCAL_MODEL_REPO, filename=LOCAL_MODEL_FILE, vocab_only=True, verbose=False)
+
+
+def local_model_downloaded():
+    """Whether the local model file is already in the Hugging Face cache, so loading it needs no download."""
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(LOCAL_MODEL_REPO, LOCAL_MODEL_FILE), str)
+
+
+def _load_gemini_chat():
+    from google import genai
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    api_key = os.getenv("GEMINI_KEY")
+    if not api_key:
+        raise RuntimeError("GEMINI_KEY not found.")
+    client = genai.Client(api_key=api_key)
+    return ChatGoogleGenerativeAI(model="gemma-3-12b-it", client=client)
+
+
+def _load_pegasus():
+    from transformers import AutoTokenizer, PegasusForConditionalGeneration
+    model = PegasusForConditionalGeneration.from_pretrained("google/pegasus-xsum")
+    tokenizer = AutoTokenizer.from_pretrained("google/pegasus-xsum")
+    return model, tokenizer
+
+
+def _load_embedder():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device="cpu")
+
+
+def _release_torch_memory(_model):
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+registry = ModelRegistry()
+registry.register("llama_local", _load_local_llama)
+registry.register("llama_tokenizer", _load_local_tokenizer)
+registry.register("gemini_chat", _load_gemini_chat)
+registry.register("pegasus", _load_pegasus, _release_torch_memory)
+registry.register("embedder", _load_embedder)
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import utils
+
+# Defaults, overridable through the environment
+DEFAULT_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", os.path.join(".cache", "pages"))
+DEFAULT_TTL_SECONDS = int(os.getenv("PAGE_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 1024 ** 3))
+
+# A cached response. `fresh` is False once the entry is older than the TTL;
+# stale entries can still be revalidated with `etag`/`last_modified`.
+CachedPage = namedtuple("CachedPage", ["url", "html", "content_hash", "etag", "last_modified", "fetched_at", "fresh"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url_key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access);
+CREATE INDEX IF NOT EXISTS pages_content_hash ON pages (content_hash);
+CREATE TABLE IF NOT EXISTS extractions (
+    content_hash TEXT NOT NULL,
+    extractor TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (content_hash, extractor)
+);
+"""
+
+# Blobs are shared, so each distinct content hash counts once
+_TOTAL_BYTES = "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT content_hash, size FROM pages)"
+
+
+def content_hash(html):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """
+    On-disk cache of fetched pages and their extracted articles.
+
+    Pages are looked up by normalized URL. The HTML itself is stored
+    zlib-compressed in a file named after its SHA-256, so mirrored pages
+    with identical content share one blob, and extraction results are keyed
+    by that same content hash. An SQLite index in WAL mode tracks entries,
+    which makes the cache safe to share between several worker processes.
+
+    In offline mode the cache never reports a miss as "go fetch it": callers
+    are expected to use whatever is cached, however old, and skip the network.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl_seconds=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        """
+        Args:
+            cache_dir: Directory holding the index and the compressed blobs.
+            ttl_seconds: Age after which an entry must be revalidated.
+            max_bytes: Compressed size above which least recently used entries are evicted.
+            offline: Serve only from the cache and never fetch.
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._blob_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self._blob_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # Kept up to date by put() so inserts need no scan; entries written by other
+        # processes are only counted again when eviction rescans the index
+        self._total_bytes = self._db.execute(_TOTAL_BYTES).fetchone()[0]
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "revalidated": 0,
+            "extraction_hits": 0,
+            "extraction_misses": 0,
+            "evictions": 0,
+            "bytes_served": 0,
+            "bytes_stored": 0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self._blob_dir, digest[:2], digest + ".html.z")
+
+    def _url_key(self, url):
+        return hashlib.sha256(utils.normalize_url(url).encode("utf-8")).hexdigest()
+
+    def _read_blob(self, digest):
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            return None
+
+    def _write_blob(self, digest, html):
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(html.encode("utf-8"), 6)
+        # Write to a temp file and rename so other processes never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def get(self, url):
+        """
+        Looks up a page by URL.
+
+        Returns:
+            A CachedPage (possibly stale), or None if the URL is not cached.
+        """
+        key = self._url_key(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, content_hash, etag, last_modified, fetched_at FROM pages WHERE url_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            html = self._read_blob(row[1])
+            if html is None:
+                # Blob was evicted by another process after we read the index
+                self._db.execute("DELETE FROM pages WHERE url_key = ?", (key,))
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE pages SET last_access = ? WHERE url_key = ?", (time.time(), key))
+
+        fresh = time.time() - row[4] < self.ttl_seconds
+        if fresh or self.offline:
+            self.stats["hits"] += 1
+            self.stats["bytes_served"] += len(html)
+        else:
+            self.stats["stale"] += 1
+        return CachedPage(row[0], html, row[1], row[2], row[3], row[4], fresh)
+
+    def put(self, url, html, etag=None, last_modified=None):
+        """Stores the HTML of a page and evicts old entries if the cache is over its size limit."""
+        digest = content_hash(html)
+        size = self._write_blob(digest, html)
+        key = self._url_key(url)
+        now = time.time()
+        with self._lock:
+            previous = self._db.execute("SELECT content_hash, size FROM pages WHERE url_key = ?", (key,)).fetchone()
+            shared = self._db.execute("SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1", (digest,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url_key, url, content_hash, size, etag, last_modified, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, digest, size, etag, last_modified, now, now),
+            )
+            if not shared:
+                self._total_bytes += size
+            if previous is not None and previous[0] != digest:
+                if not self._db.execute("SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1", (previous[0],)).fetchone():
+                    self._total_bytes -= previous[1]
+        self.stats["bytes_stored"] += size
+        self._evict_if_needed()
+        return digest
+
+    def mark_revalidated(self, url):
+        """Resets the age of an entry after the server answered 304 Not Modified."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ? WHERE url_key = ?", (time.time(), self._url_key(url)))
+        self.stats["revalidated"] += 1
+
+    def get_extracted(self, html, extractor):
+        """Returns the cached extraction result of `extractor` for this exact HTML, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM extractions WHERE content_hash = ? AND extractor = ?", (content_hash(html), extractor)
+            ).fetchone()
+        if row is None:
+            self.stats["extraction_misses"] += 1
+            return None
+        self.stats["extraction_hits"] += 1
+        return json.loads(row[0])
+
+    def put_extracted(self, html, extractor, data):
+        """Stores an extraction result. Non-JSON values such as dates are stored as strings."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extractions (content_hash, extractor, data) VALUES (?, ?, ?)",
+                (content_hash(html), extractor, json.dumps(data, default=str)),
+            )
+
+    def total_bytes(self):
+        """Compressed size of the cached pages, as tracked since the cache was opened."""
+        return self._total_bytes
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                total = self._db.execute(_TOTAL_BYTES).fetchone()[0]
+                orphaned = []
+                rows = self._db.execute("SELECT url_key, content_hash, size FROM pages ORDER BY last_access").fetchall()
+                for url_key, digest, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM pages WHERE url_key = ?", (url_key,))
+                    self.stats["evictions"] += 1
+                    still_used = self._db.execute("SELECT 1 FROM pages WHERE content_hash = ? LIMIT 1", (digest,)).fetchone()
+                    if not still_used:
+                        self._db.execute("DELETE FROM extractions WHERE content_hash = ?", (digest,))
+                        orphaned.append(digest)
+                        total -= size
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._total_bytes = total
+        for digest in orphaned:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+        logging.info(f"Page cache evicted entries down to {total} bytes.")
+
+    def report(self):
+        """Returns hit/miss counters for this process plus the on-disk totals."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "disk_bytes": self.total_bytes(),
+        }
+
+
+_default_cache = None
+
+def get_default_cache():
+    """
+    Returns the process-wide cache, created on first use from the
+    PAGE_CACHE_* settings. Set RESEARCH_OFFLINE=1 to run from the cache only.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = PageCache(offline=os.getenv("RESEARCH_OFFLINE", "0") == "1")
+    return _default_cache
@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque, namedtuple
+from urllib.parse import urlparse
+
+import instrumentation
+
+# Resource types never downloaded by default; article text does not need them
+DEFAULT_BLOCKED_RESOURCE_TYPES = os.getenv("BROWSER_BLOCK_RESOURCE_TYPES", "image,media,font").split(",")
+
+# Ad, tracking and analytics hosts, matched by suffix. Extend with BROWSER_BLOCK_DOMAINS.
+TRACKER_DOMAINS = [
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "googletagmanager.com",
+    "googletagservices.com",
+    "google-analytics.com",
+    "adservice.google.com",
+    "amazon-adsystem.com",
+    "adnxs.com",
+    "adsrvr.org",
+    "rlcdn.com",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "quantcount.com",
+    "chartbeat.com",
+    "chartbeat.net",
+    "hotjar.com",
+    "taboola.com",
+    "outbrain.com",
+    "criteo.com",
+    "criteo.net",
+    "pubmatic.com",
+    "rubiconproject.com",
+    "openx.net",
+    "casalemedia.com",
+    "moatads.com",
+    "krxd.net",
+    "bluekai.com",
+    "demdex.net",
+    "omtrdc.net",
+    "everesttech.net",
+    "mathtag.com",
+    "bidswitch.net",
+    "smartadserver.com",
+    "teads.tv",
+    "yieldmo.com",
+    "sharethrough.com",
+    "facebook.net",
+    "connect.facebook.com",
+    "ads-twitter.com",
+    "analytics.twitter.com",
+    "bat.bing.com",
+    "clarity.ms",
+    "nr-data.net",
+    "segment.io",
+    "cdn.segment.com",
+    "optimizely.com",
+    "newrelic.com",
+]
+TRACKER_DOMAINS += [d for d in os.getenv("BROWSER_BLOCK_DOMAINS", "").split(",") if d]
+
+# Per-page budgets: past them the page is stopped and whatever has loaded is used
+DEFAULT_BYTE_BUDGET = int(os.getenv("PAGE_BYTE_BUDGET", 5 * 1024 ** 2))
+DEFAULT_TIME_BUDGET = float(os.getenv("PAGE_TIME_BUDGET", 20))
+
+# Readiness: the page's text length is sampled every POLL_INTERVAL seconds after
+# DOMContentLoaded, and the page is ready once it has not changed for STABLE_CHECKS samples
+POLL_INTERVAL = 0.25
+STABLE_CHECKS = 2
+
+_TEXT_LENGTH = "() => document.body ? document.body.textContent.length : 0"
+
+# How one page load went. `budget_exceeded` is None, "bytes" or "time".
+PageLoad = namedtuple("PageLoad", [
+    "url", "dom_ready_seconds", "ready_seconds", "requests", "blocked_by_type", "blocked_by_domain",
+    "bytes_loaded", "budget_exceeded",
+])
+
+LOAD_STATS = {
+    "pages": 0,
+    "requests": 0,
+    "blocked_by_type": {},
+    "blocked_by_domain": 0,
+    "bytes_loaded": 0,
+    "seconds": 0.0,
+    "bytes_budget_exceeded": 0,
+    "time_budget_exceeded": 0,
+}
+
+# The latest page loads, for the per-page part of the report
+RECENT_LOADS = 1000
+_recent_loads = deque(maxlen=RECENT_LOADS)
+# The latest unrestricted load of each URL (load_page_unrestricted), as
+# (seconds, bytes, requests): what the lean loads of that URL are compared with
+_unrestricted_loads = {}
+
+
+class InterceptionPolicy:
+    """
+    Decides which requests a page may make while it loads.
+
+    Usage:
+        policy = InterceptionPolicy(blocked_resource_types=["image", "font"], blocked_domains=["doubleclick.net"])
+        policy.block_reason("image", "https://example.com/a.png")   # "image"
+    """
+
+    def __init__(self, blocked_resource_types=DEFAULT_BLOCKED_RESOURCE_TYPES, blocked_domains=TRACKER_DOMAINS):
+        """
+        Args:
+            blocked_resource_types: Playwright resource types to abort ("image",
+                "media", "font", "stylesheet", ...). The document itself is never blocked.
+            blocked_domains: Hosts to abort, matched by suffix, whatever the resource type.
+        """
+        self.blocked_resource_types = frozenset(t.strip() for t in blocked_resource_types if t.strip())
+        self.blocked_domains = tuple(d.strip().lower().lstrip(".") for d in blocked_domains if d.strip())
+        self._host_cache = {}
+
+    def _blocked_host(self, host):
+        if host not in self._host_cache:
+            self._host_cache[host] = any(host == d or host.endswith("." + d) for d in self.blocked_domains)
+        return self._host_cache[host]
+
+    def block_reason(self, resource_type, url):
+        """Returns "domain" or the blocked resource type, or None to let the request through."""
+        if resource_type == "document":
+            return None
+        if self._blocked_host((urlparse(url).hostname or "").lower()):
+            return "domain"
+        if resource_type in self.blocked_resource_types:
+            return resource_type
+        return None
+
+
+DEFAULT_POLICY = InterceptionPolicy()
+
+
+class _LoadState:
+    def __init__(self, byte_budget):
+        self.byte_budget = byte_budget
+        self.requests = 0
+        self.blocked_by_type = {}
+        self.blocked_by_domain = 0
+        self.bytes_loaded = 0
+        self.over_budget = False
+        self.unsized = set()
+
+    def add_bytes(self, count):
+        self.bytes_loaded += max(count, 0)
+        if self.bytes_loaded > self.byte_budget:
+            self.over_budget = True
+
+
+def _count_responses(page, state):
+    """Counts the responses of `page` and their bytes into `state`. Returns a function that stops counting."""
+    def on_response(response):
+        state.requests += 1
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            state.add_bytes(int(length))
+        else:
+            state.unsized.add(response.request)
+
+    async def on_request_finished(request):
+        # Chunked and compressed-on-the-fly responses have no Content-Length;
+        # their size is known once they have finished
+        if request not in state.unsized:
+            return
+        state.unsized.discard(request)
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            return  # The page closed meanwhile
+        state.add_bytes(sizes["responseBodySize"])
+
+    page.on("response", on_response)
+    page.on("requestfinished", on_request_finished)
+
+    def stop():
+        page.remove_listener("response", on_response)
+        page.remove_listener("requestfinished", on_request_finished)
+    return stop
+
+
+async def load_page(page, url, policy=DEFAULT_POLICY, byte_budget=DEFAULT_BYTE_BUDGET, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Navigates `page` to `url` and returns once its main content is ready.
+
+    Requests the policy rejects are aborted before they leave the browser.
+    Instead of waiting for the network to go idle (which pages with
+    analytics beacons or long polling never do), the page counts as ready
+    at DOMContentLoaded once its text has stopped changing. A page that
+    loads more than `byte_budget` bytes, or is not ready within
+    `time_budget` seconds, is stopped and used as it is.
+
+    Args:
+        page: A Playwright page, e.g. from BrowserPool.page().
+        url: The URL to load.
+        policy: InterceptionPolicy, or None to let every request through.
+        byte_budget: Bytes the page may load, by Content-Length or, for
+            responses without one, by their size once they have finished.
+        time_budget: Seconds for navigation and readiness together.
+
+    Returns:
+        PageLoad describing the load.
+
+    Raises:
+        Playwright errors if navigation itself fails (including not reaching
+        DOMContentLoaded within the time budget).
+    """
+    state = _LoadState(byte_budget)
+    start = time.perf_counter()
+    deadline = start + time_budget
+
+    async def route(route):
+        request = route.request
+        if state.over_budget:
+            # Counted under blocked_by_type["budget"]
+            reason = "budget"
+        else:
+            reason = policy.block_reason(request.resource_type, request.url) if policy else None
+        try:
+            if reason is None:
+                await route.continue_()
+                return
+            if reason == "domain":
+                state.blocked_by_domain += 1
+            else:
+                state.blocked_by_type[reason] = state.blocked_by_type.get(reason, 0) + 1
+            await route.abort("blockedbyclient")
+        except Exception:
+            pass  # The page navigated away or closed while the request was pending
+
+    await page.route("**/*", route)
+    stop_counting = _count_responses(page, state)
+    budget_exceeded = None
+    try:
+        await page.goto(url, wait_until="domcontentloaded", timeout=time_budget * 1000)
+        dom_ready = time.perf_counter() - start
+        if not await _wait_for_stable_text(page, deadline, state):
+            budget_exceeded = "bytes" if state.over_budget else "time"
+            # Stop every pending request; the DOM loaded so far is kept
+            await page.evaluate("() => window.stop()")
+    finally:
+        stop_counting()
+        try:
+            await page.unroute("**/*", route)
+        except Exception:
+            pass
+
+    load = PageLoad(
+        url, dom_ready, time.perf_counter() - start, state.requests, dict(state.blocked_by_type),
+        state.blocked_by_domain, state.bytes_loaded, budget_exceeded,
+    )
+    _record(load)
+    return load
+
+
+async def load_page_unrestricted(page, url, timeout=60):
+    """
+    Loads `url` the way a browser does unassisted: every request goes
+    through and the page is ready once the network is idle.
+
+    The load is remembered as the reference that lean loads of the same URL
+    (load_page) are compared with in get_load_report(); it does not count
+    towards the report's totals.
+
+    Returns:
+        (seconds, bytes loaded, requests made).
+    """
+    state = _LoadState(float("inf"))
+    stop_counting = _count_responses(page, state)
+    start = time.perf_counter()
+    try:
+        await page.goto(url, timeout=timeout * 1000)
+        await page.wait_for_load_state("networkidle", timeout=timeout * 1000)
+    finally:
+        stop_counting()
+    load = (time.perf_counter() - start, state.bytes_loaded, state.requests)
+    _unrestricted_loads[url] = load
+    return load
+
+
+async def _wait_for_stable_text(page, deadline, state):
+    """Waits until the page's text length stops changing. Returns False if a budget ran out first."""
+    previous = None
+    stable = 0
+    while time.perf_counter() < deadline and not state.over_budget:
+        length = await page.evaluate(_TEXT_LENGTH)
+        if length and length == previous:
+            stable += 1
+            if stable >= STABLE_CHECKS:
+                return True
+        else:
+            stable = 0
+        previous = length
+        await asyncio.sleep(POLL_INTERVAL)
+    return False
+
+
+def _record(load):
+    _recent_loads.append(load)
+    LOAD_STATS["pages"] += 1
+    LOAD_STATS["requests"] += load.requests
+    for resource_type, count in load.blocked_by_type.items():
+        LOAD_STATS["blocked_by_type"][resource_type] = LOAD_STATS["blocked_by_type"].get(resource_type, 0) + count
+    LOAD_STATS["blocked_by_domain"] += load.blocked_by_domain
+    LOAD_STATS["bytes_loaded"] += load.bytes_loaded
+    LOAD_STATS["seconds"] += load.ready_seconds
+    if load.budget_exceeded:
+        LOAD_STATS[f"{load.budget_exceeded}_budget_exceeded"] += 1
+        logging.info(f"Stopped {load.url} after {load.ready_seconds:.1f}s and {load.bytes_loaded} bytes: {load.budget_exceeded} budget exceeded.")
+    blocked = sum(load.blocked_by_type.values()) + load.blocked_by_domain
+    instrumentation.count(requests=load.requests, blocked_requests=blocked, bytes_loaded=load.bytes_loaded)
+    if load.budget_exceeded:
+        instrumentation.annotate(budget_exceeded=load.budget_exceeded)
+
+
+def _page_report(load):
+    """One page load, with what it saved against the unrestricted load of the same URL (None without one)."""
+    reference = _unrestricted_loads.get(load.url)
+    seconds, bytes_loaded, requests = reference if reference is not None else (None, None, None)
+    return {
+        "url": load.url,
+        "seconds": load.ready_seconds,
+        "bytes_loaded": load.bytes_loaded,
+        "requests": load.requests,
+        "blocked_requests": sum(load.blocked_by_type.values()) + load.blocked_by_domain,
+        "budget_exceeded": load.budget_exceeded,
+        "seconds_saved": seconds - load.ready_seconds if reference is not None else None,
+        "bytes_saved": bytes_loaded - load.bytes_loaded if reference is not None else None,
+        "requests_saved": requests - load.requests if reference is not None else None,
+    }
+
+
+def get_load_report(per_page=False):
+    """
+    Returns totals and per-page averages for browser page loads: requests
+    made and blocked, bytes loaded, seconds until ready and budget aborts.
+
+    Pages whose URL was also loaded with load_page_unrestricted() are
+    compared with that load: "saved_per_page" averages the seconds, bytes
+    and requests saved. With `per_page`, "per_page" lists the latest
+    RECENT_LOADS loads one by one, with their own savings.
+    """
+    pages = LOAD_STATS["pages"]
+    blocked = sum(LOAD_STATS["blocked_by_type"].values()) + LOAD_STATS["blocked_by_domain"]
+    pages_report = [_page_report(load) for load in _recent_loads]
+    compared = [page for page in pages_report if page["bytes_saved"] is not None]
+    report = {
+        **{key: value for key, value in LOAD_STATS.items() if key != "blocked_by_type"},
+        "blocked_by_type": dict(LOAD_STATS["blocked_by_type"]),
+        "blocked_requests_per_page": blocked / pages if pages else 0.0,
+        "bytes_per_page": LOAD_STATS["bytes_loaded"] / pages if pages else 0.0,
+        "seconds_per_page": LOAD_STATS["seconds"] / pages if pages else 0.0,
+        "saved_per_page": {
+            key: sum(page[key] for page in compared) / len(compared) for key in ("seconds_saved", "bytes_saved", "requests_saved")
+        } if compared else None,
+    }
+    if per_page:
+        report["per_page"] = pages_report
+    return report
@@ -1,78 +1,164 @@
 import time
-import random
-import json
 # import keyring
 # import google.generativeai as genai
-from google import genai
-from llama_cpp import Llama
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
 import asyncio
+import contextlib
+import logging
 
 import web_crawler
+import browser_pool
+import crawl_scheduler
+import page_cache
+import frontier
+import extraction_executor
 import google_search_api
+import LLM
+import structured_output
+import instrumentation
+import corpus_index
+import context_packing
+from budget import BudgetController, NoveltyTracker, unknown_facts
+from llm_gateway import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 
 
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-# Initialize LLM (assuming it's a local model)
-# This should ideally be passed or managed globally if multiple modules use it
-llm = Llama.from_pretrained(
-    repo_id="unsloth/gemma-3-1b-it-GGUF",
-    filename="gemma-3-1b-it-Q5_K_M.gguf",
-    n_ctx=20000
-)
-
-def _get_gemini_model():
-    try:
-        api_key = os.getenv("GEMINI_KEY")
-        if not api_key:
-            return None
-        genai.configure(api_key=api_key)
-        return ChatGoogleGenerativeAI(model="gemini-pro", google_api_key=api_key)
-    except Exception:
-        return None
-
-def _get_llm_response(prompt: str, gemini_model=None) -> str:
-    """Helper function to get response from the LLM, preferring Gemini if available."""
-    if gemini_model:
-        try:
-            response = gemini_model.invoke([HumanMessage(content=prompt)])
-            return response.content.strip()
-        except Exception:
-            pass # Fallback to local LLM if Gemini fails
-
-    response = llm.create_chat_completion(messages=[{"role": "user", "content": prompt}])
-    return response["choices"][0]["message"]["content"].strip()
+# Pages fetched and analyzed at the same time
+PAGE_CONCURRENCY = 4
+# Tokens of page text given to the page analysis, cut at a sentence end
+PAGE_TEXT_TOKENS = 500
+# Pages finished between two saves of the session's progress (and of their URLs as done)
+SAVE_STATE_EVERY = 10
+
+PERSON_TYPE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "person_type": {"type": "string"},
+        "initial_keywords": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["person_type"],
+}
+
+PAGE_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_same_person": {"type": "boolean"},
+        "reason": {"type": "string"},
+        "new_facts": {"type": "object"},
+        "details": {"type": "object"},
+        "social_media": {"type": "object"},
+        "urls": {"type": "array", "items": {"type": "string"}},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["is_same_person"],
+}
+
+PROFILE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "summary": {"type": "string"},
+        "social_media_links": {"type": "object"},
+        "discrepancies": {"type": "array"},
+        "confidence_score": {"type": "number"},
+    },
+}
+
+# Each prompt is a fixed prefix (the instructions and output format) followed by
+# the call's data. Passed to the gateway as `prefix`, it lets the local model
+# reuse its evaluated state of the instructions instead of re-reading them.
+PERSON_TYPE_PREFIX = """Analyze the initial context about a person given below and classify their likely type (e.g., "famous", "academic", "professional", "business", "local").
+Also, suggest initial relevant keywords for searching this person online.
+
+Provide the output in a JSON format with 'person_type' and 'initial_keywords' (a list of strings).
+Example: {"person_type": "famous", "initial_keywords": ["actor", "movies", "Hollywood"]}
+"""
+PERSON_TYPE_PROMPT = """
+Initial context: {initial_context}
+"""
+
+QUERIES_PREFIX = """Given a person's name, their classified type and current keywords (below),
+generate 3-5 additional, highly relevant and diverse search queries to find more information about them.
+Focus on unique identifiers, achievements, or specific affiliations.
+Provide each query on a new line.
+"""
+QUERIES_PROMPT = """
+Name: "{person_name}"
+Type: "{person_type}"
+Current keywords: {current_keywords}
+"""
+
+PAGE_ANALYSIS_PREFIX = """Analyze the following text and determine if it is primarily about the person named below.
+Consider the known facts about the person for identity verification.
+If it is a different person with a similar name, state that clearly and leave the other fields empty.
+If it is the same person, also extract:
+- 'new_facts': new, concrete facts that help confirm identity (e.g., birth year, specific achievements, affiliations)
+- 'details': occupation, education, notable achievements, affiliations, birth date/year, death date/year (omit fields not found)
+- 'social_media': handles or profile URLs keyed by platform (instagram, facebook, twitter, linkedin)
+- 'urls': new, relevant URLs that could lead to more information about THIS SAME PERSON
+- 'keywords': new search keywords about THIS SAME PERSON
+
+Provide your response as a single JSON object with the keys 'is_same_person' (true/false), 'reason' (brief explanation),
+'new_facts', 'details', 'social_media' (objects) and 'urls', 'keywords' (lists of strings).
+Example for same person: {"is_same_person": true, "reason": "Matches name and context", "new_facts": {"university": "MIT"}, "details": {"occupation": "scientist"}, "social_media": {"twitter": "@example"}, "urls": [], "keywords": ["MIT physics"]}
+Example for different person: {"is_same_person": false, "reason": "Different birth year and profession", "new_facts": {}, "details": {}, "social_media": {}, "urls": [], "keywords": []}
+"""
+PAGE_ANALYSIS_PROMPT = """
+Person: "{person_name}"
+Known facts: {known_facts}
+
+Text:
+{text}
+"""
+
+SYNTHESIS_PREFIX = """Consolidate and synthesize the raw extracted data about a person given below into a comprehensive, well-structured profile.
+Resolve inconsistencies where possible, or list them under a 'discrepancies' section.
+Include a 'confidence_score' (0-100) based on the consistency and number of corroborating sources.
+
+Provide the final profile in JSON format with keys like:
+"name", "summary", "occupation", "education", "notable_achievements", "affiliations", "social_media_links" (dict), "birth_info", "death_info", "discrepancies", "confidence_score".
+"""
+SYNTHESIS_PROMPT = """
+Person: "{person_name}"
+Extracted Details: {details}
+Social Media: {social_media}
+Discrepancies encountered during search: {discrepancies}
+Identity Fingerprint: {identity_fingerprint}
+"""
+
+async def _get_llm_response(prompt: str, priority: int = PRIORITY_NORMAL, call_site: str = "person_researcher",
+                            prefix: str = None) -> str:
+    """
+    Helper function to get response from the LLM, preferring Gemini if available.
+    Goes through the shared async gateway, so generation never blocks the crawler
+    and repeated prompts are answered from the response cache.
+    """
+    result = await LLM.gateway.complete(prompt, priority=priority, call_site=call_site, prefix=prefix)
+    return result.text
 
-def _classify_person_type(initial_context: dict) -> dict:
+async def _classify_person_type(initial_context: dict) -> dict:
     """
     Uses LLM to classify the person's type (e.g., famous, academic, professional)
     and suggest initial search keywords.
     """
-    gemini_model = _get_gemini_model()
-    prompt = f"""Analyze the following initial context about a person and classify their likely type (e.g., "famous", "academic", "professional", "business", "local").
-    Also, suggest initial relevant keywords for searching this person online.
-    Initial context: {initial_context}
-
-    Provide the output in a JSON format with 'person_type' and 'initial_keywords' (a list of strings).
-    Example: {{\"person_type\": \"famous\", \"initial_keywords\": [\"actor\", \"movies\", \"Hollywood\"]}}
-    """
-    response_text = _get_llm_response(prompt, gemini_model)
+    prompt = PERSON_TYPE_PREFIX + PERSON_TYPE_PROMPT.format(initial_context=initial_context)
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError:
-        print(f"Warning: Could not parse LLM response for person type classification: {response_text}")
+        result = await structured_output.complete_json(
+            LLM.gateway, prompt, PERSON_TYPE_SCHEMA, priority=PRIORITY_HIGH, call_site="classify_person_type",
+            prefix=PERSON_TYPE_PREFIX
+        )
+    except structured_output.StructuredOutputError as e:
+        logging.warning(f"Could not parse LLM response for person type classification: {e}")
         return {"person_type": "unknown", "initial_keywords": []}
+    return result.data
 
-def _generate_dynamic_search_queries(person_name: str, person_type: str, current_keywords: list) -> list:
+async def _generate_dynamic_search_queries(person_name: str, person_type: str, current_keywords: list) -> list:
     """
     Generates dynamic search queries based on person type and current keywords.
     Uses rule-based for common social media, LLM for more nuanced queries.
     """
-    gemini_model = _get_gemini_model()
     queries = []
     # Rule-based additions for common social media/platforms
     if person_type == "famous":
@@ -97,12 +183,8 @@ def _generate_dynamic_search_queries(person_name: str, person_type: str, current
         ])
     
     # LLM-assisted query generation for more depth
-    llm_prompt = f"""Given the person's name "{person_name}", their classified type "{person_type}", and current keywords {current_keywords},
-    generate 3-5 additional, highly relevant and diverse search queries to find more information about them.
-    Focus on unique identifiers, achievements, or specific affiliations.
-    Provide each query on a new line.
-    """
-    llm_generated_queries = _get_llm_response(llm_prompt, gemini_model).split('\n')
+    llm_prompt = QUERIES_PREFIX + QUERIES_PROMPT.format(person_name=person_name, person_type=person_type, current_keywords=current_keywords)
+    llm_generated_queries = (await _get_llm_response(llm_prompt, PRIORITY_HIGH, "generate_queries", QUERIES_PREFIX)).split('\n')
     queries.extend([q.strip() for q in llm_generated_queries if q.strip()])
     
     # Add general queries
@@ -111,63 +193,85 @@ def _generate_dynamic_search_queries(person_name: str, person_type: str, current
     
     return list(set(queries)) # Remove duplicates
 
-def _verify_identity_and_extract_facts(extracted_text: str, person_name: str, identity_fingerprint: dict) -> tuple[bool, dict]:
+def _fill_analysis_defaults(data: dict) -> dict:
+    """Fills in the optional fields of a validated page analysis."""
+    analysis = {"is_same_person": data["is_same_person"], "reason": data.get("reason") or ""}
+    for key in ("new_facts", "details", "social_media"):
+        analysis[key] = data.get(key) or {}
+    for key in ("urls", "keywords"):
+        analysis[key] = [v.strip() for v in data.get(key) or [] if v.strip()]
+    return analysis
+
+async def _analyze_page(extracted_text: str, person_name: str, identity_fingerprint: dict) -> tuple[dict, int]:
     """
-    Uses LLM to verify if the extracted text is about the correct person and extracts new facts.
+    Verifies whether a page is about the person and, if so, extracts new identity facts,
+    profile details, social media handles, and follow-up URLs and keywords, all in one LLM call.
     identity_fingerprint: A dict of known facts like {'birth_year': '1980', 'occupation': 'actor'}
+
+    Returns the validated analysis dict (None if no valid response was obtained)
+    and the number of LLM calls it took.
     """
-    gemini_model = _get_gemini_model()
     known_facts_str = ", ".join([f"{k}: {v}" for k, v in identity_fingerprint.items()]) if identity_fingerprint else "None"
-    
-    prompt = f"""Analyze the following text and determine if it is primarily about "{person_name}".
-    Consider these known facts about the person for identity verification: {known_facts_str}.
-    If it is the same person, extract any new, concrete facts (e.g., birth year, specific achievements, affiliations, social media handles) that can help confirm identity or build a profile.
-    If it is a different person with a similar name, state that clearly.
-    
-    Text:
-    {extracted_text[:1000]} # Limit text to avoid exceeding LLM context window
 
-    Provide your response in JSON format with two keys:
-    'is_same_person': true/false
-    'new_facts': {{\"fact_key\": 'fact_value', ...}} (empty if not the same person or no new facts)
-    'reason': 'brief explanation'
-    
-    Example for same person: {{\"is_same_person\": true, \"new_facts\": {{\"occupation\": \"scientist\", \"university\": \"MIT\"}}, \"reason\": \"Matches name and context\"}}
-    Example for different person: {{\"is_same_person\": false, \"new_facts\": None, \"reason\": \"Different birth year and profession\"}}
-    """
-    response_text = _get_llm_response(prompt, gemini_model)
+    prompt = PAGE_ANALYSIS_PREFIX + PAGE_ANALYSIS_PROMPT.format(
+        person_name=person_name, known_facts=known_facts_str,
+        text=context_packing.truncate_to_tokens(extracted_text, PAGE_TEXT_TOKENS),
+    )
     try:
-        llm_response = json.loads(response_text)
-        return llm_response.get("is_same_person", False), llm_response.get("new_facts", {})
-    except json.JSONDecodeError:
-        print(f"Warning: Could not parse LLM response for identity verification: {response_text}")
-        return False, {} # Default to not same person if parsing fails
-
-async def research_person(initial_context: dict, search_duration_minutes: int = 60) -> dict:
+        result = await structured_output.complete_json(
+            LLM.gateway, prompt, PAGE_ANALYSIS_SCHEMA, priority=PRIORITY_HIGH, call_site="analyze_page",
+            prefix=PAGE_ANALYSIS_PREFIX
+        )
+    except structured_output.StructuredOutputError as e:
+        logging.warning(f"Could not parse LLM response for page analysis: {e}")
+        return None, 1 + structured_output.MAX_REPAIRS
+    return _fill_analysis_defaults(result.data), 1 + result.repairs
+
+async def research_person(initial_context: dict, search_duration_minutes: int = 60, page_concurrency: int = PAGE_CONCURRENCY,
+                          pool=None, http_client=None, executor=None, budget: BudgetController = None) -> dict:
     """
     Conducts a detailed research on a person, verifying identity and accumulating information.
     
     Args:
         initial_context: A dictionary with initial info, e.g., {'name': 'John Doe', 'known_for': 'actor'}.
-        search_duration_minutes: Maximum time to spend searching.
-        
+        search_duration_minutes: Maximum time to spend searching (the time
+            budget, unless `budget` is given).
+        page_concurrency: Pages fetched and analyzed at the same time.
+        pool, http_client, executor: Shared BrowserPool, httpx client and
+            ExtractionExecutor; each one not given is created for this run.
+        budget: BudgetController deciding when to stop searching, crawling
+            and analyzing pages. By default the time budget is
+            `search_duration_minutes` and the other limits come from the
+            RESEARCH_* settings; crawling also stops once pages stop adding
+            new facts, new text or confidence.
+
     Returns:
-        A dictionary containing the compiled person profile.
+        A dictionary containing the compiled person profile. Its
+        "research_stats" include the run's timing report ("timings") and the
+        budget's stop reason and consumption ("budget").
     """
+    with instrumentation.run("research_person", person=initial_context.get("name")) as trace:
+        person_profile = await _research_person(initial_context, search_duration_minutes, page_concurrency, pool, http_client, executor, budget)
+    if "research_stats" in person_profile:
+        person_profile["research_stats"]["timings"] = trace.report()
+    return person_profile
+
+async def _research_person(initial_context, search_duration_minutes, page_concurrency, pool, http_client, executor, budget):
     person_name = initial_context.get("name")
     if not person_name:
         return {"error": "Person name is required in initial_context."}
 
-    start_time = time.time()
-    end_time = start_time + (search_duration_minutes * 60)
+    if budget is None:
+        budget = BudgetController(max_seconds=search_duration_minutes * 60)
+    novelty = NoveltyTracker()
 
     # Step 1: Classify person type and get initial keywords
-    classification_result = _classify_person_type(initial_context)
+    classification_result = await _classify_person_type(initial_context)
     person_type = classification_result.get("person_type", "unknown")
     current_keywords = classification_result.get("initial_keywords", [])
     
-    print(f"Classified person type: {person_type}")
-    print(f"Initial keywords: {current_keywords}")
+    logging.info(f"Classified person type: {person_type}")
+    logging.info(f"Initial keywords: {current_keywords}")
 
     person_profile = {
         "name": person_name,
@@ -181,130 +285,220 @@ async def research_person(initial_context: dict, search_duration_minutes: int =
     }
     identity_fingerprint = {"name": person_name} # Key facts to verify identity
 
-    urls_to_visit = []
-    visited_urls = set()
-
-    # Step 2: Initial search query generation and execution
-    initial_queries = _generate_dynamic_search_queries(person_name, person_type, current_keywords)
-    print(f"Initial search queries: {initial_queries}")
-
-    for query in initial_queries:
-        if time.time() > end_time:
-            print("Search duration exceeded. Stopping initial searches.")
-            break
-        
-        search_results = google_search_api.google_search_api(query, google_search_api.api_key, google_search_api.cx)
-        if search_results and "error" not in search_results:
-            for result in search_results:
-                if result["link"] not in visited_urls:
-                    urls_to_visit.append(result["link"])
-                    visited_urls.add(result["link"])
-        await asyncio.sleep(random.uniform(1, 3)) # Be polite
-
-    print(f"Found {len(urls_to_visit)} unique URLs from initial searches.")
-
-    # Step 3: Intelligent Crawling and Data Accumulation Loop
-    while urls_to_visit and time.time() < end_time:
-        url = urls_to_visit.pop(0)
-        print(f"Processing URL: {url}")
-
-        try:
-            html_content = await web_crawler.get_page_content(url)
-            if html_content:
-                extracted_data = await web_crawler.extract_article_content_with_newspaper(html_content, url)
-                extracted_text = extracted_data.get("text", "")
-
-                if not extracted_text:
-                    print(f"No main text extracted from {url}. Trying trafilatura...")
-                    extracted_text = await web_crawler.extract_article_content_with_trafilatura(html_content)
-                
-                if not extracted_text:
-                    print(f"Still no text from {url}. Skipping.")
-                    continue
-
-                # Identity Verification
-                is_same_person, new_facts = _verify_identity_and_extract_facts(extracted_text, person_name, identity_fingerprint)
-
-                if is_same_person:
-                    print(f"Confirmed identity for {url}. Extracting info...")
-                    # Update identity fingerprint
-                    identity_fingerprint.update(new_facts)
-                    
-                    # Extract detailed information using LLM
-                    extraction_prompt = f"""From the following text about "{person_name}", extract key details.
-                    Focus on: occupation, education, notable achievements, affiliations, social media handles (Instagram, Facebook, Twitter/X, LinkedIn), birth date/year, death date/year.
-                    Provide the output in JSON format. If a field is not found, omit it.
-                    Text:
-                    {extracted_text[:2000]} # Limit text for extraction
-                    """
-                    extracted_info_text = _get_llm_response(extraction_prompt, _get_gemini_model())
-                    try:
-                        extracted_info = json.loads(extracted_info_text)
-                        person_profile["details"].update(extracted_info)
-                        
-                        # Special handling for social media links
+    cache = page_cache.get_default_cache()
+    # URLs to visit, best first; persisted so an interrupted session resumes where it stopped
+    urls_to_visit = await asyncio.to_thread(frontier.Frontier, f"person:{person_name.lower()}", identity_terms=person_name.lower().split())
+    with urls_to_visit:  # Closed however the session ends
+        saved_state = await asyncio.to_thread(urls_to_visit.load_state)
+        if saved_state is not None:
+            person_profile = saved_state["profile"]
+            identity_fingerprint = saved_state["fingerprint"]
+            current_keywords = saved_state["keywords"]
+            logging.info(f"Resuming earlier session with {len(urls_to_visit)} queued URLs.")
+        else:
+            # Step 2: Initial search query generation and execution
+            initial_queries = await _generate_dynamic_search_queries(person_name, person_type, current_keywords)
+            remaining_requests = budget.remaining("requests")
+            if remaining_requests is not None:
+                initial_queries = initial_queries[:remaining_requests]
+            budget.charge(requests=len(initial_queries))
+            logging.info(f"Initial search queries: {initial_queries}")
+
+            with instrumentation.span("search_many", queries=len(initial_queries)):
+                async with google_search_api.SearchClient(cache=cache) as search_client:
+                    results_by_query = await search_client.search_many(initial_queries)
+
+            def add_results():
+                for search_results in results_by_query.values():
+                    for rank, result in enumerate(search_results):
+                        urls_to_visit.add(result["link"], title=result["title"], snippet=result["snippet"], rank=rank)
+
+            await asyncio.to_thread(add_results)
+
+            logging.info(f"Found {len(urls_to_visit)} unique URLs from initial searches.")
+
+        # Step 3: Crawl and analyze pages concurrently, one LLM call per page
+        crawl_stats = {"pages_fetched": 0, "pages_with_text": 0, "pages_analyzed": 0, "pages_confirmed": 0, "llm_calls": 0}
+        scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=page_concurrency)
+        in_flight = 0
+        finished = []  # (url, success) of pages whose results are not saved yet
+        crawl_start = time.time()
+
+        # The frontier is SQLite: its calls run in a thread, off the event loop
+        async def save_progress():
+            # Copied here, since pages keep updating the profile while the thread serializes it
+            state = {
+                "profile": {key: value.copy() if isinstance(value, (dict, list)) else value for key, value in person_profile.items()},
+                "fingerprint": dict(identity_fingerprint),
+                "keywords": list(current_keywords),
+            }
+            done = finished.copy()
+            finished.clear()
+            # Pages are marked done together with the state holding their results: after a
+            # crash, pages whose results were not saved are still in progress and are visited again
+            await asyncio.to_thread(urls_to_visit.save_state, state, done)
+
+        def add_discovered(urls, depth):
+            for new_url in urls:
+                urls_to_visit.add(new_url, depth=depth, source="discovery")
+
+        async def finish(url, outcome):
+            if outcome == "unvisited":
+                # Stopped before analyzing it: a resumed session still visits it
+                await asyncio.to_thread(urls_to_visit.release, url)
+                return
+            finished.append((url, outcome == "done"))
+            if len(finished) >= SAVE_STATE_EVERY:
+                await save_progress()
+
+        async with contextlib.AsyncExitStack() as resources:
+            if pool is None:
+                pool = await resources.enter_async_context(browser_pool.BrowserPool())
+            if http_client is None:
+                http_client = await resources.enter_async_context(web_crawler.create_http_client())
+            if executor is None:
+                executor = await resources.enter_async_context(extraction_executor.ExtractionExecutor())
+
+            async def process(item):
+                url = item.url
+                logging.info(f"Processing URL: {url}")
+                with instrumentation.span("page", url=url, depth=item.depth) as span:
+                    await process_page(item, span)
+
+            async def process_page(item, span):
+                url = item.url
+                outcome = "done"
+                try:
+                    queued_at = time.perf_counter()
+                    async with scheduler.slot(url):
+                        span.add(queue_seconds=time.perf_counter() - queued_at)
+                        if budget.should_stop():
+                            outcome = "unvisited"
+                            return
+                        budget.charge(requests=1)
+                        html_content = await web_crawler.fetch_page(url, pool=pool, http_client=http_client, cache=cache, executor=executor)
+                    if not html_content:
+                        outcome = "failed"
+                        return
+                    crawl_stats["pages_fetched"] += 1
+                    extracted_data = await web_crawler.extract_article_content_with_newspaper(html_content, url, cache, executor)
+                    extracted_text = extracted_data.get("text", "")
+
+                    if not extracted_text:
+                        logging.info(f"No main text extracted from {url}. Trying trafilatura...")
+                        extracted_text = await web_crawler.extract_article_content_with_trafilatura(html_content, cache, executor)
+
+                    if not extracted_text:
+                        logging.warning(f"Still no text from {url}. Skipping.")
+                        outcome = "failed"
+                        return
+
+                    crawl_stats["pages_with_text"] += 1
+                    if extracted_data.get("text"):
+                        # Later research runs answer from the local corpus before searching the web
+                        try:
+                            await asyncio.to_thread(corpus_index.get_default_index().add_article, url, extracted_data)
+                        except Exception as e:
+                            logging.error(f"Error indexing {url}: {e}")
+                    if budget.should_stop():
+                        outcome = "unvisited"
+                        return  # No LLM calls once the budget says stop
+                    analysis, llm_calls = await _analyze_page(extracted_text, person_name, identity_fingerprint)
+                    crawl_stats["llm_calls"] += llm_calls
+                    if analysis is None:
+                        person_profile["discrepancies"].append(f"Failed to parse page analysis for {url}")
+                        outcome = "failed"
+                        return
+
+                    span.set(same_person=analysis["is_same_person"])
+                    crawl_stats["pages_analyzed"] += 1
+                    if analysis["is_same_person"]:
+                        crawl_stats["pages_confirmed"] += 1
+                    # Marginal gain: facts and text this page added, and how far it moved the share of pages confirming the identity
+                    facts = unknown_facts(identity_fingerprint, analysis["new_facts"]) if analysis["is_same_person"] else {}
+                    budget.observe(
+                        novelty=novelty.novelty(extracted_text) if analysis["is_same_person"] else 0.0,
+                        facts=len(facts),
+                        confidence=(crawl_stats["pages_confirmed"] + 1) / (crawl_stats["pages_analyzed"] + 2),
+                    )
+                    if analysis["is_same_person"]:
+                        logging.info(f"Confirmed identity for {url}.")
+                        identity_fingerprint.update(analysis["new_facts"])
+                        person_profile["details"].update(analysis["details"])
+                        person_profile["social_media"].update(analysis["social_media"])
+                        # Handles reported among the details belong with the social media links
                         for sm_platform in ["instagram", "facebook", "twitter", "linkedin"]:
-                            if sm_platform in extracted_info:
-                                person_profile["social_media"][sm_platform] = extracted_info[sm_platform]
-                                del person_profile["details"][sm_platform] # Remove from general details
-                                
-                    except json.JSONDecodeError:
-                        print(f"Warning: Could not parse LLM response for info extraction: {extracted_info_text}")
-                        # Add raw text to discrepancies if extraction fails
-                        person_profile["discrepancies"].append(f"Failed to parse structured info from {url}: {extracted_info_text[:200]}")
-
-                    # Discover new links/keywords from the text
-                    discovery_prompt = f"""From the following text about "{person_name}", identify any new, relevant URLs or keywords that could lead to more information about THIS SAME PERSON.
-                    Provide URLs on new lines, followed by keywords on new lines.
-                    Text:
-                    {extracted_text[:1000]}
-                    """
-                    discovery_response = _get_llm_response(discovery_prompt, _get_gemini_model())
-                    for line in discovery_response.split('\n'):
-                        line = line.strip()
-                        if line.startswith("http") and line not in visited_urls:
-                            urls_to_visit.append(line)
-                            visited_urls.add(line)
-                        elif line and not line.startswith("http"):
-                            current_keywords.append(line) # Add to keywords for future searches
-
-                else:
-                    reason = new_facts.get("reason", "Identity not confirmed.")
-                    person_profile["discrepancies"].append(f"Skipped URL {url}: {reason}")
-                    print(f"Identity not confirmed for {url}. Reason: {reason}")
-
-        except Exception as e:
-            print(f"Error processing {url}: {e}")
-            person_profile["discrepancies"].append(f"Error crawling {url}: {e}")
-        
-        await asyncio.sleep(random.uniform(1, 3)) # Be polite
-
-    # Step 4: Data Consolidation and Synthesis
-    final_synthesis_prompt = f"""Consolidate and synthesize the following raw extracted data about "{person_name}" into a comprehensive, well-structured profile.
-    Resolve inconsistencies where possible, or list them under a 'discrepancies' section.
-    Include a 'confidence_score' (0-100) based on the consistency and number of corroborating sources.
-    
-    Extracted Details: {person_profile["details"]}
-    Social Media: {person_profile["social_media"]}
-    Discrepancies encountered during search: {person_profile["discrepancies"]}
-    Identity Fingerprint: {identity_fingerprint}
-
-    Provide the final profile in JSON format with keys like:
-    "name", "summary", "occupation", "education", "notable_achievements", "affiliations", "social_media_links" (dict), "birth_info", "death_info", "discrepancies", "confidence_score".
-    """
-    final_profile_text = _get_llm_response(final_synthesis_prompt, _get_gemini_model())
-    try:
-        final_profile = json.loads(final_profile_text)
-        person_profile.update(final_profile)
-    except json.JSONDecodeError:
-        print(f"Warning: Could not parse final LLM synthesis: {final_profile_text}")
-        person_profile["summary"] = "Failed to synthesize a structured profile. Raw details: " + str(person_profile["details"])
-        person_profile["confidence_score"] = 10 # Very low confidence
-
-    return person_profile
+                            if sm_platform in person_profile["details"]:
+                                person_profile["social_media"][sm_platform] = person_profile["details"].pop(sm_platform)
+                        person_profile["links"].append(url)
+                        await asyncio.to_thread(add_discovered, analysis["urls"], item.depth + 1)
+                        current_keywords.extend(analysis["keywords"]) # Add to keywords for future searches
+                    else:
+                        reason = analysis["reason"] or "Identity not confirmed."
+                        person_profile["discrepancies"].append(f"Skipped URL {url}: {reason}")
+                        logging.info(f"Identity not confirmed for {url}. Reason: {reason}")
+
+                except Exception as e:
+                    outcome = "failed"
+                    logging.error(f"Error processing {url}: {e}")
+                    person_profile["discrepancies"].append(f"Error crawling {url}: {e}")
+                finally:
+                    await finish(url, outcome)
+
+            async def worker():
+                nonlocal in_flight
+                while not budget.should_stop():
+                    # Counted before the pop returns, so no other worker sees the frontier as exhausted meanwhile
+                    in_flight += 1
+                    item = await asyncio.to_thread(urls_to_visit.pop)
+                    if item is None:
+                        in_flight -= 1
+                        if in_flight == 0:
+                            budget.stop("frontier exhausted")
+                            return
+                        await asyncio.sleep(0.2) # Pages still being analyzed may discover more URLs
+                        continue
+                    try:
+                        await process(item)
+                    finally:
+                        in_flight -= 1
+
+            await asyncio.gather(*(worker() for _ in range(page_concurrency)))
+        await save_progress()
+
+        crawl_minutes = (time.time() - crawl_start) / 60
+        crawl_stats["pages_per_minute"] = round(crawl_stats["pages_with_text"] / crawl_minutes, 2) if crawl_minutes else 0.0
+        crawl_stats["llm_calls_per_page"] = round(crawl_stats["llm_calls"] / crawl_stats["pages_with_text"], 2) if crawl_stats["pages_with_text"] else 0.0
+        logging.info(f"Crawl stats: {crawl_stats}")
+        logging.info(f"Budget: {budget.report()}")
+        logging.info(f"Structured output: {structured_output.report()}")
+        logging.info(f"Local prompt cache: {LLM.gateway.prompt_cache_report()}")
+
+        # Step 4: Data Consolidation and Synthesis
+        final_synthesis_prompt = SYNTHESIS_PREFIX + SYNTHESIS_PROMPT.format(
+            person_name=person_name, details=person_profile["details"], social_media=person_profile["social_media"],
+            discrepancies=person_profile["discrepancies"], identity_fingerprint=identity_fingerprint,
+        )
+        try:
+            result = await structured_output.complete_json(
+                LLM.gateway, final_synthesis_prompt, PROFILE_SCHEMA, priority=PRIORITY_LOW, call_site="synthesize_profile",
+                prefix=SYNTHESIS_PREFIX
+            )
+            person_profile.update(result.data)
+        except structured_output.StructuredOutputError as e:
+            logging.warning(f"Could not parse final LLM synthesis: {e}")
+            person_profile["summary"] = "Failed to synthesize a structured profile. Raw details: " + str(person_profile["details"])
+            person_profile["confidence_score"] = 10 # Very low confidence
+
+        # The session finished, so the next run for this person starts fresh
+        logging.info(f"Frontier: {urls_to_visit.report()}")
+        await asyncio.to_thread(urls_to_visit.clear)
+        person_profile["research_stats"] = {**crawl_stats, "budget": budget.report()}
+        return person_profile
 
 if __name__ == "__main__":
     import json
+    instrumentation.configure_logging()
     # Example Usage
     initial_person_context = {
         "name": "Elon Musk",
@@ -0,0 +1,157 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections import namedtuple
+
+# Items waiting between two stages by default. Producers block once the
+# queue is full, so a slow stage holds back the ones before it instead of
+# letting their output pile up in memory.
+DEFAULT_QUEUE_SIZE = 8
+
+# One step of a pipeline. `fn` takes an item and either returns the item for
+# the next stage (None drops it) or, as an async generator, yields any number
+# of them. `queue_size` bounds the stage's input queue (None: DEFAULT_QUEUE_SIZE).
+Stage = namedtuple("Stage", ["name", "fn", "workers", "queue_size"], defaults=[1, None])
+
+_DONE = object()
+
+
+class _StageState:
+    def __init__(self, stage, queue):
+        self.stage = stage
+        self.queue = queue
+        self.running = stage.workers
+        self.stats = {
+            "workers": stage.workers, "in": 0, "out": 0, "dropped": 0, "errors": 0,
+            "busy_seconds": 0.0, "blocked_seconds": 0.0, "max_queued": 0,
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues, each
+    stage with its own pool of workers, so an item moves on as soon as its
+    stage is done with it.
+
+    Results come out of the last stage in completion order. Breaking out of
+    the loop stops the pipeline and cancels everything still in flight, which
+    is how callers stop early once they have enough.
+
+    Usage:
+        pipeline = Pipeline([Stage("fetch", fetch, workers=8), Stage("extract", extract, workers=2)])
+        async with contextlib.aclosing(pipeline.run(urls)) as results:
+            async for result in results:
+                ...
+        pipeline.report()
+    """
+
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            stages: Stage list, in order.
+            queue_size: Size of the queue after the last stage, and of every
+                stage queue whose Stage does not set one.
+        """
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self._states = []
+        self.started_at = None
+
+    async def run(self, items):
+        """
+        Feeds `items` (an iterable or async iterable) into the first stage.
+
+        Yields:
+            Every item the last stage produces, as soon as it produces it.
+        """
+        self._states = [
+            _StageState(stage, asyncio.Queue(maxsize=stage.queue_size or self.queue_size)) for stage in self.stages
+        ]
+        output = asyncio.Queue(maxsize=self.queue_size)
+        self.started_at = time.perf_counter()
+        tasks = [asyncio.create_task(self._feed(items, self._states[0].queue))]
+        for index, state in enumerate(self._states):
+            downstream = self._states[index + 1].queue if index + 1 < len(self._states) else output
+            tasks += [asyncio.create_task(self._work(state, downstream)) for _ in range(state.stage.workers)]
+        try:
+            while True:
+                item = await output.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _feed(self, items, queue):
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        await queue.put(_DONE)
+
+    async def _work(self, state, downstream):
+        stats = state.stats
+        generator = inspect.isasyncgenfunction(state.stage.fn)
+        while True:
+            stats["max_queued"] = max(stats["max_queued"], state.queue.qsize())
+            item = await state.queue.get()
+            if item is _DONE:
+                # Let the other workers of this stage see it too; the last one passes it on
+                state.queue.put_nowait(_DONE)
+                state.running -= 1
+                if state.running == 0:
+                    await downstream.put(_DONE)
+                return
+            stats["in"] += 1
+            started = time.perf_counter()
+            blocked = 0.0
+            produced = 0
+            try:
+                if generator:
+                    async for result in state.stage.fn(item):
+                        blocked += await self._put(downstream, result)
+                        produced += 1
+                else:
+                    result = await state.stage.fn(item)
+                    if result is not None:
+                        blocked += await self._put(downstream, result)
+                        produced += 1
+            except Exception as e:
+                stats["errors"] += 1
+                logging.error(f"Pipeline stage '{state.stage.name}' failed on {item!r:.200}: {e}")
+            stats["out"] += produced
+            if not produced:
+                stats["dropped"] += 1
+            stats["blocked_seconds"] += blocked
+            stats["busy_seconds"] += time.perf_counter() - started - blocked
+
+    @staticmethod
+    async def _put(queue, item):
+        """Puts `item` on the queue and returns the seconds spent waiting for room (backpressure)."""
+        if not queue.full():
+            queue.put_nowait(item)
+            return 0.0
+        waiting_since = time.perf_counter()
+        await queue.put(item)
+        return time.perf_counter() - waiting_since
+
+    def report(self):
+        """
+        Per stage: workers, items in and out, items dropped, errors, seconds
+        spent working and blocked on a full downstream queue, the longest
+        input queue seen and utilization (busy seconds per worker over the
+        run's elapsed time).
+        """
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            state.stage.name: {
+                **state.stats,
+                "utilization": state.stats["busy_seconds"] / (elapsed * state.stage.workers) if elapsed else 0.0,
+            }
+            for state in self._states
+        }
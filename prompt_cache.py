@@ -0,0 +1,207 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+
+# Defaults, overridable through the environment
+DEFAULT_STATE_DIR = os.getenv("PROMPT_STATE_DIR", os.path.join(".cache", "prompt_states"))
+DEFAULT_MAX_BYTES = int(os.getenv("PROMPT_STATE_MAX_BYTES", 4 * 1024 ** 3))
+
+# Prefixes shorter than this are cheaper to evaluate than to load from disk
+MIN_PREFIX_TOKENS = 128
+
+
+def prefix_key(model_id, prefix):
+    return hashlib.sha256(f"{model_id}\0{prefix}".encode("utf-8")).hexdigest()
+
+
+def _longest_prefix(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    n = min(len(a), len(b))
+    mismatches = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatches[0]) if len(mismatches) else n
+
+
+class PrefixStateCache:
+    """
+    Prompt state cache for a llama_cpp model (installed with Llama.set_cache),
+    so a prompt that starts like an earlier one only evaluates what is new.
+
+    Two layers:
+      - RAM: llama_cpp's LlamaRAMCache, holding the states of this process;
+        the state sharing the longest token prefix with the prompt wins.
+      - Disk: one state per prompt prefix (a fixed instruction preamble,
+        declared with begin() before each call), in a file named by the hash
+        of the model and the prefix, so a prefix evaluated once is reused by
+        later processes too. The least recently used files are removed
+        beyond `max_bytes`.
+
+    The cache only ever offers a state; llama_cpp loads it when it covers more
+    of the prompt than what the model has evaluated already.
+
+    Usage:
+        cache = PrefixStateCache(llm, "gemma-3-1b-it", LlamaRAMCache())
+        llm.set_cache(cache)
+        cache.begin(PROMPT_PREFIX)
+        llm.create_chat_completion(messages=[{"role": "user", "content": PROMPT_PREFIX + text}])
+        cache.last_lookup   # {"prompt_tokens": ..., "reused_tokens": ..., "source": ...}
+    """
+
+    def __init__(self, llm, model_id, ram_cache, state_dir=DEFAULT_STATE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 min_prefix_tokens=MIN_PREFIX_TOKENS):
+        """
+        Args:
+            llm: The llama_cpp.Llama the cache is installed on.
+            model_id: Identifies the model and its settings in state keys
+                (a state only loads into the model that saved it).
+            ram_cache: The in-process layer, e.g. llama_cpp.LlamaRAMCache.
+            state_dir: Directory of the disk layer.
+            max_bytes: Size of the disk layer.
+            min_prefix_tokens: Shorter prefixes are not stored on disk.
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        self.llm = llm
+        self.model_id = model_id
+        self.ram = ram_cache
+        self.state_dir = state_dir
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self._lock = threading.Lock()
+        self._prefix_key = None
+        self._ids = {}
+        self.last_lookup = None
+        self.stats = {"lookups": 0, "ram_hits": 0, "disk_hits": 0, "disk_writes": 0, "disk_evictions": 0, "disk_errors": 0,
+                      "prompt_tokens": 0, "reused_tokens": 0}
+
+    def begin(self, prefix):
+        """Declares the shared prefix of the next prompt (None: it has none)."""
+        self.last_lookup = None
+        self._prefix_key = None
+        if prefix and len(self.llm.tokenize(prefix.encode("utf-8"), add_bos=False)) >= self.min_prefix_tokens:
+            self._prefix_key = prefix_key(self.model_id, prefix)
+
+    def _paths(self, key):
+        return os.path.join(self.state_dir, f"{key}.ids.npy"), os.path.join(self.state_dir, f"{key}.state")
+
+    def _stored_ids(self, key):
+        """Token ids of the state stored for `key` (None if there is none); kept in memory once read."""
+        if key not in self._ids:
+            try:
+                self._ids[key] = np.load(self._paths(key)[0])
+            except (OSError, ValueError):
+                self._ids[key] = None
+        return self._ids[key]
+
+    def _load(self, key):
+        ids_path, state_path = self._paths(key)
+        try:
+            with open(state_path, "rb") as f:
+                state = pickle.load(f)
+            os.utime(ids_path)
+            os.utime(state_path)
+            return state
+        except Exception as e:
+            logging.warning(f"Could not read the prompt state {state_path}: {e}")
+            self.stats["disk_errors"] += 1
+            self.discard(key)
+            return None
+
+    def _store(self, key, state):
+        ids_path, state_path = self._paths(key)
+        # Only the last row of logits is ever read after a state is loaded, and the
+        # full matrix is one row per batch token times the vocabulary
+        state = copy.copy(state)
+        state.scores = state.scores[-1:].copy()
+        try:
+            with open(state_path + ".tmp", "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(state_path + ".tmp", state_path)
+            with open(ids_path + ".tmp", "wb") as f:
+                np.save(f, np.asarray(state.input_ids))
+            os.replace(ids_path + ".tmp", ids_path)
+        except OSError as e:
+            logging.warning(f"Could not write the prompt state {state_path}: {e}")
+            self.stats["disk_errors"] += 1
+            return
+        self._ids[key] = np.asarray(state.input_ids)
+        self.stats["disk_writes"] += 1
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.state_dir):
+            if name.endswith(".state"):
+                path = os.path.join(self.state_dir, name)
+                try:
+                    files.append((os.path.getmtime(path), os.path.getsize(path), name[:-len(".state")]))
+                except OSError:
+                    continue
+        total = sum(size for _, size, _ in files)
+        for _, size, key in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.discard(key)
+            total -= size
+            self.stats["disk_evictions"] += 1
+
+    def discard(self, key=None):
+        """Removes the disk state of `key` (default: the one offered by the last lookup)."""
+        if key is None:
+            key = (self.last_lookup or {}).get("key")
+            if key is None:
+                return
+        self._ids.pop(key, None)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __getitem__(self, tokens):
+        with self._lock:
+            self.stats["lookups"] += 1
+            # What the model still holds from its previous prompt needs no state at all
+            best, best_length, source = None, _longest_prefix(self.llm.input_ids, tokens), "evaluated"
+            try:
+                state = self.ram[tokens]
+                length = _longest_prefix(state.input_ids, tokens)
+                if length > best_length:
+                    best, best_length, source = state, length, "ram"
+            except KeyError:
+                pass
+            key = self._prefix_key
+            if key is not None:
+                ids = self._stored_ids(key)
+                if ids is not None and _longest_prefix(ids, tokens) > best_length:
+                    state = self._load(key)
+                    if state is not None:
+                        best, best_length, source = state, _longest_prefix(ids, tokens), "disk"
+            self.last_lookup = {"prompt_tokens": len(tokens), "reused_tokens": best_length, "source": source,
+                                "key": key if source == "disk" else None}
+            self.stats["prompt_tokens"] += len(tokens)
+            self.stats["reused_tokens"] += best_length
+            if source in ("ram", "disk"):
+                self.stats[f"{source}_hits"] += 1
+            if best is None:
+                raise KeyError(tokens)
+            return best
+
+    def __contains__(self, tokens):
+        key = self._prefix_key
+        return tokens in self.ram or (key is not None and self._stored_ids(key) is not None)
+
+    def __setitem__(self, tokens, state):
+        with self._lock:
+            self.ram[tokens] = state
+            key = self._prefix_key
+            if key is not None and self._stored_ids(key) is None:
+                self._store(key, state)
+
+    def report(self):
+        """Lookups, hits per layer, disk activity, and the share of prompt tokens that were not evaluated again."""
+        prompt_tokens = self.stats["prompt_tokens"]
+        return {**self.stats, "reuse_rate": self.stats["reused_tokens"] / prompt_tokens if prompt_tokens else 0.0}
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+
+import context_packing
+from model_registry import registry
+
+PASSAGE_TOKENS = 250          # size of one ranked passage
+DUPLICATE_COSINE = 0.92       # passages at least this similar count as the same text
+DUPLICATE_SIMHASH_BITS = 3    # ... as do passages whose SimHashes differ in at most this many bits
+HASHED_DIMENSIONS = 1024      # size of the fallback bag-of-words vectors
+
+_warned_fallback = False
+
+
+def split_passages(articles, passage_tokens=PASSAGE_TOKENS):
+    """Returns (article_index, passage) pairs for every passage of every article."""
+    return [(i, passage) for i, text in enumerate(articles) if text for passage, _ in context_packing.split_sentence_passages(text, passage_tokens)]
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _hashed_embeddings(texts):
+    """Normalized hashed bag-of-words vectors, used when the embedding model is unavailable."""
+    matrix = np.zeros((len(texts), HASHED_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in _tokens(text):
+            matrix[row, int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16) % HASHED_DIMENSIONS] += 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def embed(texts):
+    """
+    Embeds texts with the small CPU sentence-embedding model from the registry.
+    Rows are L2-normalized, so a dot product is the cosine similarity.
+    """
+    global _warned_fallback
+    try:
+        model = registry.get("embedder")
+        return np.asarray(model.encode(texts, batch_size=64, normalize_embeddings=True), dtype=np.float32)
+    except Exception as e:
+        if not _warned_fallback:
+            logging.warning(f"Embedding model unavailable ({e}). Using hashed bag-of-words vectors.")
+            _warned_fallback = True
+        return _hashed_embeddings(texts)
+
+
+def simhash(text):
+    """64-bit SimHash over word 3-shingles."""
+    words = _tokens(text)
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    values = np.frombuffer(digests, dtype=">u8").astype(np.uint64)
+    bits = (values[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    weights = (bits.astype(np.int64) * 2 - 1).sum(axis=0)
+    return sum(1 << int(i) for i in np.flatnonzero(weights > 0))
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, in O(n + k log k)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def score_passages(query_vector, texts):
+    """
+    Embeds passages and scores them against an embedded query.
+
+    Returns:
+        (vectors, scores): one normalized row and one cosine similarity per passage.
+    """
+    vectors = embed(texts)
+    return vectors, vectors @ query_vector
+
+
+def select_scored(texts, vectors, scores, token_budget):
+    """
+    Picks the highest-scoring passages that fit in `token_budget`, skipping
+    near-duplicates, from passages scored with score_passages(). Tokens are
+    counted with context_packing.get_counter(), the local model's tokenizer
+    when it is available.
+
+    Returns:
+        (passages, stats) as select_passages() does.
+    """
+    stats = {"passages": len(texts), "duplicates_removed": 0, "selected": 0,
+             "input_tokens": 0, "selected_tokens": 0, "tokens_saved": 0}
+    if not texts:
+        return [], stats
+
+    counter = context_packing.get_counter()
+    token_counts = np.array([counter.count(t) for t in texts])
+    stats["input_tokens"] = int(token_counts.sum())
+    hashes = [simhash(t) for t in texts]
+
+    kept, used = [], 0
+    for index in top_k(scores, len(texts)):
+        if used + token_counts[index] > token_budget:
+            continue
+        if kept:
+            if float(np.max(vectors[kept] @ vectors[index])) >= DUPLICATE_COSINE or \
+                    any(bin(hashes[index] ^ hashes[k]).count("1") <= DUPLICATE_SIMHASH_BITS for k in kept):
+                stats["duplicates_removed"] += 1
+                continue
+        kept.append(index)
+        used += int(token_counts[index])
+
+    kept.sort()  # back to article order
+    stats["selected"] = len(kept)
+    stats["selected_tokens"] = used
+    stats["tokens_saved"] = stats["input_tokens"] - used
+    return [texts[i] for i in kept], stats
+
+
+def select_passages(query, articles, token_budget, passage_tokens=PASSAGE_TOKENS):
+    """
+    Picks the passages most relevant to `query` that fit in `token_budget`,
+    skipping near-duplicates (syndicated or mirrored copies of the same text).
+
+    Args:
+        query: The research question.
+        articles: Article texts.
+        token_budget: Tokens the summarizer should receive at most.
+        passage_tokens: Size of the passages articles are split into.
+
+    Returns:
+        (passages, stats). Passages are in article order, so each source
+        still reads in sequence. Stats hold passage counts, duplicates
+        removed and estimated input/selected/saved tokens.
+    """
+    texts = [passage for _, passage in split_passages(articles, passage_tokens)]
+    if not texts:
+        return select_scored([], None, None, token_budget)
+    vectors = embed(texts + [query])
+    passage_vectors, query_vector = vectors[:-1], vectors[-1]
+    return select_scored(texts, passage_vectors, passage_vectors @ query_vector, token_budget)
@@ -0,0 +1,327 @@
+"""
+HTTP service for research jobs.
+
+Run from the repository root:
+    python server.py            (listens on $PORT, default 5000)
+
+Endpoints:
+    POST   /jobs              submit {"kind": "query", "query": "..."} or
+                              {"kind": "person", "person": {"name": "...", "known_for": "..."}}
+    GET    /jobs/{id}         status and result
+    GET    /jobs/{id}/stream  server-sent events: every event so far, then new ones as they happen
+    DELETE /jobs/{id}         cancel
+    GET    /health            queue depth, busy workers and shared resource stats
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+import browser_pool
+import extraction_executor
+import instrumentation
+import main
+import person_researcher
+import web_crawler
+import LLM
+from model_registry import registry
+
+# Jobs running at the same time
+WORKERS = int(os.getenv("SERVER_WORKERS", 4))
+# Jobs waiting for a worker; further submissions are refused with 429
+MAX_QUEUED_JOBS = int(os.getenv("SERVER_MAX_QUEUED_JOBS", 32))
+# Browser tabs shared by all jobs
+BROWSER_TABS = int(os.getenv("SERVER_BROWSER_TABS", 8))
+# Models loaded at startup so the first job does not pay for loading them
+WARM_MODELS = [name for name in os.getenv("SERVER_WARM_MODELS", "embedder").split(",") if name]
+# Per-job limits: requests may ask for less, never for more
+MAX_JOB_SECONDS = int(os.getenv("SERVER_MAX_JOB_SECONDS", 900))
+MAX_PAGES_PER_JOB = int(os.getenv("SERVER_MAX_PAGES_PER_JOB", 40))
+MAX_PERSON_MINUTES = int(os.getenv("SERVER_MAX_PERSON_MINUTES", 10))
+MAX_PERSON_PAGE_CONCURRENCY = 4
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = 1000
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobRequest(BaseModel):
+    kind: str = Field("query", pattern="^(query|person)$")
+    query: Optional[str] = None
+    person: Optional[dict] = None
+    timeout_seconds: int = Field(MAX_JOB_SECONDS, gt=0)
+    max_pages: int = Field(MAX_PAGES_PER_JOB, gt=0)
+    search_duration_minutes: float = Field(MAX_PERSON_MINUTES, gt=0)
+
+
+class Job:
+    def __init__(self, request):
+        self.id = uuid.uuid4().hex
+        self.kind = request.kind
+        self.request = request
+        self.status = QUEUED
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.trace = None
+        self._changed = asyncio.Event()
+
+    def add_event(self, event):
+        self.events.append(event)
+        # Wake every stream waiting on this job, then arm the event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout):
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.add_event({"type": "status", "status": status})
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "events": len(self.events),
+            "queued_seconds": (self.started_at or time.time()) - self.created_at,
+            "run_seconds": ((self.finished_at or time.time()) - self.started_at) if self.started_at else None,
+            # Per-stage timings so far; the full trace is under the trace directory once the job ends
+            "timings": self.trace.report() if self.trace else None,
+        }
+
+
+class JobManager:
+    """
+    Bounded job queue drained by a fixed set of workers.
+
+    All jobs share one warm browser pool, HTTP client and extraction process
+    pool, plus the process-wide model registry and LLM gateway, so a job
+    only pays for its own pages and prompts.
+    """
+
+    def __init__(self, workers=WORKERS, max_queued=MAX_QUEUED_JOBS, browser_tabs=BROWSER_TABS):
+        self.workers = workers
+        self.browser_tabs = browser_tabs
+        self._queue = asyncio.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._finished = []
+        self._worker_tasks = []
+        self.busy = 0
+        self.pool = None
+        self.http_client = None
+        self.executor = None
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+    async def start(self):
+        self.pool = browser_pool.BrowserPool(size=self.browser_tabs)
+        await self.pool.start()
+        self.http_client = web_crawler.create_http_client()
+        self.executor = extraction_executor.ExtractionExecutor()
+        await asyncio.to_thread(registry.warm_up, WARM_MODELS)
+        self._worker_tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+        logging.info(f"Job server started with {self.workers} workers and {self.browser_tabs} browser tabs.")
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        await self.executor.close()
+        await self.http_client.aclose()
+        await self.pool.close()
+        LLM.gateway.close()
+
+    def submit(self, request):
+        """Queues a job. Returns None if the queue is full."""
+        job = Job(request)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return None
+        self._jobs[job.id] = job
+        self.stats["submitted"] += 1
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job):
+        if job.status in FINISHED:
+            return False
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued: the worker skips it when it comes up
+            self._finish(job, CANCELLED)
+        return True
+
+    def _finish(self, job, status, result=None, error=None):
+        job.finish(status, result, error)
+        self.stats[status] += 1
+        self._finished.append(job.id)
+        while len(self._finished) > MAX_FINISHED_JOBS:
+            self._jobs.pop(self._finished.pop(0), None)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job.status != QUEUED:
+                continue
+            self.busy += 1
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.add_event({"type": "status", "status": RUNNING})
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                result = await asyncio.wait_for(job.task, min(job.request.timeout_seconds, MAX_JOB_SECONDS))
+                self._finish(job, DONE, result)
+            except asyncio.TimeoutError:
+                self._finish(job, FAILED, error="Job exceeded its time limit.")
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # The worker itself is being stopped: the server is shutting down
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                logging.exception(f"Job {job.id} failed")
+                self._finish(job, FAILED, error=str(e))
+            finally:
+                job.task = None
+                self.busy -= 1
+
+    async def _run(self, job):
+        with instrumentation.run(f"job.{job.kind}", job_id=job.id) as trace:
+            job.trace = trace
+            return await self._run_job(job)
+
+    async def _run_job(self, job):
+        request = job.request
+        if job.kind == "person":
+            profile = await person_researcher.research_person(
+                request.person or {"name": request.query},
+                search_duration_minutes=min(request.search_duration_minutes, MAX_PERSON_MINUTES),
+                page_concurrency=MAX_PERSON_PAGE_CONCURRENCY,
+                pool=self.pool, http_client=self.http_client, executor=self.executor,
+            )
+            job.add_event({"type": "answer", "profile": profile})
+            return profile
+        answer = None
+        async for event in main.research_query_stream(
+            request.query,
+            pool=self.pool, http_client=self.http_client, executor=self.executor,
+            max_pages=min(request.max_pages, MAX_PAGES_PER_JOB),
+        ):
+            job.add_event(event)
+            if event["type"] == "error":
+                raise RuntimeError(event["text"])
+            if event["type"] == "answer":
+                answer = event["text"]
+        return answer
+
+    def report(self):
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            **self.stats,
+            "browser_pool": self.pool.stats if self.pool else None,
+            "llm_gateway": LLM.gateway.stats,
+        }
+
+
+manager = JobManager()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await manager.start()
+    try:
+        yield
+    finally:
+        await manager.close()
+
+
+app = FastAPI(title="Deep research", lifespan=lifespan)
+
+
+def _job_or_404(job_id):
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    if request.kind == "query" and not request.query:
+        raise HTTPException(status_code=422, detail="'query' is required.")
+    if request.kind == "person" and not (request.person or {}).get("name") and not request.query:
+        raise HTTPException(status_code=422, detail="'person.name' is required.")
+    job = manager.submit(request)
+    if job is None:
+        # Backpressure: tell the client to come back rather than queueing without bound
+        raise HTTPException(status_code=429, detail="Job queue is full.", headers={"Retry-After": "5"})
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _job_or_404(job_id).summary()
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = _job_or_404(job_id)
+    return {"job_id": job.id, "cancelled": manager.cancel(job), "status": job.status}
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    job = _job_or_404(job_id)
+
+    async def events():
+        for index in itertools.count():
+            while index >= len(job.events):
+                if job.status in FINISHED:
+                    return
+                await job.wait_for_change(timeout=15)
+                if index >= len(job.events):
+                    yield ": keep-alive\n\n"
+            yield f"data: {json.dumps(job.events[index], default=str)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/health")
+async def health():
+    return manager.report()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
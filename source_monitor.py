@@ -0,0 +1,473 @@
+"""
+Ingests articles from many news sources at once, for monitoring them on a schedule.
+
+Run from the repository root:
+    python source_monitor.py sources.txt --interval 900   # one source URL per line
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import logging
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import httpx
+import newspaper
+
+import browser_pool
+import corpus_index
+import crawl_scheduler
+import extraction_executor
+import instrumentation
+import pipeline
+import utils
+import web_crawler
+
+DEFAULT_MEMO_PATH = os.getenv("SOURCE_MEMO_PATH", os.path.join(".cache", "sources.sqlite3"))
+
+# New articles taken from one source per run, newest first
+DEFAULT_MAX_ARTICLES = int(os.getenv("SOURCE_MAX_ARTICLES", 20))
+# Sources discovered at the same time
+DISCOVERY_CONCURRENCY = int(os.getenv("SOURCE_DISCOVERY_CONCURRENCY", 16))
+# Article fetches in flight (per-domain politeness comes from the CrawlScheduler)
+FETCH_CONCURRENCY = int(os.getenv("SOURCE_FETCH_CONCURRENCY", 16))
+# Pipeline workers waiting on the ExtractionExecutor (which does the work in its own processes)
+EXTRACT_WORKERS = 4
+# Browser tabs for pages the HTTP fast path cannot read
+BROWSER_TABS = 4
+# Seconds between the starts of two monitoring cycles
+DEFAULT_INTERVAL = float(os.getenv("SOURCE_MONITOR_INTERVAL", 900))
+
+# Feeds read per source, and sitemaps read per source (a sitemap index counts as one)
+MAX_FEEDS = 3
+MAX_SITEMAPS = 5
+# Feed and sitemap documents larger than this are skipped
+MAX_DOCUMENT_BYTES = 20 * 1024 * 1024
+# A failed article is retried in later runs until it has failed this many times
+MAX_ATTEMPTS = 3
+
+FEED_TYPES = ("application/rss+xml", "application/atom+xml", "application/rdf+xml")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    url_key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    source TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    method TEXT,
+    discovered INTEGER NOT NULL,
+    new INTEGER NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+class ArticleMemo:
+    """
+    Remembers which articles were already ingested, across runs, so each
+    monitoring cycle only fetches what is new. Articles that failed are
+    retried until they failed MAX_ATTEMPTS times. Also records, per source,
+    how its articles were last discovered.
+
+    Safe to share between the threads of one process.
+    """
+
+    def __init__(self, path=DEFAULT_MEMO_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def unseen(self, urls):
+        """The URLs still to ingest, in order and without duplicates."""
+        keyed = {}
+        for url in urls:
+            keyed.setdefault(utils.normalize_url(url), url)
+        done = set()
+        keys = list(keyed)
+        with self._lock:
+            for start in range(0, len(keys), 900):
+                chunk = keys[start:start + 900]
+                done.update(row[0] for row in self._db.execute(
+                    f"SELECT url_key FROM articles WHERE (state = 'ok' OR attempts >= ?) AND url_key IN ({','.join('?' * len(chunk))})",
+                    [MAX_ATTEMPTS, *chunk],
+                ))
+        return [url for key, url in keyed.items() if key not in done]
+
+    def mark(self, url, source, ok):
+        """Records an ingested article, or one more failed attempt at it."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO articles (url_key, url, source, state, attempts, updated_at) VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (url_key) DO UPDATE SET state = excluded.state, attempts = attempts + 1, updated_at = excluded.updated_at",
+                (utils.normalize_url(url), url, source, "ok" if ok else "failed", time.time()),
+            )
+
+    def record_source(self, source, method, discovered, new):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sources (source, method, discovered, new, checked_at) VALUES (?, ?, ?, ?, ?)",
+                (source, method, discovered, new, time.time()),
+            )
+
+    def report(self):
+        """Articles ingested and given up on, and sources by discovery method."""
+        with self._lock:
+            ingested = self._db.execute("SELECT COUNT(*) FROM articles WHERE state = 'ok'").fetchone()[0]
+            failed = self._db.execute("SELECT COUNT(*) FROM articles WHERE state = 'failed' AND attempts >= ?", (MAX_ATTEMPTS,)).fetchone()[0]
+            methods = dict(self._db.execute("SELECT COALESCE(method, 'none'), COUNT(*) FROM sources GROUP BY method").fetchall())
+        return {"ingested": ingested, "given_up": failed, "sources_by_method": methods}
+
+
+_default_memo = None
+
+
+def get_default_memo():
+    """The process-wide article memo, created on first use at SOURCE_MEMO_PATH."""
+    global _default_memo
+    if _default_memo is None:
+        _default_memo = ArticleMemo()
+    return _default_memo
+
+
+# Discovery
+
+class _FeedLinkParser(HTMLParser):
+    """Collects the feeds a page advertises with <link rel="alternate" type="application/rss+xml">."""
+
+    def __init__(self):
+        super().__init__()
+        self.feeds = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "link":
+            return
+        attrs = dict(attrs)
+        rel = (attrs.get("rel") or "").lower().split()
+        if "alternate" in rel and (attrs.get("type") or "").lower() in FEED_TYPES and attrs.get("href"):
+            self.feeds.append(attrs["href"])
+
+
+def _name(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _child_text(element, *names):
+    for child in element:
+        if _name(child) in names and child.text and child.text.strip():
+            return child.text.strip()
+    return None
+
+
+def _parse_xml(body):
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    return ElementTree.fromstring(body)
+
+
+def parse_feed(body):
+    """Article URLs of an RSS or Atom feed, in feed order (usually newest first)."""
+    urls = []
+    for element in _parse_xml(body).iter():
+        name = _name(element)
+        if name == "item":
+            link = _child_text(element, "link")
+            if link is None:
+                guid = next((child for child in element if _name(child) == "guid"), None)
+                if guid is not None and guid.get("isPermaLink", "true") == "true" and guid.text:
+                    link = guid.text.strip()
+            if link:
+                urls.append(link)
+        elif name == "entry":
+            links = [child for child in element if _name(child) == "link" and child.get("href")]
+            preferred = [link for link in links if link.get("rel", "alternate") == "alternate"] or links
+            if preferred:
+                urls.append(preferred[0].get("href"))
+    return urls
+
+
+def parse_sitemap(body):
+    """
+    Returns (pages, sitemaps): the page URLs of a sitemap and the child
+    sitemaps of a sitemap index, each as (url, lastmod) newest first.
+    """
+    pages, sitemaps = [], []
+    root = _parse_xml(body)
+    for element in root.iter():
+        name = _name(element)
+        if name not in ("url", "sitemap"):
+            continue
+        loc = _child_text(element, "loc")
+        if not loc:
+            continue
+        # News sitemaps carry the publication date, regular ones lastmod
+        lastmod = _child_text(element, "lastmod") or next(
+            (child.text.strip() for child in element.iter() if _name(child) == "publication_date" and child.text), ""
+        )
+        (pages if name == "url" else sitemaps).append((loc, lastmod))
+    for entries in (pages, sitemaps):
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+    return pages, sitemaps
+
+
+async def _get(http_client, url):
+    """GETs a discovery document; returns the response, or None on any failure."""
+    try:
+        response = await http_client.get(url)
+    except httpx.HTTPError as e:
+        logging.info(f"Discovery request failed for {url}: {e}")
+        return None
+    if response.status_code != 200 or len(response.content) > MAX_DOCUMENT_BYTES:
+        return None
+    return response
+
+
+async def _read_feeds(http_client, feed_urls):
+    urls = []
+    for response in await asyncio.gather(*(_get(http_client, url) for url in feed_urls)):
+        if response is None:
+            continue
+        try:
+            urls += [urljoin(str(response.url), link) for link in parse_feed(response.content)]
+        except ElementTree.ParseError as e:
+            logging.info(f"Unreadable feed {response.url}: {e}")
+    return urls
+
+
+async def _read_sitemaps(http_client, sitemap_urls):
+    pages = []
+    queue = list(sitemap_urls)
+    for _ in range(MAX_SITEMAPS):
+        if not queue:
+            break
+        response = await _get(http_client, queue.pop(0))
+        if response is None:
+            continue
+        try:
+            found, children = parse_sitemap(response.content)
+        except (ElementTree.ParseError, OSError) as e:
+            logging.info(f"Unreadable sitemap {response.url}: {e}")
+            continue
+        pages += found
+        # The newest child sitemaps first: they hold the latest articles
+        queue = [url for url, _ in children] + queue
+    pages.sort(key=lambda entry: entry[1], reverse=True)
+    return [url for url, _ in pages]
+
+
+async def discover_articles(source_url, http_client):
+    """
+    Finds a source's article URLs, newest first: from the RSS or Atom feeds
+    its home page advertises, else from the sitemaps listed in its robots.txt
+    (or /sitemap.xml), else from newspaper's own link discovery.
+
+    Returns:
+        (method, urls): "feed", "sitemap" or "newspaper", and the URLs.
+    """
+    home = await _get(http_client, source_url)
+    if home is not None:
+        parser = _FeedLinkParser()
+        parser.feed(home.text)
+        feeds = list(dict.fromkeys(urljoin(str(home.url), href) for href in parser.feeds))[:MAX_FEEDS]
+        urls = await _read_feeds(http_client, feeds) if feeds else []
+        if urls:
+            return "feed", list(dict.fromkeys(urls))
+
+    robots = await _get(http_client, urljoin(source_url, "/robots.txt"))
+    sitemaps = [
+        line.split(":", 1)[1].strip() for line in (robots.text.splitlines() if robots is not None else [])
+        if line.lower().startswith("sitemap:")
+    ] or [urljoin(source_url, "/sitemap.xml")]
+    urls = await _read_sitemaps(http_client, sitemaps)
+    if urls:
+        return "sitemap", list(dict.fromkeys(urls))
+
+    source = await asyncio.to_thread(newspaper.build, source_url, memoize_articles=False)
+    return "newspaper", [article.url for article in source.articles]
+
+
+# Ingestion
+
+async def ingest_sources(source_urls, max_articles_per_source=DEFAULT_MAX_ARTICLES, pool=None, http_client=None, cache=None, executor=None,
+                         scheduler=None, memo=None, index=None, stats=None, headless=True):
+    """
+    Discovers, fetches and extracts the new articles of many sources at once.
+
+    Runs discover -> fetch -> extract as a pipeline (see pipeline.Pipeline)
+    with a bounded pool of workers per stage: DISCOVERY_CONCURRENCY sources
+    are discovered at a time, FETCH_CONCURRENCY articles fetched (within the
+    scheduler's per-domain limits) and EXTRACT_WORKERS extracted, so
+    throughput stays flat however many sources are given.
+
+    Args:
+        source_urls: Home pages of the sources.
+        max_articles_per_source: New articles taken from each source, newest first.
+        pool, http_client, executor: Shared BrowserPool, httpx client and
+            ExtractionExecutor. Each one not given is created for this run.
+        cache: Optional PageCache for the fetched pages.
+        scheduler: CrawlScheduler for the fetches (by default FETCH_CONCURRENCY
+            at a time, two per domain, one request per domain per second).
+        memo: ArticleMemo; articles it has seen are skipped, and every
+            article is recorded in it. Without one, every article found is taken.
+        index: Optional corpus_index.CorpusIndex every extracted article is added to.
+        stats: Optional dict filled with the run's counters and pipeline report.
+        headless: Whether a browser pool created here runs headless.
+
+    Yields:
+        Every extracted article (extract_article_content_with_newspaper's
+        dict plus "url" and "source"), as soon as it is extracted.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(sources=0, discovery_errors=0, discovered=0, new=0, fetch_errors=0, empty=0, articles=0)
+    if scheduler is None:
+        scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=FETCH_CONCURRENCY)
+    started = time.perf_counter()
+
+    async def discover(source):
+        with instrumentation.span("discover", source=source) as span:
+            stats["sources"] += 1
+            try:
+                method, urls = await discover_articles(source, http_client)
+            except Exception as e:
+                logging.error(f"Error discovering articles of {source}: {e}")
+                stats["discovery_errors"] += 1
+                method, urls = None, []
+            new = await asyncio.to_thread(memo.unseen, urls) if memo is not None else list(dict.fromkeys(urls))
+            new = new[:max_articles_per_source]
+            span.set(method=method, discovered=len(urls), new=len(new))
+        stats["discovered"] += len(urls)
+        stats["new"] += len(new)
+        if memo is not None:
+            await asyncio.to_thread(memo.record_source, source, method, len(urls), len(new))
+        for url in new:
+            yield source, url
+
+    async def fetch_article(url):
+        return await web_crawler.fetch_page(url, pool=pool, http_client=http_client, cache=cache, executor=executor)
+
+    async def fetch(item):
+        source, url = item
+        return source, await scheduler.run(url, fetch_article)
+
+    async def extract(item):
+        source, crawled = item
+        article = None
+        if crawled.error is not None:
+            logging.error(f"Error crawling {crawled.url}: {crawled.error}")
+            stats["fetch_errors"] += 1
+        elif crawled.value:
+            try:
+                article = await web_crawler.extract_article_content_with_newspaper(crawled.value, crawled.url, cache, executor)
+            except Exception as e:
+                logging.error(f"Error extracting {crawled.url}: {e}")
+        ok = bool(article and article.get("text"))
+        if memo is not None:
+            await asyncio.to_thread(memo.mark, crawled.url, source, ok)
+        if not ok:
+            stats["empty"] += crawled.error is None
+            return None
+        if index is not None:
+            try:
+                await asyncio.to_thread(index.add_article, crawled.url, article)
+            except Exception as e:
+                logging.error(f"Error indexing {crawled.url}: {e}")
+        return {**article, "url": crawled.url, "source": source}
+
+    stages = pipeline.Pipeline([
+        pipeline.Stage("discover", discover, workers=DISCOVERY_CONCURRENCY),
+        pipeline.Stage("fetch", fetch, workers=FETCH_CONCURRENCY),
+        pipeline.Stage("extract", extract, workers=EXTRACT_WORKERS),
+    ])
+    async with contextlib.AsyncExitStack() as resources:
+        if pool is None:
+            pool = await resources.enter_async_context(browser_pool.BrowserPool(size=BROWSER_TABS, headless=headless))
+        if http_client is None:
+            http_client = await resources.enter_async_context(web_crawler.create_http_client())
+        if executor is None:
+            executor = await resources.enter_async_context(extraction_executor.ExtractionExecutor())
+        try:
+            with instrumentation.span("ingest_sources", sources=len(source_urls)) as span:
+                async with contextlib.aclosing(stages.run(dict.fromkeys(source_urls))) as articles:
+                    async for article in articles:
+                        stats["articles"] += 1
+                        yield article
+                span.set(articles=stats["articles"])
+        finally:
+            stats["seconds"] = time.perf_counter() - started
+            stats["articles_per_minute"] = stats["articles"] / stats["seconds"] * 60 if stats["seconds"] else 0.0
+            stats["pipeline"] = stages.report()
+
+
+async def monitor_sources(source_urls, interval=DEFAULT_INTERVAL, cycles=None, max_articles_per_source=DEFAULT_MAX_ARTICLES, memo=None, index=None,
+                          headless=True):
+    """
+    Ingests the new articles of every source each `interval` seconds, into
+    the local corpus index. The browser pool, HTTP client and extraction
+    processes stay up between cycles.
+
+    Args:
+        source_urls: Home pages of the sources.
+        interval: Seconds between the starts of two cycles; a cycle that runs
+            longer is followed by the next one straight away.
+        cycles: Stop after this many cycles (None: run until cancelled).
+        memo, index: ArticleMemo and CorpusIndex (the defaults if not given).
+
+    Returns:
+        The stats of the last cycle.
+    """
+    memo = memo or get_default_memo()
+    index = index or corpus_index.get_default_index()
+    stats = {}
+    cycle = 0
+    async with contextlib.AsyncExitStack() as resources:
+        pool = await resources.enter_async_context(browser_pool.BrowserPool(size=BROWSER_TABS, headless=headless))
+        http_client = await resources.enter_async_context(web_crawler.create_http_client(max_connections=FETCH_CONCURRENCY + DISCOVERY_CONCURRENCY))
+        executor = await resources.enter_async_context(extraction_executor.ExtractionExecutor())
+        scheduler = crawl_scheduler.CrawlScheduler(max_concurrency=FETCH_CONCURRENCY)
+        while cycles is None or cycle < cycles:
+            cycle += 1
+            started = time.monotonic()
+            stats = {}
+            with instrumentation.run("monitor_sources", cycle=cycle, sources=len(source_urls)):
+                async with contextlib.aclosing(ingest_sources(
+                    source_urls, max_articles_per_source, pool, http_client, None, executor, scheduler, memo, index, stats
+                )) as articles:
+                    async for _ in articles:
+                        pass
+            logging.info(
+                f"Monitoring cycle {cycle}: {stats['articles']} new articles from {stats['sources']} sources "
+                f"in {stats['seconds']:.1f}s ({stats['articles_per_minute']:.1f}/min): {stats}"
+            )
+            logging.info(f"Article memo: {memo.report()}")
+            if cycles is not None and cycle >= cycles:
+                break
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+    return stats
+
+
+if __name__ == "__main__":
+    instrumentation.configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("sources", help="File with one source URL per line.")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument("--cycles", type=int, default=None)
+    parser.add_argument("--max-articles", type=int, default=DEFAULT_MAX_ARTICLES, help="New articles per source and cycle.")
+    args = parser.parse_args()
+    with open(args.sources) as f:
+        sources = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    asyncio.run(monitor_sources(sources, args.interval, args.cycles, args.max_articles))
@@ -0,0 +1,382 @@
+import json
+import logging
+import re
+from collections import namedtuple
+
+from llm_gateway import PRIORITY_NORMAL
+
+# Extra LLM calls allowed to fix a response that does not parse or validate
+MAX_REPAIRS = 1
+
+# data: the parsed, validated JSON; text: the raw response it came from;
+# backend: "api" or "local"; repairs: follow-up calls that were needed
+StructuredResult = namedtuple("StructuredResult", ["data", "text", "backend", "repairs"])
+
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON|javascript)?[ \t]*\n?(.*?)(?:```|\Z)", re.S)
+_WORD = re.compile(r"[A-Za-z_]+")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_MAX_START_ATTEMPTS = 8
+
+# Per call site: calls, parsed (first try), recovered (parsed only thanks to
+# the tolerant extractor, i.e. a retry avoided), repaired, repair_calls, failed
+STATS = {}
+
+
+class StructuredOutputError(ValueError):
+    """The model's response could not be turned into JSON matching the schema."""
+
+
+class _Scanner:
+    """
+    Incremental JSON structure scanner. Tracks open brackets and strings as
+    text is fed, so a streaming response is only scanned once.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = None      # index of the first '{' or '['
+        self.end = None        # index just past the matching close bracket
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.cut_points = []   # (index, depth): safe places to truncate a partial value
+
+    def feed(self, chunk):
+        offset = len(self.text)
+        self.text += chunk
+        if self.end is not None:
+            return
+        for i in range(offset, len(self.text)):
+            char = self.text[i]
+            if self.start is None:
+                if char in "{[":
+                    self.start = i
+                    self.stack.append(char)
+                    self.cut_points.append((i + 1, 1))
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.stack.append(char)
+                self.cut_points.append((i + 1, len(self.stack)))
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    return
+                self.cut_points.append((i + 1, len(self.stack)))
+            elif char == ",":
+                self.cut_points.append((i, len(self.stack)))
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def span(self):
+        if self.start is None:
+            return None
+        return self.text[self.start:self.end]
+
+
+def strip_fences(text):
+    """Returns the body of the first Markdown code fence, or the text itself if there is none."""
+    match = _FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def _repair(text):
+    """
+    Fixes the mistakes models commonly make in otherwise valid JSON:
+    Python literals (True/False/None), single-quoted strings and trailing commas.
+    """
+    out = []
+    i = 0
+    quote = None
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\" and i + 1 < len(text):
+                # \' is only an escape inside single quotes; JSON needs a bare '
+                out.append("'" if quote == "'" and text[i + 1] == "'" else text[i:i + 2])
+                i += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = None
+            elif char == '"' and quote == "'":
+                out.append('\\"')
+            else:
+                out.append(char)
+            i += 1
+            continue
+        if char in "\"'":
+            quote = char
+            out.append('"')
+            i += 1
+            continue
+        # Matched in place: slicing text[i:] would copy the rest of the text for every word
+        word = _WORD.match(text, i)
+        if word:
+            out.append(_PY_LITERALS.get(word.group(0), word.group(0)))
+            i = word.end()
+            continue
+        out.append(char)
+        i += 1
+    return _TRAILING_COMMA.sub(r"\1", "".join(out))
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_repair(text))
+
+
+def _close(scanner):
+    """Parses the longest prefix of an unfinished JSON value that can be closed off, or raises ValueError."""
+    text = scanner.text[scanner.start:]
+    stack = list(scanner.stack)
+    in_string = scanner.in_string
+    cut_points = list(scanner.cut_points)
+    while True:
+        base = text + ('"' if in_string else "")
+        closers = "".join(_CLOSERS[b] for b in reversed(stack))
+        for candidate in (base, base + "null", base.rstrip().rstrip(",:")):
+            try:
+                return _loads(candidate + closers)
+            except (json.JSONDecodeError, ValueError):
+                continue
+        # Drop the unfinished member and try again from the last safe cut point
+        while cut_points and cut_points[-1][0] - scanner.start >= len(text):
+            cut_points.pop()
+        if not cut_points:
+            raise ValueError("No parseable JSON prefix.")
+        index, _ = cut_points.pop()
+        text = text[:index - scanner.start]
+        rescan = _Scanner()
+        rescan.feed(text)
+        stack, in_string = rescan.stack, rescan.in_string
+
+
+def extract_json(text, partial=False):
+    """
+    Finds and parses the JSON value in an LLM response, tolerating Markdown
+    fences, surrounding prose, Python literals, single quotes and trailing commas.
+
+    Args:
+        text: The raw response.
+        partial: Also accept a truncated value, closing open strings and brackets.
+
+    Returns:
+        The parsed value.
+
+    Raises:
+        StructuredOutputError: If no JSON value can be recovered.
+    """
+    for candidate in dict.fromkeys((strip_fences(text), text)):
+        offset = 0
+        # Prose before the JSON may contain stray brackets; try the next opening one
+        for _ in range(_MAX_START_ATTEMPTS):
+            scanner = _Scanner()
+            scanner.feed(candidate[offset:])
+            if scanner.start is None:
+                break
+            try:
+                if scanner.complete:
+                    return _loads(scanner.span())
+                if partial:
+                    return _close(scanner)
+            except ValueError:
+                pass
+            offset += scanner.start + 1
+    raise StructuredOutputError(f"No JSON found in response: {text[:200]!r}")
+
+
+class JSONStreamParser:
+    """
+    Parses a JSON response as it streams in.
+
+    Usage:
+        parser = JSONStreamParser()
+        async for chunk in gateway.stream(prompt):
+            partial = parser.feed(chunk)   # best-effort value so far, or None
+        data = parser.result()
+    """
+
+    def __init__(self):
+        self._scanner = _Scanner()
+
+    def feed(self, chunk):
+        """Adds a chunk and returns the value parsed so far (None if nothing is parseable yet)."""
+        self._scanner.feed(chunk)
+        if self._scanner.start is None:
+            return None
+        try:
+            return _loads(self._scanner.span()) if self._scanner.complete else _close(self._scanner)
+        except ValueError:
+            return None
+
+    @property
+    def complete(self):
+        return self._scanner.complete
+
+    def result(self):
+        """Parses the full response, raising StructuredOutputError if it is not valid JSON."""
+        return extract_json(self._scanner.text)
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def validate(data, schema, path="$"):
+    """
+    Checks `data` against a JSON Schema subset (type, properties, required,
+    items, enum).
+
+    Returns:
+        A list of error messages, empty if the data is valid.
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        matches = any(
+            isinstance(data, _TYPES[t]) and not (t in ("number", "integer") and isinstance(data, bool))
+            for t in types
+        )
+        if not matches:
+            return [f"{path}: expected {' or '.join(types)}, got {type(data).__name__}"]
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path}: {data!r} is not one of {schema['enum']}")
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing required key '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in data and data[key] is not None:
+                errors.extend(validate(data[key], subschema, f"{path}.{key}"))
+    if isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def _site_stats(call_site):
+    return STATS.setdefault(call_site, {"calls": 0, "parsed": 0, "recovered": 0, "repaired": 0, "repair_calls": 0, "failed": 0})
+
+
+def _repair_prompt(prompt, response, problem):
+    return (
+        f"{prompt}\n\n"
+        f"Your previous response could not be used: {problem}\n"
+        f"Previous response:\n{response[:2000]}\n\n"
+        f"Respond again with only the corrected JSON object, no explanations and no code fences."
+    )
+
+
+def _parse(text, schema):
+    """Returns (data, strict) where strict is False if only the tolerant extractor could parse it."""
+    try:
+        data, strict = json.loads(text), True
+    except json.JSONDecodeError:
+        data, strict = extract_json(text), False
+    errors = validate(data, schema)
+    if errors:
+        raise StructuredOutputError("; ".join(errors[:5]))
+    return data, strict
+
+
+async def complete_json(gateway, prompt, schema, priority=PRIORITY_NORMAL, call_site="default", max_repairs=MAX_REPAIRS, **kwargs):
+    """
+    Asks the LLM for JSON matching `schema` and returns it parsed and validated.
+
+    The schema is passed to the gateway so backends with native JSON output
+    (Gemini response schemas, llama_cpp grammar-constrained decoding) can
+    enforce it. Responses are parsed tolerantly; if one still does not parse
+    or validate, the model is asked to correct it, at most `max_repairs` times.
+    Only a valid answer is stored in the response cache (under `prompt`), and
+    a cached answer that no longer validates is ignored.
+
+    Args:
+        gateway: The LLMGateway to call.
+        prompt: The prompt, which should describe the expected JSON.
+        schema: JSON Schema of the expected value.
+        priority: Gateway priority.
+        call_site: Name the parse statistics are recorded under.
+        max_repairs: Follow-up calls allowed to fix an invalid response.
+        **kwargs: Passed on to gateway.complete().
+
+    Returns:
+        StructuredResult.
+
+    Raises:
+        StructuredOutputError: If no valid response was obtained.
+    """
+    stats = _site_stats(call_site)
+    stats["calls"] += 1
+    current_prompt, attempt, use_cache = prompt, 0, True
+    while True:
+        # Only a validated answer is stored, so the cache never replays one that needs repairing
+        result = await gateway.complete(
+            current_prompt, priority=priority, json_schema=schema, call_site=call_site, use_cache=use_cache, store=False, **kwargs
+        )
+        try:
+            data, strict = _parse(result.text, schema)
+        except StructuredOutputError as e:
+            if result.cached:
+                # Stored before the schema or prompt changed: ask the model instead
+                logging.warning(f"Cached JSON at '{call_site}' is no longer valid ({e}). Asking the LLM again.")
+                use_cache = False
+                continue
+            logging.warning(f"Invalid JSON from the LLM at '{call_site}' (attempt {attempt + 1}): {e}")
+            if attempt == max_repairs:
+                break
+            # Repair prompts embed the bad answer, so they would never be asked twice: skip the cache
+            attempt += 1
+            stats["repair_calls"] += 1
+            current_prompt, use_cache = _repair_prompt(prompt, result.text, e), False
+            continue
+        if attempt:
+            stats["repaired"] += 1
+        elif strict:
+            stats["parsed"] += 1
+        else:
+            stats["recovered"] += 1
+        # Stored under the original prompt, so a repaired answer saves the repair next time too
+        await gateway.remember(prompt, result, max_tokens=kwargs.get("max_tokens"), json_schema=schema, call_site=call_site)
+        return StructuredResult(data, result.text, result.backend, attempt)
+    stats["failed"] += 1
+    raise StructuredOutputError(f"No valid JSON from the LLM at '{call_site}' after {max_repairs} repairs.")
+
+
+def report():
+    """Returns the per-call-site counters plus the overall success rate and retries avoided."""
+    totals = {key: sum(site[key] for site in STATS.values()) for key in ("calls", "parsed", "recovered", "repaired", "repair_calls", "failed")}
+    succeeded = totals["parsed"] + totals["recovered"] + totals["repaired"]
+    return {
+        "call_sites": {name: dict(site) for name, site in STATS.items()},
+        "success_rate": succeeded / totals["calls"] if totals["calls"] else None,
+        "first_try_rate": (totals["parsed"] + totals["recovered"]) / totals["calls"] if totals["calls"] else None,
+        # Responses that strict json.loads rejects would each have cost a retry
+        "retries_avoided": totals["recovered"],
+        **totals,
+    }
@@ -1,47 +1,47 @@
-import keyring
-from transformers import AutoTokenizer, PegasusForConditionalGeneration
-from LLM import llm
+from model_registry import registry
+import LLM
+from llm_gateway import PRIORITY_LOW, PRIORITY_NORMAL
+import context_packing
+import asyncio
+import hashlib
 import logging
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
+import os
+import re
+import sqlite3
+import threading
+import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _summary_prompt(text: str) -> str:
+    return f"Please provide a concise summary of the following text:\n\n{text}"
 
-# def summarize_with_gemini(text: str) -> str:
-#     """
-#     Generate a summary for the given text using the Gemini API.
-#     Falls back to local LLM if Gemini is unavailable or fails.
-
-#     Args:
-#         text: The input text to be summarized.
-
-#     Returns:
-#         A summary string, or error message if both methods fail.
-#     """
-#     try:
-#         api_key = keyring.get_password("gemini_key", "user1")
-#         if not api_key:
-#             logging.warning("GEMINI_API_KEY not found in keyring. Falling back to local LLM.")
-#             return summarize_with_local_llm(text)
+async def summarize_with_gemini(text: str) -> str:
+    """
+    Generate a summary for the given text using the Gemini API.
+    Falls back to local LLM if Gemini is unavailable or fails.
 
-#         model = ChatGoogleGenerativeAI(model="gemini-pro", google_api_key=api_key)
+    Args:
+        text: The input text to be summarized.
 
-#         prompt = f"Please provide a concise summary of the following text:\n\n{text}"
-#         response = model.invoke([HumanMessage(content=prompt)])
+    Returns:
+        A summary string.
+    """
+    result = await LLM.gateway.complete(_summary_prompt(text), priority=PRIORITY_LOW, call_site="summarize")
+    logging.info(f"Used {result.backend} LLM for summarization.")
+    return result.text
 
-#         if response and response.content:
-#             logging.info("Using Gemini for summarization.")
-#             return response.content
-#         else:
-#             logging.warning("Gemini returned empty or invalid response. Falling back to local LLM.")
-#             return summarize_with_local_llm(text)
+async def summarize_with_gemini_stream(text: str):
+    """
+    Streaming version of summarize_with_gemini.
 
-#     except Exception:
-#         logging.exception("An error occurred during Gemini summarization. Falling back to local LLM.")
-#         return summarize_with_local_llm(text)
+    Args:
+        text: The input text to be summarized.
 
+    Yields:
+        Chunks of the summary as the model generates them.
+    """
+    async for chunk in LLM.gateway.stream(_summary_prompt(text), priority=PRIORITY_LOW, call_site="summarize"):
+        yield chunk
 
 
 def summarize_with_pegasus(text: str) -> str:
@@ -54,14 +54,13 @@ def summarize_with_pegasus(text: str) -> str:
     Returns:
         A string containing the summary of the text.
     """
-    model = PegasusForConditionalGeneration.from_pretrained("google/pegasus-xsum")
-    tokenizer = AutoTokenizer.from_pretrained("google/pegasus-xsum")
+    model, tokenizer = registry.get("pegasus") # loaded once, then shared
     inputs = tokenizer(text, max_length=1024, return_tensors="pt", truncation=True)
     summary_ids = model.generate(inputs["input_ids"])
     summary = tokenizer.batch_decode(summary_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)[0]
     return summary
 
-def summarize_with_local_llm(paragraph: str) -> str:
+async def summarize_with_local_llm(paragraph: str) -> str:
     """
     Summarizes a paragraph using the local LLM.
 
@@ -73,6 +72,203 @@ def summarize_with_local_llm(paragraph: str) -> str:
     """
     prompt = f"Summarize the following text concisely:\n\n{paragraph}\n\n compressed version:"
     
-    response = llm.create_chat_completion(messages=[{"role": "user", "content": prompt}])
+    result = await LLM.gateway.complete(prompt, backend="local", call_site="summarize_local")
     
-    return response["choices"][0]["message"]["content"].strip()
\ No newline at end of file
+    return result.text
+
+
+# Hierarchical (map-reduce) summarization. Tokens are counted with context_packing.
+CHUNK_TOKENS = 1500           # size of one article chunk summarized in the map step
+REDUCE_INPUT_TOKENS = 6000    # most text handed to the model in one reduce/final prompt
+CHUNK_SUMMARY_WORDS = 150     # target length of each partial summary
+FINAL_OUTPUT_TOKENS = 1024    # room left in the context window for the final answer
+MIN_INPUT_TOKENS = 512        # floor of the input budget, however small the context window
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", os.path.join(".cache", "chunk_summaries.sqlite3"))
+
+# Bump when the map prompt changes so old cached summaries are not reused
+MAP_PROMPT_VERSION = "1"
+
+class SummaryCache:
+    """
+    Chunk summaries keyed by the SHA-256 of the chunk text, stored in SQLite
+    so an article seen in an earlier run is never summarized again.
+    """
+
+    def __init__(self, path: str = SUMMARY_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+
+    @staticmethod
+    def key(chunk: str) -> str:
+        return hashlib.sha256((MAP_PROMPT_VERSION + "\0" + chunk).encode("utf-8")).hexdigest()
+
+    def get(self, chunk: str):
+        with self._lock:
+            row = self._db.execute("SELECT summary FROM summaries WHERE key = ?", (self.key(chunk),)).fetchone()
+        return row[0] if row else None
+
+    def put(self, chunk: str, summary: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", (self.key(chunk), summary))
+
+_summary_cache = None
+
+def get_summary_cache() -> SummaryCache:
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = SummaryCache()
+    return _summary_cache
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS, counter=None) -> list:
+    """
+    Splits text into chunks of up to `chunk_tokens` tokens, breaking between
+    sentences (a sentence longer than a chunk is cut between words).
+    """
+    return [chunk for chunk, _ in context_packing.split_sentence_passages(text, chunk_tokens, counter)]
+
+def _group_by_budget(texts: list, budget: int, counter) -> list:
+    """Packs consecutive texts into groups whose tokens stay within `budget` (at least two per group)."""
+    groups, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = counter.count(text)
+        if len(current) >= 2 and current_tokens + tokens > budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def _input_budget(query: str, counter) -> int:
+    """Tokens of notes one final prompt takes: REDUCE_INPUT_TOKENS, or less if the local model's context is smaller."""
+    budget = context_packing.prompt_budget(_final_prompt([], query), FINAL_OUTPUT_TOKENS, counter=counter)
+    return max(min(REDUCE_INPUT_TOKENS, budget), MIN_INPUT_TOKENS)
+
+def _map_prompt(chunk: str) -> str:
+    return (
+        f"Summarize the following text in at most {CHUNK_SUMMARY_WORDS} words. "
+        f"Keep concrete facts, names, numbers and dates.\n\n{chunk}"
+    )
+
+def _reduce_prompt(summaries: list, query: str) -> str:
+    joined = "\n\n".join(f"[{i + 1}] {s}" for i, s in enumerate(summaries))
+    focus = f" Focus on what is relevant to the question: {query}" if query else ""
+    return (
+        f"Merge the following partial summaries into one summary of at most {CHUNK_SUMMARY_WORDS * 2} words, "
+        f"removing repetition and keeping concrete facts.{focus}\n\n{joined}"
+    )
+
+def _final_prompt(summaries: list, query: str) -> str:
+    joined = "\n\n".join(summaries)
+    if query:
+        return f"Using the following notes from several sources, write a concise, well-structured answer to: {query}\n\n{joined}"
+    return _summary_prompt(joined)
+
+def _new_stats() -> dict:
+    return {"llm_calls": 0, "llm_cache_hits": 0, "chunks": 0, "cached_chunks": 0, "levels": 0,
+            "input_tokens": 0, "output_tokens": 0, "source_tokens": 0, "coverage": 0.0, "seconds": 0.0}
+
+async def _call(prompt: str, stats: dict, priority: int, call_site: str) -> str:
+    result = await LLM.gateway.complete(prompt, priority=priority, call_site=call_site)
+    if result.cached:
+        stats["llm_cache_hits"] += 1
+        return result.text
+    counter = context_packing.get_counter()
+    stats["llm_calls"] += 1
+    stats["input_tokens"] += counter.count(prompt)
+    stats["output_tokens"] += counter.count(result.text)
+    return result.text
+
+async def _summarize_chunk(chunk: str, cache: SummaryCache, stats: dict) -> str:
+    cached = await asyncio.to_thread(cache.get, chunk)
+    if cached is not None:
+        stats["cached_chunks"] += 1
+        return cached
+    summary = await _call(_map_prompt(chunk), stats, PRIORITY_NORMAL, "summarize_chunk")
+    await asyncio.to_thread(cache.put, chunk, summary)
+    return summary
+
+async def _reduce_to_final_inputs(articles: list, query: str, cache: SummaryCache, stats: dict) -> list:
+    """
+    Map-reduces the articles until what is left fits in one final prompt.
+    Input that already fits is passed through untouched; if the reduce steps
+    cannot shrink it enough, the most valuable passages that fit are packed.
+    """
+    counter = context_packing.get_counter()
+    budget = _input_budget(query, counter)
+    texts = [a.strip() for a in articles if a and a.strip()]
+    stats["source_tokens"] = sum(counter.count(t) for t in texts)
+    stats["coverage"] = 1.0 if texts else 0.0
+    if stats["source_tokens"] <= budget:
+        return texts
+
+    # Map: summarize every chunk of every article in parallel
+    chunks = [chunk for text in texts for chunk in chunk_text(text, min(CHUNK_TOKENS, budget), counter)]
+    stats["chunks"] = len(chunks)
+    partials = await asyncio.gather(*(_summarize_chunk(chunk, cache, stats) for chunk in chunks))
+    stats["levels"] = 1
+
+    # Reduce: merge groups that fit the prompt budget, level by level
+    while sum(counter.count(p) for p in partials) > budget and len(partials) > 1:
+        groups = _group_by_budget(list(partials), budget, counter)
+        partials = await asyncio.gather(*(
+            _call(_reduce_prompt(group, query), stats, PRIORITY_NORMAL, "summarize_reduce") if len(group) > 1 else asyncio.sleep(0, group[0])
+            for group in groups
+        ))
+        stats["levels"] += 1
+    if sum(counter.count(p) for p in partials) > budget:
+        packed, pack_stats = context_packing.pack(list(partials), budget, counter=counter)
+        stats["coverage"] = pack_stats["tokens"] / (pack_stats["tokens"] + pack_stats["tokens_dropped"]) if pack_stats["passages"] else 0.0
+        return [packed]
+    return list(partials)
+
+async def summarize_hierarchical(articles: list, query: str = "", cache: SummaryCache = None, stats: dict = None) -> str:
+    """
+    Summarizes many articles without truncating them.
+
+    Each article is split into chunks that are summarized in parallel (map);
+    the partial summaries are then merged in groups sized to the prompt
+    budget, level by level, until they fit one final prompt (reduce).
+    Chunk summaries are cached by content hash across runs.
+
+    Args:
+        articles: Article texts.
+        query: The research question the final answer should address.
+        cache: SummaryCache to use (defaults to the shared on-disk one).
+        stats: Optional dict filled with llm_calls, chunks, cached_chunks,
+            levels, input/output/source token estimates, coverage and seconds.
+
+    Returns:
+        The final summary.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(_new_stats())
+    start = time.perf_counter()
+    partials = await _reduce_to_final_inputs(articles, query, cache or get_summary_cache(), stats)
+    summary = await _call(_final_prompt(partials, query), stats, PRIORITY_LOW, "summarize_final")
+    stats["seconds"] = time.perf_counter() - start
+    return summary
+
+async def summarize_hierarchical_stream(articles: list, query: str = "", cache: SummaryCache = None, stats: dict = None):
+    """
+    Streaming version of summarize_hierarchical: the map and reduce steps run
+    as usual, then the final answer is yielded chunk by chunk.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(_new_stats())
+    start = time.perf_counter()
+    partials = await _reduce_to_final_inputs(articles, query, cache or get_summary_cache(), stats)
+    prompt = _final_prompt(partials, query)
+    pieces = []
+    async for chunk in LLM.gateway.stream(prompt, priority=PRIORITY_LOW, call_site="summarize_final"):
+        pieces.append(chunk)
+        yield chunk
+    counter = context_packing.get_counter()
+    stats["llm_calls"] += 1
+    stats["input_tokens"] += counter.count(prompt)
+    stats["output_tokens"] += counter.count("".join(pieces))
+    stats["seconds"] = time.perf_counter() - start
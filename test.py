@@ -1,5 +1,6 @@
 import os
 import logging
+import instrumentation
 from google import genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
@@ -9,7 +10,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+instrumentation.configure_logging()
 
 
 # Get API key from environment variables
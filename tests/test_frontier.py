@@ -0,0 +1,55 @@
+from frontier import Frontier
+
+
+def _frontier(tmp_path, **kwargs):
+    return Frontier("person:test", path=str(tmp_path / "frontier.sqlite3"), **kwargs)
+
+
+def test_in_progress_urls_are_requeued_on_reopen(tmp_path):
+    with _frontier(tmp_path) as frontier:
+        frontier.add("https://a.example/1", score=2.0)
+        frontier.add("https://b.example/2", score=1.0)
+        popped = frontier.pop()
+        assert popped.url == "https://a.example/1"
+        assert len(frontier) == 1
+    # Reopened without done(): the crash left it in progress
+    with _frontier(tmp_path) as frontier:
+        assert frontier.stats["requeued"] == 1
+        assert len(frontier) == 2
+        assert frontier.pop().url == "https://a.example/1"
+
+
+def test_release_puts_a_url_back_without_a_visit(tmp_path):
+    with _frontier(tmp_path) as frontier:
+        frontier.add("https://a.example/1", score=2.0)
+        frontier.add("https://a.example/2", score=1.9)
+        frontier.add("https://b.example/1", score=1.8)
+        first = frontier.pop()
+        frontier.release(first.url)
+        assert len(frontier) == 3
+        # The released visit no longer penalizes its domain
+        assert frontier.pop().url == first.url
+        # Releasing a URL that is not in progress changes nothing
+        frontier.done(first.url)
+        frontier.release(first.url)
+        assert frontier.report()["states"] == {"done": 1, "queued": 2}
+
+
+def test_save_state_marks_urls_finished_with_the_state(tmp_path):
+    with _frontier(tmp_path) as frontier:
+        for i in range(3):
+            frontier.add(f"https://a{i}.example/", score=3.0 - i)
+        items = [frontier.pop() for _ in range(3)]
+        frontier.save_state({"profile": {"name": "Test"}}, [(items[0].url, True), (items[1].url, False)])
+    with _frontier(tmp_path) as frontier:
+        assert frontier.load_state() == {"profile": {"name": "Test"}}
+        assert frontier.report()["states"] == {"done": 1, "failed": 1, "queued": 1}
+        assert frontier.pop().url == items[2].url
+
+
+def test_urls_are_deduplicated_by_normalized_form(tmp_path):
+    with _frontier(tmp_path) as frontier:
+        assert frontier.add("https://a.example/page?utm_source=x#top")
+        assert not frontier.add("https://A.example/page")
+        assert frontier.seen("https://a.example/page")
+        assert len(frontier) == 1
@@ -0,0 +1,25 @@
+import asyncio
+
+from google_search_api import _RateLimiter
+
+
+def test_quota_is_refused_once_used_up():
+    limiter = _RateLimiter(rate=0, daily_quota=2)
+    assert asyncio.run(limiter.acquire())
+    assert asyncio.run(limiter.acquire())
+    assert not asyncio.run(limiter.acquire())
+    assert limiter.quota_left() == 0
+
+
+def test_quota_carries_over_across_restarts(tmp_path):
+    path = str(tmp_path / "quota.sqlite3")
+    limiter = _RateLimiter(rate=0, daily_quota=3, path=path)
+    assert asyncio.run(limiter.acquire())
+    assert asyncio.run(limiter.acquire())
+    # A new process starts from the calls already made today
+    restarted = _RateLimiter(rate=0, daily_quota=3, path=path)
+    assert restarted.quota_left() == 1
+    assert asyncio.run(restarted.acquire())
+    assert not asyncio.run(restarted.acquire())
+    # Limiters sharing the file see each other's calls
+    assert limiter.quota_left() == 0
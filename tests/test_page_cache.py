@@ -0,0 +1,61 @@
+import os
+
+from page_cache import PageCache
+
+
+def _html(index, size=20000):
+    # Random bytes, so compression cannot shrink the pages to nothing
+    return f"<html>{index}{os.urandom(size).hex()}</html>"
+
+
+def test_put_and_get(tmp_path):
+    cache = PageCache(str(tmp_path), ttl_seconds=3600)
+    cache.put("https://example.com/a?utm_source=feed", "<html>a</html>", etag='"1"')
+    page = cache.get("https://example.com/a")
+    assert page.html == "<html>a</html>"
+    assert page.etag == '"1"'
+    assert page.fresh
+    assert cache.get("https://example.com/b") is None
+    cache.close()
+
+
+def test_identical_pages_share_one_blob(tmp_path):
+    cache = PageCache(str(tmp_path))
+    html = _html(0)
+    cache.put("https://example.com/a", html)
+    size = cache.total_bytes()
+    cache.put("https://mirror.example.com/a", html)
+    assert cache.total_bytes() == size
+    # Replacing the only reference to a blob no longer counts it
+    cache.put("https://example.com/a", "<html>new</html>")
+    cache.put("https://mirror.example.com/a", "<html>new</html>")
+    assert cache.total_bytes() < size
+    cache.close()
+
+
+def test_eviction_removes_least_recently_used_pages(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put("https://example.com/0", _html(0))
+    page_bytes = cache.total_bytes()
+    cache.max_bytes = int(page_bytes * 2.5)
+    cache.put("https://example.com/1", _html(1))
+    cache.get("https://example.com/0")
+    cache.put("https://example.com/2", _html(2))
+    assert cache.stats["evictions"] == 1
+    assert cache.get("https://example.com/1") is None
+    assert cache.get("https://example.com/0") is not None
+    assert cache.total_bytes() <= cache.max_bytes
+    cache.close()
+    # The size tracked in memory matches what a fresh scan finds
+    reopened = PageCache(str(tmp_path))
+    assert reopened.total_bytes() == cache.total_bytes()
+    reopened.close()
+
+
+def test_extraction_results_are_keyed_by_content(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put_extracted("<html>a</html>", "trafilatura", {"text": "A"})
+    assert cache.get_extracted("<html>a</html>", "trafilatura") == {"text": "A"}
+    assert cache.get_extracted("<html>a</html>", "newspaper") is None
+    assert cache.get_extracted("<html>b</html>", "trafilatura") is None
+    cache.close()
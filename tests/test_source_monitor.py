@@ -0,0 +1,25 @@
+from source_monitor import ArticleMemo, MAX_ATTEMPTS
+
+
+def test_failed_articles_are_retried_up_to_the_cap(tmp_path):
+    memo = ArticleMemo(str(tmp_path / "memo.sqlite3"))
+    url = "https://news.example/story"
+    for _ in range(MAX_ATTEMPTS - 1):
+        memo.mark(url, "https://news.example/", ok=False)
+        assert memo.unseen([url]) == [url]
+    memo.mark(url, "https://news.example/", ok=False)
+    assert memo.unseen([url]) == []
+    assert memo.report()["given_up"] == 1
+    memo.close()
+
+
+def test_ingested_articles_are_skipped_across_runs(tmp_path):
+    path = str(tmp_path / "memo.sqlite3")
+    memo = ArticleMemo(path)
+    memo.mark("https://news.example/a", "https://news.example/", ok=True)
+    memo.close()
+    memo = ArticleMemo(path)
+    urls = ["https://news.example/a?utm_source=rss", "https://news.example/b", "https://news.example/b#comments"]
+    assert memo.unseen(urls) == ["https://news.example/b"]
+    assert memo.report()["ingested"] == 1
+    memo.close()
@@ -0,0 +1,50 @@
+import pytest
+
+from structured_output import StructuredOutputError, extract_json, validate
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "age": {"type": "integer"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["name"],
+}
+
+
+def test_fenced_json_with_prose():
+    text = 'Here you go:\n```json\n{"name": "Ada", "tags": ["math"]}\n```\nAnything else?'
+    assert extract_json(text) == {"name": "Ada", "tags": ["math"]}
+
+
+def test_python_literals_single_quotes_and_trailing_commas():
+    assert extract_json("{'name': 'Ada', 'alive': False, 'spouse': None, 'tags': ['a', 'b',],}") == {
+        "name": "Ada", "alive": False, "spouse": None, "tags": ["a", "b"],
+    }
+
+
+def test_stray_brackets_in_prose_before_the_json():
+    assert extract_json('Notes [draft] follow: {"name": "Ada"}') == {"name": "Ada"}
+
+
+def test_truncated_json_needs_partial():
+    text = '{"name": "Ada", "tags": ["math", "poet'
+    with pytest.raises(StructuredOutputError):
+        extract_json(text)
+    assert extract_json(text, partial=True) == {"name": "Ada", "tags": ["math", "poet"]}
+
+
+def test_no_json_at_all():
+    with pytest.raises(StructuredOutputError):
+        extract_json("I could not find anything.")
+
+
+def test_validate():
+    assert validate({"name": "Ada", "age": 36, "tags": []}, SCHEMA) == []
+    assert validate({"age": True, "tags": ["a", 1]}, SCHEMA) == [
+        "$: missing required key 'name'",
+        "$.age: expected integer, got bool",
+        "$.tags[1]: expected string, got int",
+    ]
+    assert validate(["Ada"], SCHEMA) == ["$: expected object, got list"]
@@ -1,8 +1,11 @@
 import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text.split()) * 1.3) + 1
 
 def truncate_text_by_words(text, word_limit):
     words = text.split()
-    print(len(words))
     word_limit-=1
     if len(words) <= word_limit:
         return text #if text is alreay in light than return it
@@ -20,3 +23,24 @@ def truncate_text_by_words(text, word_limit):
         truncated_text = " ".join(truncated_words)  #if no sentese end.
 
     return truncated_text.strip()
+
+# query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref_src"}
+
+def normalize_url(url):
+    """
+    Returns a canonical form of a URL so the same page always maps to the same key.
+    Lowercases scheme and host, drops default ports, fragments and tracking
+    parameters (utm_*, fbclid, ...), and sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    ]
+    path = parts.path or "/"
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))